@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+# Make main.py importable when running benchmarks from the repo root or this directory
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from synthetic import generate_catalogue
+
+
+def percentile(values, pct):
+    """
+    Return the pct-th percentile of a list of numbers (nearest-rank).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def latency_summary(latencies):
+    """
+    Summarise a list of latencies in seconds as milliseconds.
+    """
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+def prepare_workdir():
+    """
+    Create a temporary working directory with an empty data/ folder and chdir into it,
+    so importing main creates its database there rather than in the repo.
+    """
+    workdir = tempfile.mkdtemp(prefix='redmane_bench_')
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.chdir(workdir)
+    return workdir
+
+
+def disable_response_cache(main):
+    """
+    Make the response cache keep nothing, so repeated requests measure the full request path.
+    Must be called before the app's lifespan starts.
+    """
+    main.CACHE_MAX_BYTES = 0
+
+
+def seed_project(database, patients=1000, samples_per_patient=4, files_per_sample=2, seed=0):
+    """
+    Fill an initialised database with one project, one dataset and linked patients,
+    samples, metadata and raw files.
+    """
+    conn = sqlite3.connect(database)
+    result = generate_catalogue(conn, patients=patients, samples_per_patient=samples_per_patient,
+                                files_per_sample=files_per_sample, seed=seed)
+    conn.close()
+    return result["project_ids"][0], result["dataset_ids"][0]
+
+
+@asynccontextmanager
+async def app_client(app):
+    """
+    An httpx client driving the app in-process, with the app's lifespan running.
+    """
+    import httpx
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            yield client
+
+
+async def timed_get(client, url):
+    start = time.perf_counter()
+    response = await client.get(url)
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    return elapsed, response
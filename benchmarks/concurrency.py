@@ -0,0 +1,77 @@
+"""
+Measure tail latency of small requests while large project-wide requests are in flight.
+
+Usage:
+python benchmarks/concurrency.py --patients 20000 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import app_client, disable_response_cache, latency_summary, prepare_workdir, seed_project, timed_get
+
+
+async def light_requests(client, url, duration, interval):
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        elapsed, _ = await timed_get(client, url)
+        latencies.append(elapsed)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def heavy_requests(client, url, stop):
+    latencies = []
+    while not stop.is_set():
+        elapsed, _ = await timed_get(client, url)
+        latencies.append(elapsed)
+    return latencies
+
+
+async def run(args):
+    prepare_workdir()
+    import main
+    if not args.cache:
+        disable_response_cache(main)
+
+    project_id, _ = seed_project(main.DATABASE, patients=args.patients, samples_per_patient=args.samples_per_patient)
+    light_url = '/projects/'
+    heavy_url = f'/samples/0?project_id={project_id}'
+
+    async with app_client(main.app) as client:
+        # Light requests on an idle server
+        idle = await light_requests(client, light_url, args.duration / 2, args.interval)
+
+        # Light requests while heavy requests keep running
+        stop = asyncio.Event()
+        heavy_tasks = [asyncio.create_task(heavy_requests(client, heavy_url, stop)) for _ in range(args.heavy)]
+        await asyncio.sleep(0.05)
+        loaded = await light_requests(client, light_url, args.duration, args.interval)
+        stop.set()
+        heavy = [latency for task in heavy_tasks for latency in await task]
+
+        pool_stats = (await client.get('/db_pool_stats/')).json()
+
+    report = {
+        "patients": args.patients,
+        "samples": args.patients * args.samples_per_patient,
+        "heavy_concurrency": args.heavy,
+        "light_idle": latency_summary(idle),
+        "light_under_load": latency_summary(loaded),
+        "heavy": latency_summary(heavy),
+        "db_pool": pool_stats,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Small-request tail latency while large requests are in flight.')
+    parser.add_argument('--patients', type=int, default=5000, help='Number of patients to seed')
+    parser.add_argument('--samples_per_patient', type=int, default=4, help='Samples seeded per patient')
+    parser.add_argument('--heavy', type=int, default=2, help='Concurrent heavy /samples/0 requests')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds to measure light requests under load')
+    parser.add_argument('--interval', type=float, default=0.005, help='Pause between light requests in seconds')
+    parser.add_argument('--cache', action='store_true', help='Leave the response cache enabled')
+    asyncio.run(run(parser.parse_args()))
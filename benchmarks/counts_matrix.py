@@ -0,0 +1,133 @@
+"""
+Time repeated reads of a counts matrix: re-parsing the TSV for every analysis against
+converting it once with counts_store.convert_counts and memory-mapping the store.
+
+Each analysis reads a few sample columns in full, then one gene's row across every sample.
+Each case runs in a fresh process so peak_rss_mb is its own; for the store it includes the
+mapped pages of the columns read, which the kernel can drop at any time. The store is opened through
+open_store, as the API does, so first_s includes mapping it and indexing its genes and
+repeat_s is an analysis of a matrix that is already open.
+
+Usage:
+python benchmarks/counts_matrix.py --genes 2000000 --samples 24
+python benchmarks/counts_matrix.py --tsv /data/project/counts.tsv --columns 4
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# Make the repo's modules importable when running from the repo root or this directory
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from counts_store import convert_counts, open_store
+from file_stats import COUNTS_BLOCK_SIZE, line_blocks
+
+
+def build_tsv(path, genes, samples, rng):
+    with open(path, 'w') as file:
+        file.write('GeneID\t' + '\t'.join(f'sample{s}' for s in range(samples)) + '\n')
+        for g in range(genes):
+            file.write(f'ENSG{g:011d}\t' + '\t'.join(str(rng.randrange(1000)) for _ in range(samples)) + '\n')
+
+
+def tsv_analysis(path, columns, gene):
+    # Column totals and one gene's row, by parsing the whole table as counts_stats does
+    header = None
+    totals = None
+    row = None
+    for block in line_blocks(path, COUNTS_BLOCK_SIZE):
+        if header is None:
+            first, _, block = block.partition(b'\n')
+            header = first.decode().split('\t')
+            indexes = [header.index(column) for column in columns]
+            totals = [0.0] * len(indexes)
+        cells = block.replace(b'\n', b'\t').split(b'\t')
+        cells.pop()
+        for n, index in enumerate(indexes):
+            totals[n] += sum(map(float, cells[index::len(header)]))
+        genes = cells[0::len(header)]
+        if row is None and gene.encode() in genes:
+            start = genes.index(gene.encode()) * len(header)
+            row = [float(value) for value in cells[start + 1:start + len(header)]]
+    return totals, row
+
+
+def store_analysis(store_dir, columns, gene):
+    store = open_store(store_dir)
+    totals = [sum(store.column(column)) for column in columns]
+    rows = store.gene_rows(gene)
+    row = [store.column(sample)[rows[0]] for sample in store.samples] if rows else None
+    return totals, row
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_case(analysis, source, columns, gene, repeat):
+    # Runs in its own process
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = analysis(source, columns, gene)
+        times.append(time.perf_counter() - started)
+    return times, result, peak_rss_mb()
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='redmane_counts_')
+    try:
+        path = args.tsv
+        if path is None:
+            path = os.path.join(workdir, 'counts.tsv')
+            build_tsv(path, args.genes, args.samples, random.Random(args.seed))
+        store_dir = os.path.join(workdir, 'store')
+
+        # Converted in a worker too, as a child process starts with its parent's peak RSS
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            index = pool.submit(convert_counts, path, store_dir).result()
+        report = {"tsv_mb": round(os.path.getsize(path) / 1e6, 1), "genes": index["rows"],
+                  "samples": len(index["samples"]), "convert_s": round(time.perf_counter() - started, 2)}
+
+        rng = random.Random(args.seed)
+        columns = rng.sample(index["samples"], min(args.columns, len(index["samples"])))
+        with open(os.path.join(store_dir, 'genes.txt')) as file:
+            gene = file.readline().strip()
+
+        expected = None
+        for name, analysis, source in [('store', store_analysis, store_dir), ('tsv', tsv_analysis, path)]:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                times, result, peak = pool.submit(run_case, analysis, source, columns, gene, args.repeat).result()
+            if expected is not None and result != expected:
+                raise SystemExit(f"{name}: results differ from the store")
+            expected = result
+            repeats = times[1:] or times
+            report[name] = {"first_s": round(times[0], 4), "repeat_s": round(sum(repeats) / len(repeats), 4),
+                            "peak_rss_mb": peak}
+        print(json.dumps(report, indent=2))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Re-parsing a counts TSV vs reading its columnar store.')
+    parser.add_argument('--tsv', help='Use this existing counts table instead of generating one')
+    parser.add_argument('--genes', type=int, default=500000, help='Rows of the generated table')
+    parser.add_argument('--samples', type=int, default=24, help='Sample columns of the generated table')
+    parser.add_argument('--columns', type=int, default=3, help='Sample columns each analysis totals')
+    parser.add_argument('--repeat', type=int, default=3, help='Times each analysis runs')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    run(parser.parse_args())
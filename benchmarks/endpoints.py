@@ -0,0 +1,414 @@
+"""
+Drive every endpoint in main.py in-process against a synthetic catalogue and write a JSON
+report of throughput, p50/p95/p99 latency and peak RSS per endpoint.
+
+Usage:
+python benchmarks/endpoints.py --patients 25000 --output report.json
+python benchmarks/endpoints.py --database data/synthetic.db --output report.json --baseline last_release.json
+
+Pass --baseline with an earlier report to fail when an endpoint's p95 latency or
+throughput regressed by more than --max_regression.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from common import REPO_ROOT, app_client, disable_response_cache, latency_summary, prepare_workdir
+from synthetic import generate_catalogue
+from counts_store import STORE_KEY, STORE_KEYS, STORE_MTIME_KEY, STORE_SIZE_KEY, convert_counts
+from checksums import CHECKSUM_KEYS
+from ingest import replace_raw_files_metadata
+
+
+def current_rss_bytes():
+    """
+    Return the resident set size of this process, or the peak so far where /proc is unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RssSampler:
+    """
+    Track the peak RSS seen between start() and stop() from a background thread.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self.peak = current_rss_bytes()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+        return self.peak
+
+
+def pick_ids(database, project_id):
+    # A patient and sample in the middle of the project, for the single-entity endpoints
+    conn = sqlite3.connect(database)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM patients WHERE project_id = ? ORDER BY id LIMIT 1 OFFSET "
+                   "(SELECT COUNT(*) / 2 FROM patients WHERE project_id = ?)", (project_id, project_id))
+    patient_id = cursor.fetchone()[0]
+    cursor.execute("SELECT id FROM samples WHERE patient_id = ? ORDER BY id LIMIT 1", (patient_id,))
+    sample_id = cursor.fetchone()[0]
+    conn.close()
+    return patient_id, sample_id
+
+
+def prepare_counts(database, dataset_id, genes, samples, seed):
+    # A counts table registered in the dataset and converted to a store, for /raw_file_counts.
+    # Returns its raw file id, a few gene IDs spread through it and its sample names.
+    rng = random.Random(seed)
+    path = os.path.abspath('data/bench_counts.tsv')
+    sample_names = [f'bench_s{n:04d}' for n in range(samples)]
+    with open(path, 'w') as file:
+        file.write('GeneID\t' + '\t'.join(sample_names) + '\n')
+        for g in range(genes):
+            file.write(f'ENSG{g:011d}\t' + '\t'.join(str(rng.randrange(5000)) for _ in range(samples)) + '\n')
+    store_dir = os.path.abspath('data/counts_store/bench')
+    convert_counts(path, store_dir)
+
+    conn = sqlite3.connect(database)
+    raw_file_id = conn.execute("INSERT INTO raw_files (dataset_id, path) VALUES (?, ?)", (dataset_id, path)).lastrowid
+    conn.commit()
+    stat = os.stat(path)
+    replace_raw_files_metadata(conn, STORE_KEYS, [(raw_file_id, {STORE_KEY: store_dir, STORE_SIZE_KEY: stat.st_size,
+                                                                 STORE_MTIME_KEY: stat.st_mtime_ns})])
+    conn.close()
+    return raw_file_id, [f'ENSG{g:011d}' for g in range(0, genes, max(1, genes // 10))], sample_names
+
+
+def prepare_scan_jobs(database, project_id, dataset_id, datasets, files):
+    # A directory of files named after the project's samples, datasets set up to scan it for
+    # POST /scan_jobs/ (one each, as a dataset has one unfinished scan at a time) and a history
+    # of finished jobs on dataset_id. Returns the directory, a finished job id and the datasets.
+    directory = os.path.abspath('data/bench_scan')
+    os.makedirs(directory)
+    conn = sqlite3.connect(database)
+    ext_sample_ids = [row[0] for row in conn.execute('''
+        SELECT s.ext_sample_id FROM samples s JOIN patients p ON p.id = s.patient_id
+        WHERE p.project_id = ? ORDER BY s.id LIMIT ?
+    ''', (project_id, files))]
+    for ext_sample_id in ext_sample_ids:
+        with open(os.path.join(directory, f'{ext_sample_id}_R1.fastq'), 'w') as file:
+            file.write('@read\n')
+
+    dataset_ids = []
+    for n in range(datasets):
+        scan_dataset_id = conn.execute("INSERT INTO datasets (project_id, name) VALUES (?, ?)",
+                                       (project_id, f'Scan benchmark {n}')).lastrowid
+        conn.executemany("INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, ?, ?)", [
+            (scan_dataset_id, 'raw_file_directory', directory),
+            (scan_dataset_id, 'sample_info_stored', 'filename'),
+            (scan_dataset_id, 'raw_file_extensions', '.fastq'),
+        ])
+        dataset_ids.append(scan_dataset_id)
+    now = time.time()
+    conn.executemany('''
+        INSERT INTO scan_jobs (dataset_id, directory, status, server_pid, created_at, finished_at)
+        VALUES (?, ?, 'succeeded', 0, ?, ?)
+    ''', [(dataset_id, directory, now - n, now - n) for n in range(20)])
+    job_id = conn.execute("SELECT MAX(id) FROM scan_jobs").fetchone()[0]
+    conn.commit()
+    conn.close()
+    return directory, job_id, dataset_ids
+
+
+def prepare_checksums(database, duplicate_every, seed):
+    # Checksums for every raw file, with one file in duplicate_every sharing its content with
+    # another file, so /duplicate_raw_files/ has groups to find among many unique checksums
+    rng = random.Random(seed)
+    conn = sqlite3.connect(database)
+    raw_file_ids = [row[0] for row in conn.execute("SELECT id FROM raw_files ORDER BY id")]
+    checksums = []
+    for raw_file_id in raw_file_ids:
+        if checksums and rng.randrange(duplicate_every) == 0:
+            checksum = rng.choice(checksums)[1]
+        else:
+            checksum = f'blake2b:{rng.getrandbits(256):064x}'
+        checksums.append((raw_file_id, checksum))
+    replace_raw_files_metadata(conn, CHECKSUM_KEYS, [(raw_file_id, dict(zip(CHECKSUM_KEYS, (checksum, 1024, 0))))
+                                                     for raw_file_id, checksum in checksums])
+    conn.close()
+
+
+def build_scenarios(project_id, dataset_id, patient_id, sample_id, page_size, counts, scan_jobs):
+    """
+    Return (name, method, url, body_factory) for every endpoint. body_factory(n) builds the
+    body of the n-th request, so write endpoints send new data each time.
+    """
+    def raw_files(n, count=100):
+        return [{"dataset_id": dataset_id, "path": f"/data/bench/{n:06d}_{i:04d}.fastq",
+                 "metadata": [{"metadata_key": "sample_id", "metadata_value": str(sample_id)}]}
+                for i in range(count)]
+
+    def raw_files_ndjson(n):
+        return ''.join(json.dumps(raw_file) + '\n' for raw_file in raw_files(n + 500000))
+
+    counts_file_id, genes, samples = counts
+    scan_job_id, scan_dataset_ids = scan_jobs
+    gene_params = '&'.join(f'gene={gene}' for gene in genes)
+    sample_params = '&'.join(f'sample={sample}' for sample in samples[::max(1, len(samples) // 5)])
+
+    return [
+        ("projects", "GET", "/projects/", None),
+        ("project_summary", "GET", f"/projects/{project_id}/summary", None),
+        ("project_summaries", "GET", "/projects/summary", None),
+        ("dataset", "GET", f"/datasets/{dataset_id}?project_id={project_id}", None),
+        ("datasets", "GET", f"/datasets/0?project_id={project_id}", None),
+        ("dataset_with_metadata", "GET", f"/datasets_with_metadata/{dataset_id}?project_id={project_id}", None),
+        ("patient", "GET", f"/patients/{patient_id}?project_id={project_id}", None),
+        ("patients_page", "GET", f"/patients/0?project_id={project_id}&limit={page_size}", None),
+        ("patients_all", "GET", f"/patients/0?project_id={project_id}", None),
+        ("sample", "GET", f"/samples/{sample_id}?project_id={project_id}", None),
+        ("samples_page", "GET", f"/samples/0?project_id={project_id}&limit={page_size}", None),
+        ("samples_all", "GET", f"/samples/0?project_id={project_id}", None),
+        ("samples_all_ndjson", "GET", f"/samples/0?project_id={project_id}&stream=ndjson", None),
+        ("patient_metadata", "GET", f"/patients_metadata/{patient_id}?project_id={project_id}", None),
+        ("patients_metadata_page", "GET", f"/patients_metadata/0?project_id={project_id}&limit={page_size}", None),
+        ("patients_metadata_all", "GET", f"/patients_metadata/0?project_id={project_id}", None),
+        ("raw_files_page", "GET", f"/raw_files_with_metadata/{dataset_id}?limit={page_size}", None),
+        ("raw_files_all", "GET", f"/raw_files_with_metadata/{dataset_id}", None),
+        ("raw_files_all_ndjson", "GET", f"/raw_files_with_metadata/{dataset_id}?stream=ndjson", None),
+        ("samples_by_metadata_page", "GET",
+         f"/samples_by_metadata/?project_id={project_id}&where=tissue=Liver&where=sample_type=Tumour&limit={page_size}", None),
+        ("samples_by_metadata_all", "GET",
+         f"/samples_by_metadata/?project_id={project_id}&where=tissue=Liver&where=tissue=Lung&where=sample_type=Normal", None),
+        ("patients_by_metadata_page", "GET",
+         f"/patients_by_metadata/?project_id={project_id}&where=sex=Female&where=age_range=45-54&limit={page_size}", None),
+        ("sample_facets", "GET", f"/metadata_facets/samples?project_id={project_id}", None),
+        ("sample_facets_filtered", "GET",
+         f"/metadata_facets/samples?project_id={project_id}&where=tissue=Liver&key=sample_type&key=ext_sample_batch", None),
+        ("patient_facets", "GET", f"/metadata_facets/patients?project_id={project_id}", None),
+        ("raw_file_counts_slice", "GET", f"/raw_file_counts/{counts_file_id}?{gene_params}&{sample_params}", None),
+        ("raw_file_counts_slice_npy", "GET", f"/raw_file_counts/{counts_file_id}?format=npy&{gene_params}", None),
+        ("raw_file_counts_columns_ndjson", "GET",
+         f"/raw_file_counts/{counts_file_id}?format=ndjson&sample={samples[0]}&sample={samples[-1]}", None),
+        ("scan_job", "GET", f"/scan_jobs/{scan_job_id}", None),
+        ("scan_jobs", "GET", f"/scan_jobs/?dataset_id={dataset_id}", None),
+        ("duplicate_raw_files", "GET", f"/duplicate_raw_files/?dataset_id={dataset_id}", None),
+        ("duplicate_raw_files_all", "GET", "/duplicate_raw_files/", None),
+        ("cache_stats", "GET", "/cache_stats/", None),
+        ("db_pool_stats", "GET", "/db_pool_stats/", None),
+        ("size_update", "PUT", "/datasets_metadata/size_update",
+         lambda n: json.dumps({"dataset_id": dataset_id, "raw_file_size": str(1000 + n),
+                               "last_size_update": datetime(2024, 1, 1).isoformat()})),
+        ("datasets_metadata_bulk", "PUT", "/datasets_metadata/",
+         lambda n: json.dumps([{"dataset_id": dataset_id, "key": f"bench_key_{i}", "value": str(n)} for i in range(50)])),
+        ("add_raw_files", "POST", "/add_raw_files/", lambda n: json.dumps(raw_files(n))),
+        ("add_raw_files_ndjson", "POST", "/add_raw_files/ndjson", raw_files_ndjson),
+        # Removes the files add_raw_files registered, request for request
+        ("remove_raw_files", "POST", "/remove_raw_files/",
+         lambda n: json.dumps([{"dataset_id": raw_file["dataset_id"], "path": raw_file["path"]} for raw_file in raw_files(n)])),
+        # Queues a scan of a prepared dataset per request; the scans run in the background
+        ("post_scan_job", "POST", "/scan_jobs/", lambda n: json.dumps({"dataset_id": scan_dataset_ids[n]})),
+    ]
+
+
+async def run_scenario(client, method, url, body_factory, requests, concurrency, warmup):
+    counter = iter(range(warmup + requests))
+    latencies = []
+    sizes = []
+    status_codes = {}
+
+    async def send(n):
+        content = body_factory(n) if body_factory else None
+        headers = {'content-type': 'application/json'} if content is not None else None
+        start = time.perf_counter()
+        response = await client.request(method, url, content=content, headers=headers)
+        return time.perf_counter() - start, response
+
+    # Warm-up requests fill the page cache and SQLite statement caches but are not reported
+    for n in range(warmup):
+        await send(next(counter))
+
+    async def worker():
+        for n in counter:
+            elapsed, response = await send(n)
+            status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+            latencies.append(elapsed)
+            sizes.append(len(response.content))
+
+    sampler = RssSampler()
+    sampler.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    peak_rss = sampler.stop()
+
+    return {
+        "method": method,
+        "url": url,
+        "concurrency": concurrency,
+        "errors": sum(count for status, count in status_codes.items() if status >= 400),
+        "status_codes": {str(status): count for status, count in sorted(status_codes.items())},
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "latency": latency_summary(latencies),
+        "mean_response_bytes": round(sum(sizes) / len(sizes)) if sizes else 0,
+        "peak_rss_mb": round(peak_rss / 2**20, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(report, baseline, max_regression):
+    """
+    Return a list of regressions of report against baseline: endpoints whose p95 latency
+    grew, or whose throughput fell, by more than max_regression (a fraction).
+    """
+    regressions = []
+    for name, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if previous is None:
+            continue
+        old_p95, new_p95 = previous["latency"]["p95_ms"], current["latency"]["p95_ms"]
+        if old_p95 and new_p95 > old_p95 * (1 + max_regression):
+            regressions.append(f"{name}: p95 {old_p95}ms -> {new_p95}ms")
+        old_rps, new_rps = previous["throughput_rps"], current["throughput_rps"]
+        if old_rps and new_rps < old_rps * (1 - max_regression):
+            regressions.append(f"{name}: throughput {old_rps}/s -> {new_rps}/s")
+    return regressions
+
+
+async def run(args):
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    database = os.path.abspath(args.database) if args.database else None
+
+    prepare_workdir()
+    import main
+    if not args.cache:
+        disable_response_cache(main)
+
+    catalogue = {}
+    if database:
+        # Benchmark an existing catalogue in place, e.g. one made by synthetic.py
+        main.DATABASE = database
+        main.init_db()
+        conn = sqlite3.connect(database)
+        project_id = args.project_id or conn.execute("SELECT MIN(id) FROM projects").fetchone()[0]
+        dataset_id = conn.execute("SELECT MIN(id) FROM datasets WHERE project_id = ?", (project_id,)).fetchone()[0]
+        conn.close()
+    else:
+        conn = sqlite3.connect(main.DATABASE)
+        start = time.perf_counter()
+        catalogue = generate_catalogue(
+            conn, projects=args.projects, patients=args.patients, samples_per_patient=args.samples_per_patient,
+            datasets=args.datasets, files_per_sample=args.files_per_sample, seed=args.seed,
+        )
+        catalogue["seconds"] = round(time.perf_counter() - start, 2)
+        conn.close()
+        project_id, dataset_id = catalogue["project_ids"][0], catalogue["dataset_ids"][0]
+
+    patient_id, sample_id = pick_ids(main.DATABASE, project_id)
+    counts = prepare_counts(main.DATABASE, dataset_id, args.counts_genes, args.counts_samples, args.seed)
+    prepare_checksums(main.DATABASE, args.duplicate_every, args.seed)
+    main.SCAN_ROOT, *scan_jobs = prepare_scan_jobs(main.DATABASE, project_id, dataset_id,
+                                                   args.warmup + args.requests, args.scan_files)
+    scenarios = build_scenarios(project_id, dataset_id, patient_id, sample_id, args.page_size, counts, scan_jobs)
+    if args.only:
+        scenarios = [scenario for scenario in scenarios if scenario[0] in args.only]
+
+    endpoints = {}
+    async with app_client(main.app) as client:
+        for name, method, url, body_factory in scenarios:
+            # Project-wide lists are much slower than single lookups, so they get fewer requests
+            requests = args.heavy_requests if name.endswith(('_all', '_ndjson')) else args.requests
+            endpoints[name] = await run_scenario(client, method, url, body_factory, requests,
+                                                 args.concurrency, args.warmup)
+            print(f"{name}: {endpoints[name]['throughput_rps']}/s, p95 {endpoints[name]['latency']['p95_ms']}ms",
+                  file=sys.stderr)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        "catalogue": catalogue,
+        "peak_rss_mb": round((peak if sys.platform == 'darwin' else peak * 1024) / 2**20, 1),
+        "endpoints": endpoints,
+    }
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    errors = [name for name, result in endpoints.items() if result["errors"]]
+    if errors:
+        raise SystemExit(f"Requests failed for: {', '.join(errors)}")
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare_reports(report, json.load(f), args.max_regression)
+        if regressions:
+            raise SystemExit("Regressions against baseline:\n" + "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Throughput, latency and peak RSS of every endpoint.')
+    parser.add_argument('--database', help='Benchmark this existing database (it is written to) instead of generating one')
+    parser.add_argument('--project_id', type=int, help='Project to query in --database (default: the first)')
+    parser.add_argument('--projects', type=int, default=1, help='Projects to generate')
+    parser.add_argument('--patients', type=int, default=5000, help='Patients to generate per project')
+    parser.add_argument('--samples_per_patient', type=int, default=4, help='Samples generated per patient')
+    parser.add_argument('--datasets', type=int, default=1, help='Datasets generated per project')
+    parser.add_argument('--files_per_sample', type=int, default=2, help='Raw files generated per sample')
+    parser.add_argument('--counts_genes', type=int, default=60000, help='Genes in the counts table for /raw_file_counts')
+    parser.add_argument('--counts_samples', type=int, default=100, help='Samples in the counts table for /raw_file_counts')
+    parser.add_argument('--scan_files', type=int, default=200, help='Files in the directory scanned by /scan_jobs/')
+    parser.add_argument('--duplicate_every', type=int, default=20,
+                        help='About one raw file in this many shares its checksum with another')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated catalogue')
+    parser.add_argument('--requests', type=int, default=200, help='Timed requests per endpoint')
+    parser.add_argument('--heavy_requests', type=int, default=10, help='Timed requests per project-wide list')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed requests before each endpoint')
+    parser.add_argument('--concurrency', type=int, default=4, help='Requests in flight at once')
+    parser.add_argument('--page_size', type=int, default=100, help='limit for the paged endpoints')
+    parser.add_argument('--only', nargs='+', help='Run only these endpoint names')
+    parser.add_argument('--cache', action='store_true', help='Leave the response cache enabled')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='Earlier report to compare against')
+    parser.add_argument('--max_regression', type=float, default=0.25,
+                        help='Allowed fractional p95/throughput regression against --baseline')
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,115 @@
+"""
+Time header extraction over many compressed FASTQ files: gzip/bz2/zstandard.open().readline()
+one file at a time against the tracker's bounded, pooled header_reader.read_headers.
+
+cpu_s close to wall_s means decompression is the bottleneck; on a network filesystem the
+pooled reader should spend most of its wall time waiting on storage instead. bzip2 has to
+decode a whole block before the first line, so it stays CPU-bound and gains from the pool
+only with several cores.
+
+Usage:
+python benchmarks/headers.py --files 100000 --format gz
+python benchmarks/headers.py --directory /mnt/lustre/project/raw --extension .fastq.gz
+"""
+import argparse
+import bz2
+import gzip
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Make the tracker's modules importable when running from the repo root or this directory
+TRACKER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_files', 'tracker')
+if TRACKER_DIR not in sys.path:
+    sys.path.insert(0, TRACKER_DIR)
+
+from header_reader import HEADER_WORKERS, read_headers, zstandard
+from scanner import scan_tree
+
+
+COMPRESSORS = {
+    'gz': ('.fastq.gz', gzip.compress, gzip.open),
+    'bz2': ('.fastq.bz2', bz2.compress, bz2.open),
+}
+if zstandard is not None:
+    COMPRESSORS['zst'] = ('.fastq.zst', zstandard.ZstdCompressor().compress,
+                          lambda path, mode: zstandard.open(path, mode))
+
+
+def build_files(root, count, reads, fmt, rng):
+    # Compressed FASTQ files of `reads` 100bp reads each. The reads are generated once and
+    # shared; only the first read's name differs between files.
+    quality = 'I' * 100
+    sequences = [''.join(rng.choice('ACGT') for _ in range(100)) for _ in range(reads)]
+    body = ''.join(f'{sequence}\n+\n{quality}\n@read{r + 1} lane1\n' for r, sequence in enumerate(sequences[1:]))
+    body = (body + f'{sequences[0]}\n+\n{quality}\n').encode()
+    suffix, compress, _ = COMPRESSORS[fmt]
+    paths = []
+    for n in range(count // 100 + 1):
+        os.makedirs(os.path.join(root, f'batch{n:04d}'), exist_ok=True)
+    for n in range(count):
+        path = os.path.join(root, f'batch{n // 100:04d}', f's{n:07d}{suffix}')
+        with open(path, 'wb') as file:
+            file.write(compress(f'@s{n:07d} read0 lane1\n'.encode() + body))
+        paths.append(path)
+    return paths
+
+
+def naive_headers(paths):
+    # What a straightforward fix of the old text-mode readline would do
+    openers = {suffix: opener for suffix, _, opener in COMPRESSORS.values()}
+    headers = []
+    for path in paths:
+        opener = next((opener for suffix, opener in openers.items() if path.endswith(suffix)), open)
+        with opener(path, 'rt') as file:
+            headers.append(file.readline().strip())
+    return headers
+
+
+def timed(func, *args):
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func(*args)
+    return time.perf_counter() - wall, time.process_time() - cpu, result
+
+
+def run(args):
+    root = args.directory
+    if root is None:
+        root = tempfile.mkdtemp(prefix='redmane_headers_')
+        paths = build_files(root, args.files, args.reads, args.format, random.Random(args.seed))
+    else:
+        paths = sorted(file.path for file in scan_tree(root, args.extension))
+
+    try:
+        cases = [('naive_sequential', naive_headers, (paths,)),
+                 ('read_headers_1_worker', lambda p: [h for _, h in read_headers(p, workers=1)], (paths,)),
+                 (f'read_headers_{args.workers}_workers', lambda p: [h for _, h in read_headers(p, workers=args.workers)], (paths,))]
+        report = {"files": len(paths), "format": args.format if args.directory is None else args.extension}
+        expected = None
+        for name, func, func_args in cases:
+            wall, cpu, headers = timed(func, *func_args)
+            if expected is not None and headers != expected:
+                raise SystemExit(f"{name}: headers differ from naive_sequential")
+            expected = headers
+            report[name] = {"wall_s": round(wall, 2), "cpu_s": round(cpu, 2),
+                            "files_per_s": round(len(paths) / wall) if wall else None}
+        print(json.dumps(report, indent=2))
+    finally:
+        if args.directory is None:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sequential vs pooled, bounded header extraction.')
+    parser.add_argument('--directory', help='Read the files in this existing tree instead of generating some')
+    parser.add_argument('--extension', default='.gz', help='Files to read in --directory')
+    parser.add_argument('--files', type=int, default=10000, help='Compressed files to generate')
+    parser.add_argument('--reads', type=int, default=200, help='Reads per generated file')
+    parser.add_argument('--format', choices=sorted(COMPRESSORS), default='gz', help='Compression of the generated files')
+    parser.add_argument('--workers', type=int, default=HEADER_WORKERS, help='Files read at once')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    run(parser.parse_args())
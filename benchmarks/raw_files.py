@@ -0,0 +1,54 @@
+"""
+Measure /raw_files_with_metadata/{dataset_id} latency on a dataset with a large raw_files table.
+
+Usage:
+python benchmarks/raw_files.py --samples 25000 --files_per_sample 4
+"""
+import argparse
+import asyncio
+import json
+
+from common import app_client, disable_response_cache, latency_summary, prepare_workdir, seed_project, timed_get
+
+
+async def run(args):
+    prepare_workdir()
+    import main
+    if not args.cache:
+        disable_response_cache(main)
+
+    patients = max(1, args.samples // args.samples_per_patient)
+    _, dataset_id = seed_project(
+        main.DATABASE,
+        patients=patients,
+        samples_per_patient=args.samples_per_patient,
+        files_per_sample=args.files_per_sample,
+    )
+    url = f'/raw_files_with_metadata/{dataset_id}'
+
+    async with app_client(main.app) as client:
+        latencies = []
+        for _ in range(args.repeat):
+            elapsed, response = await timed_get(client, url)
+            latencies.append(elapsed)
+        file_count = len(response.json())
+
+    report = {
+        "raw_files": file_count,
+        "samples": patients * args.samples_per_patient,
+        "latency": latency_summary(latencies),
+    }
+    print(json.dumps(report, indent=2))
+    if args.max_p50_ms and report["latency"]["p50_ms"] > args.max_p50_ms:
+        raise SystemExit(f"p50 latency {report['latency']['p50_ms']}ms exceeds {args.max_p50_ms}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Latency of /raw_files_with_metadata on a large dataset.')
+    parser.add_argument('--samples', type=int, default=10000, help='Number of samples to seed')
+    parser.add_argument('--samples_per_patient', type=int, default=4, help='Samples seeded per patient')
+    parser.add_argument('--files_per_sample', type=int, default=4, help='Raw files linked to each sample')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed requests')
+    parser.add_argument('--max_p50_ms', type=float, default=0, help='Fail if median latency exceeds this (0 disables)')
+    parser.add_argument('--cache', action='store_true', help='Leave the response cache enabled')
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,112 @@
+"""
+Time the tracker's SampleMatcher against the former per-sample loop of file_report.py, which
+tests every filename against every sample and compiles a regex per (file, sample) pair.
+
+The former loop is only run on --legacy_files of the filenames, both to check that the
+matcher returns the same samples for them and to extrapolate its time to all filenames.
+
+Usage:
+python benchmarks/sample_matching.py --files 1000000 --samples 50000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+# Make the tracker's modules importable when running from the repo root or this directory
+TRACKER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_files', 'tracker')
+if TRACKER_DIR not in sys.path:
+    sys.path.insert(0, TRACKER_DIR)
+
+import matcher
+from matcher import SampleMatcher
+
+
+def build_samples(count, samples_per_patient, rng):
+    # Patient ids look like REDCap record names, some with spaces ('WEHI 0042 B')
+    samples = []
+    for n in range(count):
+        patient = n // samples_per_patient
+        ext_patient_id = f'WEHI {patient:05d} B' if patient % 5 == 0 else f'pt{patient:05d}x'
+        samples.append({"sample_id": n + 1, "patient_id": patient + 1,
+                        "ext_sample_id": f'abc{n:06d}', "ext_patient_id": ext_patient_id})
+    return samples
+
+
+def build_filenames(count, samples, rng):
+    # Mostly files named after a sample, some after a patient only, some after nothing known
+    filenames = []
+    for n in range(count):
+        sample = rng.choice(samples)
+        kind = n % 10
+        if kind < 7:
+            name = f'{sample["ext_sample_id"]}_agrf_{rng.choice(["liver", "lung", "blood"])}_wes_R{n % 2 + 1}.fastq'
+        elif kind < 9:
+            name = f'{sample["ext_patient_id"].replace(" ", "_")}_run{n}_L001.fastq'
+        else:
+            name = f'unknown_{n:07d}_lane{n % 8}.fastq'
+        filenames.append(f'/data/raw/batch{n % 100:03d}/{name}')
+    return filenames
+
+
+def legacy_match(filename, samples):
+    # The loop file_report.py ran for each file before SampleMatcher
+    matches = []
+    for data in samples:
+        if data["ext_sample_id"] in filename:
+            matches.append(data)
+        elif re.compile(re.escape(data["ext_patient_id"]).replace(r'\ ', '.*')).search(filename):
+            matches.append(data)
+            break
+    return matches
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    samples = build_samples(args.samples, args.samples_per_patient, rng)
+    filenames = build_filenames(args.files, samples, rng)
+    if args.pure_python:
+        matcher.ahocorasick = None
+
+    start = time.perf_counter()
+    sample_matcher = SampleMatcher(samples)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matched = sum(1 for filename in filenames if sample_matcher.match_filename(filename))
+    match_seconds = time.perf_counter() - start
+
+    checked = rng.sample(filenames, min(args.legacy_files, len(filenames)))
+    start = time.perf_counter()
+    expected = [legacy_match(filename, samples) for filename in checked]
+    legacy_seconds = time.perf_counter() - start
+    for filename, legacy in zip(checked, expected):
+        if sample_matcher.match_filename(filename) != legacy:
+            raise SystemExit(f"{filename}: matcher and former loop disagree")
+
+    print(json.dumps({
+        "files": args.files,
+        "samples": args.samples,
+        "aho_corasick": sample_matcher.sample_index.automaton is not None,
+        "files_matched": matched,
+        "build_ms": round(build_seconds * 1000, 1),
+        "match_s": round(match_seconds, 2),
+        "match_us_per_file": round(match_seconds / len(filenames) * 1e6, 2),
+        "legacy_files_checked": len(checked),
+        "legacy_ms_per_file": round(legacy_seconds / len(checked) * 1000, 2) if checked else None,
+        "legacy_estimated_s": round(legacy_seconds / len(checked) * len(filenames)) if checked else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='SampleMatcher vs the former per-sample filename loop.')
+    parser.add_argument('--files', type=int, default=1000000, help='Filenames to match')
+    parser.add_argument('--samples', type=int, default=50000, help='Samples to match against')
+    parser.add_argument('--samples_per_patient', type=int, default=4, help='Samples per patient')
+    parser.add_argument('--legacy_files', type=int, default=20, help='Filenames also run through the former loop')
+    parser.add_argument('--pure_python', action='store_true', help='Ignore pyahocorasick even if it is installed')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    run(parser.parse_args())
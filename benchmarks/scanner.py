@@ -0,0 +1,114 @@
+"""
+Compare the tracker's former three passes over a storage tree (os.walk for the total size,
+du, os.walk for the file list) with one scanner.scan_tree pass, on a synthetic tree.
+
+Network filesystems are where the thread pool pays off; on a local disk the tree is mostly
+in the page cache after the first pass, so point --directory at a Lustre/NFS mount to see
+the difference there.
+
+Usage:
+python benchmarks/scanner.py --directories 2000 --files_per_directory 50
+python benchmarks/scanner.py --directory /mnt/lustre/project/raw --extension .fastq.gz
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the tracker's scanner importable when running from the repo root or this directory
+TRACKER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_files', 'tracker')
+if TRACKER_DIR not in sys.path:
+    sys.path.insert(0, TRACKER_DIR)
+
+from scanner import SCAN_WORKERS, scan_tree
+
+
+def build_tree(root, directories, files_per_directory, extension, fanout=10):
+    """
+    Create a tree of empty-ish files: directories spread over nested levels of fanout
+    subdirectories, each holding files_per_directory files, half with extension.
+    """
+    for d in range(directories):
+        parts, n = [], d
+        while True:
+            parts.append(f'd{n % fanout}')
+            n //= fanout
+            if not n:
+                break
+        directory = os.path.join(root, *reversed(parts), f'leaf{d}')
+        os.makedirs(directory)
+        for f in range(files_per_directory):
+            name = f's{d:06d}_{f:03d}' + (extension if f % 2 == 0 else '.log')
+            with open(os.path.join(directory, name), 'wb') as file:
+                file.write(b'@' * (f + 1))
+
+
+def three_passes(directory, extension):
+    # What file_report.py did before: a size walk, a discarded du, and a listing walk
+    total = 0
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            if file.endswith(extension):
+                total += os.path.getsize(os.path.join(root, file))
+    if platform.system() == 'Linux':
+        subprocess.run(['du', '--max-depth=1', '-m', directory], capture_output=True, text=True)
+    matches = []
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            if file.endswith(extension):
+                matches.append(os.path.join(root, file))
+    return total, len(matches)
+
+
+def one_pass(directory, extension, workers):
+    files = list(scan_tree(directory, extension, workers=workers))
+    return sum(file.size for file in files), len(files)
+
+
+def best_of(func, args, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def run(args):
+    root = args.directory
+    if root is None:
+        root = tempfile.mkdtemp(prefix='redmane_scan_')
+        build_tree(root, args.directories, args.files_per_directory, args.extension)
+
+    try:
+        cases = [('three_passes', three_passes, (root, args.extension)),
+                 ('scan_tree_1_worker', one_pass, (root, args.extension, 1)),
+                 (f'scan_tree_{args.workers}_workers', one_pass, (root, args.extension, args.workers))]
+        report = {"directory": root}
+        expected = None
+        for name, func, func_args in cases:
+            seconds, (total, count) = best_of(func, func_args, args.repeat)
+            if expected is not None and (total, count) != expected:
+                raise SystemExit(f"{name}: found {count} files / {total} bytes, expected {expected[1]} / {expected[0]}")
+            expected = (total, count)
+            report[name] = {"files": count, "bytes": total, "ms": round(seconds * 1000, 1)}
+        print(json.dumps(report, indent=2))
+    finally:
+        if args.directory is None:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Three os.walk/du passes vs one parallel scandir pass.')
+    parser.add_argument('--directory', help='Scan this existing tree instead of generating one')
+    parser.add_argument('--directories', type=int, default=1000, help='Directories to generate')
+    parser.add_argument('--files_per_directory', type=int, default=50, help='Files generated per directory')
+    parser.add_argument('--extension', default='.fastq', help='Extension to search for')
+    parser.add_argument('--workers', type=int, default=SCAN_WORKERS, help='Directories listed at once')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the best is reported')
+    run(parser.parse_args())
@@ -0,0 +1,62 @@
+"""
+Compare response serialization with per-row Pydantic validation (what response_model does)
+against the fast path that writes the fetched rows straight to JSON.
+
+Usage:
+python benchmarks/serialization.py --patients 25000
+"""
+import argparse
+import json
+import sqlite3
+import time
+from typing import List
+
+from common import prepare_workdir, seed_project
+
+
+def best_of(func, arg, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = func(arg)
+        timings.append(time.perf_counter() - start)
+    return min(timings), body
+
+
+def run(args):
+    prepare_workdir()
+    import main
+    from serialization import dump_json, validating_serializer
+
+    project_id, dataset_id = seed_project(main.DATABASE, patients=args.patients, samples_per_patient=args.samples_per_patient)
+    conn = sqlite3.connect(main.DATABASE)
+
+    cases = [
+        ('samples', List[main.Sample], main.fetch_samples(conn, 0, project_id)),
+        ('patients_metadata', List[main.PatientWithSamples], main.fetch_patients_metadata(conn, project_id, 0)),
+        ('raw_files_with_metadata', List[main.RawFileResponse], main.fetch_raw_files_with_metadata(conn, dataset_id)),
+    ]
+    conn.close()
+
+    report = {}
+    for name, model, result in cases:
+        validated_time, validated_body = best_of(validating_serializer(model), result, args.repeat)
+        fast_time, fast_body = best_of(dump_json, result, args.repeat)
+        if json.loads(validated_body) != json.loads(fast_body):
+            raise SystemExit(f"{name}: fast path output differs from the validated output")
+        report[name] = {
+            "items": len(result),
+            "bytes": len(fast_body),
+            "validated_ms": round(validated_time * 1000, 1),
+            "fast_ms": round(fast_time * 1000, 1),
+            "speedup": round(validated_time / fast_time, 1) if fast_time else None,
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Validated vs fast-path response serialization.')
+    parser.add_argument('--patients', type=int, default=10000, help='Number of patients to seed')
+    parser.add_argument('--samples_per_patient', type=int, default=4, help='Samples seeded per patient')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case (best is reported)')
+    run(parser.parse_args())
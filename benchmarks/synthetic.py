@@ -0,0 +1,206 @@
+"""
+Fill a REDMANE database with a seeded, realistically shaped synthetic catalogue.
+
+Usage:
+python benchmarks/synthetic.py data/synthetic.db --projects 4 --patients 62500 --samples_per_patient 4
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+# Make migrations.py importable when running from the repo root or this directory
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from migrations import migrate
+
+
+# Metadata keys and values modelled on the REDCap imports in sample_data/. Extra keys
+# beyond these are generated as key_N with a small vocabulary each.
+PATIENT_METADATA = [
+    ('age_range', ['18-24', '25-34', '35-44', '45-54', '55-64', '65-74', '75+']),
+    ('sex', ['Female', 'Male']),
+    ('smoking', ['yes', 'no', 'former']),
+    ('diagnosis', ['LUAD', 'LUSC', 'HCC', 'CRC', 'BRCA', 'PDAC']),
+    ('ethnicity', ['Caucasian', 'Asian', 'Aboriginal', 'Other', 'Unknown']),
+]
+SAMPLE_METADATA = [
+    ('tissue', ['Liver', 'Lung', 'Blood', 'Colon', 'Breast', 'Pancreas']),
+    ('sample_type', ['Tumour', 'Normal', 'Metastasis']),
+    ('ext_sample_batch', [str(batch) for batch in range(3000, 3100)]),
+    ('sample_date', [f'2024-{month:02d}-{day:02d}' for month in range(1, 13) for day in (1, 15)]),
+    ('preservation', ['FFPE', 'Fresh frozen']),
+]
+RAW_FILE_EXTENSIONS = ['.fastq', '.fastq.gz', '.bam']
+
+# Rows per executemany batch; bounds memory however large the catalogue is
+BATCH_SIZE = 20000
+
+
+def _metadata_keys(known, count):
+    keys = list(known[:count])
+    for n in range(len(keys), count):
+        keys.append((f'key_{n}', [f'value_{v}' for v in range(8)]))
+    return keys
+
+
+def _next_id(cursor, table, column='id'):
+    cursor.execute(f"SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}")
+    return cursor.fetchone()[0]
+
+
+class _Batches:
+    # Buffers rows per insert statement and flushes them with executemany. Statements are
+    # flushed together in first-use order, so parent rows always land before their children
+    # and the cache epoch triggers can resolve their project.
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.rows = {}
+
+    def add(self, sql, row):
+        rows = self.rows.setdefault(sql, [])
+        rows.append(row)
+        if len(rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        for sql, rows in self.rows.items():
+            if rows:
+                self.cursor.executemany(sql, rows)
+                rows.clear()
+
+
+def generate_catalogue(conn, projects=1, patients=1000, samples_per_patient=4, patient_metadata_keys=2,
+                       sample_metadata_keys=3, datasets=1, files_per_sample=2, seed=0):
+    """
+    Add a synthetic catalogue to a migrated database and commit it.
+
+    Every project gets the same number of patients, samples and datasets. Each sample's
+    raw files are spread across its project's datasets and linked back to the sample with
+    a sample_id metadata row, as the tracker scripts do.
+
+    Args:
+    conn (sqlite3.Connection): The database connection.
+    projects (int): Number of projects.
+    patients (int): Patients per project.
+    samples_per_patient (int): Samples per patient.
+    patient_metadata_keys (int): Metadata keys per patient.
+    sample_metadata_keys (int): Metadata keys per sample.
+    datasets (int): Datasets per project.
+    files_per_sample (int): Raw files per sample.
+    seed (int): Seed for the random metadata values; equal arguments give equal databases.
+
+    Returns:
+    dict: The ids of the generated projects and datasets, and row counts per table.
+    """
+    rng = random.Random(seed)
+    patient_keys = _metadata_keys(PATIENT_METADATA, patient_metadata_keys)
+    sample_keys = _metadata_keys(SAMPLE_METADATA, sample_metadata_keys)
+    cursor = conn.cursor()
+    batches = _Batches(cursor)
+    counts = dict.fromkeys(['projects', 'datasets', 'datasets_metadata', 'patients', 'patients_metadata',
+                            'samples', 'samples_metadata', 'raw_files', 'raw_files_metadata'], 0)
+
+    # Ids are assigned here rather than read back per row, so rows can be batched
+    project_id = _next_id(cursor, 'projects')
+    dataset_id = _next_id(cursor, 'datasets')
+    patient_id = _next_id(cursor, 'patients')
+    sample_id = _next_id(cursor, 'samples')
+    raw_file_id = _next_id(cursor, 'raw_files')
+    project_ids, dataset_ids = [], []
+
+    for p in range(projects):
+        cursor.execute("INSERT INTO projects (id, name, status) VALUES (?, ?, ?)",
+                       (project_id, f'Synthetic project {p + 1}', rng.choice(['active', 'active', 'archived'])))
+        project_ids.append(project_id)
+        counts['projects'] += 1
+
+        project_datasets = []
+        for d in range(datasets):
+            extension = RAW_FILE_EXTENSIONS[d % len(RAW_FILE_EXTENSIONS)]
+            cursor.execute("INSERT INTO datasets (id, project_id, name) VALUES (?, ?, ?)",
+                           (dataset_id, project_id, f'Synthetic raw {extension[1:]} {d + 1}'))
+            cursor.executemany(
+                "INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, ?, ?)",
+                [(dataset_id, 'sample_info_stored', 'filename'),
+                 (dataset_id, 'raw_file_extensions', '*' + extension)],
+            )
+            project_datasets.append((dataset_id, extension))
+            dataset_ids.append(dataset_id)
+            counts['datasets'] += 1
+            counts['datasets_metadata'] += 2
+            dataset_id += 1
+
+        for n in range(patients):
+            batches.add(
+                "INSERT INTO patients (id, project_id, ext_patient_id, ext_patient_url, public_patient_id) VALUES (?, ?, ?, ?, ?)",
+                (patient_id, project_id, f'P{project_id}-{n + 1:07d}', 'https://redcap.example/patients',
+                 f'PUB{patient_id:08d}' if rng.random() < 0.5 else None),
+            )
+            for key, values in patient_keys:
+                batches.add("INSERT INTO patients_metadata (patient_id, key, value) VALUES (?, ?, ?)",
+                            (patient_id, key, rng.choice(values)))
+
+            for s in range(samples_per_patient):
+                ext_sample_id = f's{project_id}_{n + 1:07d}_{s + 1}'
+                batches.add("INSERT INTO samples (id, patient_id, ext_sample_id, ext_sample_url) VALUES (?, ?, ?, ?)",
+                            (sample_id, patient_id, ext_sample_id, 'https://redcap.example/samples'))
+                for key, values in sample_keys:
+                    batches.add("INSERT INTO samples_metadata (sample_id, key, value) VALUES (?, ?, ?)",
+                                (sample_id, key, rng.choice(values)))
+
+                for f in range(files_per_sample if project_datasets else 0):
+                    file_dataset_id, extension = project_datasets[f % len(project_datasets)]
+                    batches.add("INSERT INTO raw_files (id, dataset_id, path) VALUES (?, ?, ?)",
+                                (raw_file_id, file_dataset_id, f'/data/raw/{ext_sample_id}_R{f + 1}{extension}'))
+                    batches.add(
+                        "INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value) VALUES (?, ?, ?)",
+                        (raw_file_id, 'sample_id', str(sample_id)))
+                    raw_file_id += 1
+                    counts['raw_files'] += 1
+                    counts['raw_files_metadata'] += 1
+
+                sample_id += 1
+                counts['samples'] += 1
+                counts['samples_metadata'] += len(sample_keys)
+
+            patient_id += 1
+            counts['patients'] += 1
+            counts['patients_metadata'] += len(patient_keys)
+
+        project_id += 1
+
+    batches.flush()
+    conn.commit()
+    return {"project_ids": project_ids, "dataset_ids": dataset_ids, "counts": counts}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fill a REDMANE database with a seeded synthetic catalogue.')
+    parser.add_argument('database', help='Database file to create or extend')
+    parser.add_argument('--projects', type=int, default=1, help='Number of projects')
+    parser.add_argument('--patients', type=int, default=1000, help='Patients per project')
+    parser.add_argument('--samples_per_patient', type=int, default=4, help='Samples per patient')
+    parser.add_argument('--patient_metadata_keys', type=int, default=2, help='Metadata keys per patient')
+    parser.add_argument('--sample_metadata_keys', type=int, default=3, help='Metadata keys per sample')
+    parser.add_argument('--datasets', type=int, default=1, help='Datasets per project')
+    parser.add_argument('--files_per_sample', type=int, default=2, help='Raw files per sample')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    migrate(conn)
+    start = time.perf_counter()
+    result = generate_catalogue(
+        conn, projects=args.projects, patients=args.patients, samples_per_patient=args.samples_per_patient,
+        patient_metadata_keys=args.patient_metadata_keys, sample_metadata_keys=args.sample_metadata_keys,
+        datasets=args.datasets, files_per_sample=args.files_per_sample, seed=args.seed,
+    )
+    conn.close()
+    result["seconds"] = round(time.perf_counter() - start, 2)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,167 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from fastapi.responses import Response
+
+
+class CacheEntry:
+    __slots__ = ('body', 'etag', 'epochs', 'scopes', 'headers')
+
+    def __init__(self, body, etag, epochs, scopes, headers):
+        self.body = body
+        self.etag = etag
+        self.epochs = epochs
+        self.scopes = scopes
+        self.headers = headers
+
+
+class ResponseCache:
+    """
+    An in-process LRU cache of serialized JSON responses, bounded by entry count and bytes.
+
+    Each entry records the cache_epochs versions of the scopes it was built from, e.g.
+    ('project', 3) or ('dataset', 7). Triggers bump those versions on every write, so an
+    entry is served only while its scopes are unchanged, whichever process wrote.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Counters reported by stats()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, epochs, scopes, headers=None):
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        entry = CacheEntry(body, etag, epochs, scopes, headers or {})
+        # Responses too large for the whole cache are served but not kept
+        if len(body) > self.max_bytes:
+            return entry
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+                self.evictions += 1
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry.body)
+        return entry
+
+    def discard(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate(self, scope):
+        """
+        Drop every entry built from scope, e.g. ('dataset', 7), right after a local write.
+        """
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if scope in entry.scopes]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def read_epochs(conn, scopes):
+    """
+    Return the current cache_epochs versions of scopes as a tuple (0 for never written).
+    """
+    versions = {}
+    for scope, scope_id, version in conn.execute(
+        "SELECT scope, scope_id, version FROM cache_epochs WHERE (scope, scope_id) IN (VALUES "
+        + ", ".join("(?, ?)" for _ in scopes) + ")",
+        [value for scope in scopes for value in scope],
+    ):
+        versions[(scope, scope_id)] = version
+    return tuple(versions.get(scope, 0) for scope in scopes)
+
+
+def _build(conn, scopes, serialize, headers_for, fetch, args):
+    # Read the epochs and the data in one read transaction so they describe the same snapshot
+    conn.execute('BEGIN')
+    try:
+        epochs = read_epochs(conn, scopes)
+        result = fetch(conn, *args)
+    finally:
+        conn.rollback()
+    return epochs, serialize(result), headers_for(result) if headers_for else None
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or 'W/' + etag in candidates
+
+
+async def cached_response(request, db, cache, key, scopes, serialize, fetch, *args, headers_for=None):
+    """
+    Serve fetch(conn, *args) through the response cache, honouring If-None-Match.
+
+    Args:
+    request (Request): The incoming request, for its If-None-Match header.
+    db (ConnectionPool): The pool to run queries on.
+    cache (ResponseCache): The response cache.
+    key (tuple): The cache key, e.g. ('samples', project_id, sample_id, after, limit).
+    scopes (list): The (scope, id) pairs whose writes invalidate this response.
+    serialize (callable): Turns fetch's result into JSON bytes.
+    fetch (callable): The query function, called as fetch(conn, *args).
+    headers_for (callable): Optional, maps fetch's result to extra headers stored with the entry.
+
+    Returns:
+    Response: The JSON body with an ETag, or an empty 304 when the client's copy is current.
+    """
+    scopes = tuple(scopes)
+    entry = cache.get(key)
+    if entry is not None:
+        if await db.run(read_epochs, scopes) == entry.epochs:
+            cache.hits += 1
+        else:
+            cache.stale += 1
+            cache.discard(key)
+            entry = None
+
+    if entry is None:
+        cache.misses += 1
+        epochs, body, headers = await db.run(_build, scopes, serialize, headers_for, fetch, args)
+        entry = cache.put(key, body, epochs, scopes, headers)
+
+    headers = {**entry.headers, 'ETag': entry.etag, 'Cache-Control': 'no-cache'}
+    if _etag_matches(request.headers.get('if-none-match'), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type='application/json', headers=headers)
@@ -0,0 +1,210 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from database import configure_connection
+from ingest import raw_files_metadata_page, replace_raw_files_metadata
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+# Hash functions by name; stored checksums are prefixed with theirs, e.g. blake2b:4f1c...
+ALGORITHMS = {'blake2b': hashlib.blake2b}
+if xxhash is not None:
+    ALGORITHMS['xxh3_128'] = xxhash.xxh3_128
+DEFAULT_ALGORITHM = 'blake2b'
+
+# Bytes read per step; large sequential reads let storage read ahead
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Files hashed at once, each in its own process
+CHECKSUM_WORKERS = os.cpu_count() or 1
+
+# Files looked up per query. Results are written every CHECKSUM_BATCH_SIZE files or
+# CHECKSUM_FLUSH_SECONDS, whichever comes first, so an interrupted run keeps what it has
+# done and the next run carries on from there.
+CHECKSUM_PAGE_SIZE = 10000
+CHECKSUM_BATCH_SIZE = 1000
+CHECKSUM_FLUSH_SECONDS = 5
+
+# raw_files_metadata keys: the checksum, and the size and mtime it was computed at
+CHECKSUM_KEY = 'checksum'
+CHECKSUM_SIZE_KEY = 'checksum_size'
+CHECKSUM_MTIME_KEY = 'checksum_mtime_ns'
+CHECKSUM_KEYS = [CHECKSUM_KEY, CHECKSUM_SIZE_KEY, CHECKSUM_MTIME_KEY]
+
+
+# Read buffers by size, allocated once per process rather than once per file
+_buffers = {}
+
+
+def hash_file(path, algorithm=DEFAULT_ALGORITHM, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Hash a file's content, reading it front to back into one reused buffer.
+
+    Returns:
+    str: The checksum as algorithm:hexdigest.
+    """
+    digest = ALGORITHMS[algorithm]()
+    buffer = _buffers.get(chunk_size)
+    if buffer is None:
+        buffer = _buffers[chunk_size] = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as file:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while size := file.readinto(buffer):
+            digest.update(view[:size])
+    return f'{algorithm}:{digest.hexdigest()}'
+
+
+def _checksum_task(task):
+    # Runs in a worker process; returns (raw_file_id, checksum or None if unchanged or
+    # failed, size, mtime_ns, error)
+    raw_file_id, path, checksum, size, mtime_ns, algorithm, chunk_size = task
+    try:
+        before = os.stat(path)
+        if (checksum is not None and checksum.startswith(algorithm + ':')
+                and before.st_size == size and before.st_mtime_ns == mtime_ns):
+            return raw_file_id, None, size, mtime_ns, None
+        checksum = hash_file(path, algorithm, chunk_size)
+        after = os.stat(path)
+        if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+            return raw_file_id, None, None, None, "changed while it was hashed"
+        return raw_file_id, checksum, after.st_size, after.st_mtime_ns, None
+    except OSError as e:
+        return raw_file_id, None, None, None, str(e)
+
+
+def checksum_raw_files(conn, dataset_id=None, workers=CHECKSUM_WORKERS, algorithm=DEFAULT_ALGORITHM,
+                       root='.', chunk_size=HASH_CHUNK_SIZE, onprogress=None, onerror=None):
+    """
+    Hash the content of registered raw files on a process pool and store the checksums in
+    raw_files_metadata, with the size and mtime they were computed at.
+
+    Files whose size and mtime still match their stored checksum are not read again, so a
+    repeated or interrupted run only hashes new and changed files.
+
+    Args:
+    conn (sqlite3.Connection): The database connection.
+    dataset_id (int): Only hash this dataset's files; all datasets if None.
+    workers (int): Files hashed at once.
+    algorithm (str): A key of ALGORITHMS.
+    root (str): Directory relative raw file paths are resolved against.
+    chunk_size (int): Bytes read per step.
+    onprogress (callable): Called with the counts after every stored batch.
+    onerror (callable): Called with (path, message) for each file that could not be hashed.
+
+    Returns:
+    dict: Counts of hashed, unchanged and failed files, bytes hashed, seconds and MB/s.
+    """
+    counts = {"hashed": 0, "unchanged": 0, "failed": 0, "bytes": 0, "seconds": 0.0, "mb_per_s": 0.0}
+    started = last_flush = time.perf_counter()
+    batch = []
+
+    def flush():
+        nonlocal last_flush
+        replace_raw_files_metadata(conn, CHECKSUM_KEYS, batch)
+        batch.clear()
+        last_flush = time.perf_counter()
+        counts["seconds"] = round(time.perf_counter() - started, 3)
+        counts["mb_per_s"] = round(counts["bytes"] / 1e6 / counts["seconds"], 1) if counts["seconds"] else 0.0
+        if onprogress is not None:
+            onprogress(dict(counts))
+
+    # spawn, not fork, so this also works from the API process and its threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+        after = 0
+        while page := raw_files_metadata_page(conn, CHECKSUM_KEYS, dataset_id, after, CHECKSUM_PAGE_SIZE):
+            after = page[-1][0]
+            paths = {raw_file_id: path for raw_file_id, path, _ in page}
+            tasks = [(raw_file_id, os.path.join(root, path), stored.get(CHECKSUM_KEY),
+                      int(stored.get(CHECKSUM_SIZE_KEY, -1)), int(stored.get(CHECKSUM_MTIME_KEY, -1)),
+                      algorithm, chunk_size)
+                     for raw_file_id, path, stored in page]
+            for raw_file_id, checksum, size, mtime_ns, error in pool.map(_checksum_task, tasks, chunksize=16):
+                if error is not None:
+                    counts["failed"] += 1
+                    if onerror is not None:
+                        onerror(paths[raw_file_id], error)
+                elif checksum is None:
+                    counts["unchanged"] += 1
+                else:
+                    counts["hashed"] += 1
+                    counts["bytes"] += size
+                    batch.append((raw_file_id, {CHECKSUM_KEY: checksum, CHECKSUM_SIZE_KEY: size,
+                                                CHECKSUM_MTIME_KEY: mtime_ns}))
+                    if len(batch) >= CHECKSUM_BATCH_SIZE or time.perf_counter() - last_flush >= CHECKSUM_FLUSH_SECONDS:
+                        flush()
+    flush()
+    return counts
+
+
+def fetch_duplicate_checksums(conn, dataset_id=None):
+    """
+    Return the raw files that share their content with another registered file, in any
+    dataset, grouped by checksum.
+
+    Args:
+    dataset_id (int): Only groups with at least one file in this dataset; all if None.
+
+    Returns:
+    list: {"checksum", "files": [{"id", "dataset_id", "path"}]} dicts, by checksum.
+    """
+    rows = conn.execute('''
+        SELECT m.metadata_value, rf.id, rf.dataset_id, rf.path
+        FROM raw_files_metadata m
+        JOIN raw_files rf ON rf.id = m.raw_file_id
+        WHERE m.metadata_key = 'checksum' AND m.metadata_value IN (
+            SELECT metadata_value FROM raw_files_metadata
+            WHERE metadata_key = 'checksum'
+            GROUP BY metadata_value
+            HAVING COUNT(*) > 1
+        ) AND (? IS NULL OR m.metadata_value IN (
+            SELECT dm.metadata_value FROM raw_files drf
+            JOIN raw_files_metadata dm ON dm.raw_file_id = drf.id AND dm.metadata_key = 'checksum'
+            WHERE drf.dataset_id = ?
+        ))
+        ORDER BY m.metadata_value, rf.id
+    ''', (dataset_id, dataset_id)).fetchall()
+
+    groups = []
+    for checksum, raw_file_id, file_dataset_id, path in rows:
+        if not groups or groups[-1]["checksum"] != checksum:
+            groups.append({"checksum": checksum, "files": []})
+        groups[-1]["files"].append({"id": raw_file_id, "dataset_id": file_dataset_id, "path": path})
+    return groups
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Hash the content of registered raw files and store the checksums.')
+    parser.add_argument('database', type=str, nargs='?', default='data/data_redmane.db', help='Path to the SQLite database')
+    parser.add_argument('--dataset_id', type=int, help='Only hash this dataset\'s files')
+    parser.add_argument('--workers', type=int, default=CHECKSUM_WORKERS, help='Files hashed at once')
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default=DEFAULT_ALGORITHM, help='Hash function')
+    parser.add_argument('--root', type=str, default='.', help='Directory relative raw file paths are resolved against')
+    parser.add_argument('--duplicates', action='store_true', help='Print files with the same content afterwards')
+    args = parser.parse_args()
+
+    def print_progress(counts):
+        print(f"{counts['hashed']} hashed, {counts['unchanged']} unchanged, {counts['failed']} failed, "
+              f"{counts['bytes'] / 1e6:.0f} MB at {counts['mb_per_s']} MB/s")
+
+    def print_error(path, message):
+        print(f"Error hashing {path}: {message}")
+
+    conn = configure_connection(sqlite3.connect(args.database))
+    counts = checksum_raw_files(conn, args.dataset_id, workers=args.workers, algorithm=args.algorithm,
+                                root=args.root, onprogress=print_progress, onerror=print_error)
+    print(json.dumps(counts, indent=2))
+    if args.duplicates:
+        print(json.dumps(fetch_duplicate_checksums(conn, args.dataset_id), indent=2))
+    conn.close()
@@ -0,0 +1,472 @@
+import argparse
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import Lock
+
+from database import configure_connection
+from ingest import raw_files_metadata_page, replace_raw_files_metadata
+from serialization import dump_json
+
+# Counts tables are read with the file tracker's streaming readers
+TRACKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_files', 'tracker')
+if TRACKER_DIR not in sys.path:
+    sys.path.insert(0, TRACKER_DIR)
+
+from file_stats import COUNTS_BLOCK_SIZE, line_blocks, split_cells, split_header, stats_kind, table_lines
+
+
+# Where converted matrices are written, one directory per raw file and version
+COUNTS_STORE_DIR = os.environ.get('REDMANE_COUNTS_STORE_DIR', 'data/counts_store')
+
+# Files converted at once, each in its own process
+STORE_WORKERS = os.cpu_count() or 1
+
+# Stores kept open per process by open_store
+STORE_CACHE_SIZE = 32
+
+# raw_files_metadata keys: the store's directory, and the size and mtime of the counts
+# table it was converted from
+STORE_KEY = 'counts_store'
+STORE_SIZE_KEY = 'counts_store_size'
+STORE_MTIME_KEY = 'counts_store_mtime_ns'
+STORE_KEYS = [STORE_KEY, STORE_SIZE_KEY, STORE_MTIME_KEY]
+
+MATRIX_FILE = 'counts.npy'
+GENES_FILE = 'genes.txt'
+GENE_INDEX_FILE = 'genes.idx'
+INDEX_FILE = 'store.json'
+
+# Values are float64, which holds whole counts exactly up to 2**53
+DTYPE = '<f8' if sys.byteorder == 'little' else '>f8'
+ITEM_SIZE = 8
+
+# A column holding any of these is not all whole numbers
+NON_INTEGER_MARKS = (b'.', b'e', b'E', b'n', b'N')
+
+# Rows read per step when streaming part of a matrix
+SLICE_CHUNK_ROWS = 4096
+
+SLICE_MEDIA_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'npy': 'application/octet-stream',
+}
+
+
+def _npy_header(shape, fortran_order=True):
+    """
+    Return a .npy version 1.0 header for a float64 matrix, padded so the data starts on a
+    64-byte boundary.
+    """
+    header = repr({'descr': DTYPE, 'fortran_order': fortran_order, 'shape': shape}).encode('latin-1')
+    preamble = 10  # Magic, version and header length
+    padding = -(preamble + len(header) + 1) % 64
+    header += b' ' * padding + b'\n'
+    return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header
+
+
+def _count_lines(path):
+    # Lines of the table, as convert_counts reads them
+    return sum(table_lines(block).count(b'\n') for block in line_blocks(path, COUNTS_BLOCK_SIZE * 16))
+
+
+def convert_counts(path, store_dir, block_size=COUNTS_BLOCK_SIZE):
+    """
+    Convert a counts table (a header line, then a gene ID and one value per sample on each
+    line, split as file_stats.split_header splits them) into a columnar store in store_dir:
+
+    - counts.npy: a genes x samples float64 matrix in column-major order, so each sample's
+      column is contiguous; numpy.load(..., mmap_mode='r') reads it as it is.
+    - genes.txt: the gene IDs, one per line, in row order.
+    - genes.idx: int64 offsets of each line of genes.txt, then the rows in gene ID order,
+      so a gene is found by binary search without loading the IDs.
+    - store.json: the sample names, the matrix shape, where its data starts and whether every
+      value is a whole number.
+
+    The table is streamed twice, once to count its rows and once to write each block's
+    columns in place, so memory is bounded by the gene IDs, not the size of the table.
+
+    Returns:
+    dict: The store's index, as written to store.json.
+
+    Raises:
+    ValueError: If the header has no sample columns, a row has a different number of cells
+    than the header, or a sample column holds something other than numbers.
+    """
+    rows = _count_lines(path) - 1
+    if rows < 0:
+        raise ValueError("empty counts file")
+
+    os.makedirs(store_dir, exist_ok=True)
+    columns = None
+    integer = True
+    row = 0
+    genes_seen = []
+    with open(os.path.join(store_dir, GENES_FILE), 'wb') as genes:
+        for block in line_blocks(path, block_size):
+            block = table_lines(block)
+            if columns is None:
+                if not block:
+                    continue
+                header, _, block = block.partition(b'\n')
+                columns, separator = split_header(header)
+                shape = (rows, len(columns) - 1)
+                matrix_header = _npy_header(shape)
+                matrix = os.open(os.path.join(store_dir, MATRIX_FILE), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+                os.write(matrix, matrix_header)
+                # Sized up front, so every block's slice of every column is written in place
+                os.ftruncate(matrix, len(matrix_header) + rows * shape[1] * ITEM_SIZE)
+                if not block:
+                    continue
+
+            block_rows = block.count(b'\n')
+            cells = split_cells(block, separator)
+            if len(cells) != block_rows * len(columns) or row + block_rows > rows:
+                raise ValueError(f"rows after row {row} do not all have the header's {len(columns)} columns")
+
+            block_genes = cells[0::len(columns)]
+            genes.write(b'\n'.join(block_genes) + b'\n')
+            genes_seen += block_genes
+            for column in range(1, len(columns)):
+                values = cells[column::len(columns)]
+                if integer:
+                    joined = b''.join(values)
+                    integer = not any(mark in joined for mark in NON_INTEGER_MARKS)
+                offset = len(matrix_header) + ((column - 1) * rows + row) * ITEM_SIZE
+                os.pwrite(matrix, array('d', map(float, values)), offset)
+            row += block_rows
+
+    if columns is None:
+        raise ValueError("empty counts file")
+    os.close(matrix)
+
+    offsets = array('q', [0])
+    for gene in genes_seen:
+        offsets.append(offsets[-1] + len(gene) + 1)
+    # sorted() is stable, so rows of a repeated gene ID stay in row order
+    order = array('q', sorted(range(rows), key=genes_seen.__getitem__))
+    with open(os.path.join(store_dir, GENE_INDEX_FILE), 'wb') as file:
+        file.write(offsets)
+        file.write(order)
+
+    index = {"rows": rows, "samples": columns[1:], "gene_column": columns[0],
+             "data_offset": len(matrix_header), "integer": integer}
+    with open(os.path.join(store_dir, INDEX_FILE), 'w') as file:
+        json.dump(index, file)
+    return index
+
+
+class CountsStore:
+    """
+    Read access to a store written by convert_counts. The matrix is memory-mapped, so only
+    the pages of the columns that are read are loaded, and opening a store is cheap.
+
+    Args:
+    store_dir (str): The store's directory.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, INDEX_FILE)) as file:
+            index = json.load(file)
+        self.rows = index["rows"]
+        self.samples = index["samples"]
+        self.gene_column = index["gene_column"]
+        self.integer = index["integer"]
+        self._offset = index["data_offset"]
+        self._sample_columns = {sample: column for column, sample in reversed(list(enumerate(self.samples)))}
+        self._map = self._genes = self._gene_index = None
+        if self.rows:
+            self._genes = _map_file(os.path.join(store_dir, GENES_FILE))
+            gene_index = memoryview(_map_file(os.path.join(store_dir, GENE_INDEX_FILE))).cast('q')
+            self._gene_offsets = gene_index[:self.rows + 1]
+            self._gene_order = gene_index[self.rows + 1:]
+            if self.samples:
+                self._map = _map_file(os.path.join(store_dir, MATRIX_FILE))
+
+    def _gene_at(self, row):
+        return self._genes[self._gene_offsets[row]:self._gene_offsets[row + 1] - 1]
+
+    def gene(self, row):
+        """
+        Return the gene ID of a row.
+        """
+        return self._gene_at(row).decode('utf-8', errors='replace')
+
+    def gene_rows(self, gene):
+        """
+        Return the rows of a gene ID, in order; empty if the matrix does not have it.
+        """
+        key = gene.encode('utf-8')
+        low, high = 0, self.rows
+        while low < high:
+            middle = (low + high) // 2
+            if self._gene_at(self._gene_order[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        rows = []
+        while low < self.rows and self._gene_at(self._gene_order[low]) == key:
+            rows.append(self._gene_order[low])
+            low += 1
+        return rows
+
+    def column(self, sample):
+        """
+        Return a sample's values for every gene as a read-only float64 memoryview of the
+        mapped file; numpy.asarray() wraps it without copying.
+
+        Raises:
+        KeyError: If the matrix has no such sample.
+        """
+        column = self._sample_columns[sample]
+        if self._map is None:
+            return memoryview(b'').cast('d')
+        start = self._offset + column * self.rows * ITEM_SIZE
+        return memoryview(self._map)[start:start + self.rows * ITEM_SIZE].cast('d')
+
+    def gene_list_rows(self, genes):
+        """
+        Return the rows of some gene IDs, in the order given and each gene's rows in row
+        order, and the gene IDs the matrix does not have.
+        """
+        rows = []
+        missing = []
+        for gene in genes:
+            gene_rows = self.gene_rows(gene)
+            if not gene_rows:
+                missing.append(gene)
+            rows += gene_rows
+        return rows, missing
+
+    def missing_samples(self, samples):
+        """
+        Return the sample names the matrix does not have, in the order given.
+        """
+        return [sample for sample in samples if sample not in self._sample_columns]
+
+    def iter_chunks(self, rows, samples, chunk_rows=SLICE_CHUNK_ROWS):
+        """
+        Yield (rows, columns) for successive chunks of rows, columns holding each sample's
+        values for those rows as an array('d'). A range of rows is copied out of each column
+        as one slice.
+        """
+        columns = [self.column(sample) for sample in samples]
+        for start in range(0, len(rows), chunk_rows):
+            chunk = rows[start:start + chunk_rows]
+            if isinstance(chunk, range) and chunk.step == 1:
+                values = []
+                for column in columns:
+                    values.append(array('d'))
+                    values[-1].frombytes(column[chunk.start:chunk.stop].cast('B'))
+            else:
+                values = [array('d', [column[row] for row in chunk]) for column in columns]
+            yield chunk, values
+
+    def values(self, rows, samples):
+        """
+        Return {sample: [value per row]} for some rows and samples, reading only those
+        columns. Values are ints when the matrix holds only whole numbers.
+        """
+        convert = int if self.integer else float
+        result = {}
+        for sample in samples:
+            column = self.column(sample)
+            result[sample] = [convert(column[row]) for row in rows]
+        return result
+
+    def close(self):
+        # Columns still in use keep their mapping open until they are released
+        for mapped in (self._map, self._genes):
+            if mapped is not None:
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass
+
+
+def _map_file(path):
+    with open(path, 'rb') as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_slice(store, rows, samples, fmt):
+    """
+    Yield part of a matrix, some rows of some sample columns, as a streamed response body:
+
+    - json: {"samples": [...], "rows": [{"gene": ..., "values": [...]}, ...]}
+    - ndjson: {"samples": [...]}, then one {"gene": ..., "values": [...]} line per row.
+    - npy: a rows x samples float64 .npy array, for numpy.load.
+
+    Values follow the order of rows and samples; in JSON they are ints when the matrix holds
+    only whole numbers.
+    """
+    if fmt == 'npy':
+        yield _npy_header((len(rows), len(samples)), fortran_order=False)
+        for chunk, columns in store.iter_chunks(rows, samples):
+            block = array('d', bytes(len(chunk) * len(samples) * ITEM_SIZE))
+            for sample, values in enumerate(columns):
+                block[sample::len(samples)] = values
+            yield block.tobytes()
+        return
+
+    separator = b',' if fmt == 'json' else b'\n'
+    head = dump_json({"samples": samples})
+    yield head[:-1] + b',"rows":[' if fmt == 'json' else head + b'\n'
+    first = True
+    for chunk, columns in store.iter_chunks(rows, samples):
+        if store.integer:
+            columns = [list(map(int, values)) for values in columns]
+        else:
+            columns = [values.tolist() for values in columns]
+        row_values = zip(*columns) if columns else (() for _ in chunk)
+        body = separator.join(dump_json({"gene": store.gene(row), "values": values})
+                              for row, values in zip(chunk, row_values))
+        if fmt == 'json':
+            yield body if first else separator + body
+        else:
+            yield body + separator
+        first = False
+    if fmt == 'json':
+        yield b']}'
+
+
+_open_stores = OrderedDict()
+_open_stores_lock = Lock()
+
+
+def open_store(store_dir):
+    """
+    Return a CountsStore for store_dir, reusing one opened earlier by this process, so
+    repeated reads of a matrix share its mappings and the pages already read.
+
+    Stores pushed out of the cache are not closed, as a response may still be streaming
+    from one; their mappings are unmapped once the last reference to them is dropped.
+    """
+    with _open_stores_lock:
+        store = _open_stores.pop(store_dir, None)
+        if store is None:
+            store = CountsStore(store_dir)
+            while len(_open_stores) >= STORE_CACHE_SIZE:
+                _open_stores.popitem(last=False)
+        _open_stores[store_dir] = store
+        return store
+
+
+def _convert_task(task):
+    # Runs in a worker process; returns (raw_file_id, store metadata or None if unchanged
+    # or failed, bytes read, error)
+    raw_file_id, path, size, mtime_ns, store_root = task
+    try:
+        before = os.stat(path)
+        if before.st_size == size and before.st_mtime_ns == mtime_ns:
+            return raw_file_id, None, 0, None
+        # A new directory per version of the table, so readers of the old store are not
+        # disturbed until the metadata points at the new one
+        store_dir = os.path.join(store_root, str(raw_file_id), str(before.st_mtime_ns))
+        shutil.rmtree(store_dir, ignore_errors=True)
+        convert_counts(path, store_dir)
+        after = os.stat(path)
+        if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+            shutil.rmtree(store_dir, ignore_errors=True)
+            return raw_file_id, None, 0, "changed while it was converted"
+    except (OSError, EOFError, ValueError, zlib.error) as e:
+        return raw_file_id, None, 0, str(e)
+    return raw_file_id, {STORE_KEY: store_dir, STORE_SIZE_KEY: after.st_size, STORE_MTIME_KEY: after.st_mtime_ns}, after.st_size, None
+
+
+def _remove_old_versions(store_root, raw_file_id, store_dir):
+    versions = os.path.join(store_root, str(raw_file_id))
+    for name in os.listdir(versions):
+        if os.path.join(versions, name) != store_dir:
+            shutil.rmtree(os.path.join(versions, name), ignore_errors=True)
+
+
+def convert_raw_files(conn, dataset_id=None, workers=STORE_WORKERS, root='.', store_root=COUNTS_STORE_DIR,
+                      onprogress=None, onerror=None):
+    """
+    Convert registered counts tables into columnar stores on a process pool and record
+    each store's directory in raw_files_metadata, with the size and mtime of the table it
+    was converted from. Tables that have not changed since are not converted again.
+
+    Args:
+    conn (sqlite3.Connection): The database connection.
+    dataset_id (int): Only this dataset's files; all datasets if None.
+    workers (int): Tables converted at once.
+    root (str): Directory relative raw file paths are resolved against.
+    store_root (str): Directory the stores are written under; their absolute paths are recorded,
+    so the API finds them whatever directory it runs from.
+    onprogress (callable): Called with the counts after every converted table.
+    onerror (callable): Called with (path, message) for each table that could not be converted.
+
+    Returns:
+    dict: Counts of converted, unchanged, skipped and failed files, bytes read, seconds and MB/s.
+    """
+    counts = {"converted": 0, "unchanged": 0, "skipped": 0, "failed": 0, "bytes": 0, "seconds": 0.0, "mb_per_s": 0.0}
+    started = time.perf_counter()
+    store_root = os.path.abspath(store_root)
+
+    # spawn, not fork, so this also works from the API process and its threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+        after = 0
+        while page := raw_files_metadata_page(conn, STORE_KEYS, dataset_id, after):
+            after = page[-1][0]
+            paths = {raw_file_id: path for raw_file_id, path, _ in page}
+            tasks = [(raw_file_id, os.path.join(root, path), int(stored.get(STORE_SIZE_KEY, -1)),
+                      int(stored.get(STORE_MTIME_KEY, -1)), store_root)
+                     for raw_file_id, path, stored in page if stats_kind(path) == 'counts']
+            counts["skipped"] += len(page) - len(tasks)
+            for raw_file_id, metadata, size, error in pool.map(_convert_task, tasks):
+                if error is not None:
+                    counts["failed"] += 1
+                    if onerror is not None:
+                        onerror(paths[raw_file_id], error)
+                    continue
+                if metadata is None:
+                    counts["unchanged"] += 1
+                    continue
+                # Each table is recorded as soon as it is converted, as tables are large
+                replace_raw_files_metadata(conn, STORE_KEYS, [(raw_file_id, metadata)])
+                _remove_old_versions(store_root, raw_file_id, metadata[STORE_KEY])
+                counts["converted"] += 1
+                counts["bytes"] += size
+                counts["seconds"] = round(time.perf_counter() - started, 3)
+                counts["mb_per_s"] = round(counts["bytes"] / 1e6 / counts["seconds"], 1) if counts["seconds"] else 0.0
+                if onprogress is not None:
+                    onprogress(dict(counts))
+    counts["seconds"] = round(time.perf_counter() - started, 3)
+    counts["mb_per_s"] = round(counts["bytes"] / 1e6 / counts["seconds"], 1) if counts["seconds"] else 0.0
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert registered counts tables into memory-mappable columnar stores.')
+    parser.add_argument('database', type=str, nargs='?', default='data/data_redmane.db', help='Path to the SQLite database')
+    parser.add_argument('--dataset_id', type=int, help='Only convert this dataset\'s files')
+    parser.add_argument('--workers', type=int, default=STORE_WORKERS, help='Tables converted at once')
+    parser.add_argument('--root', type=str, default='.', help='Directory relative raw file paths are resolved against')
+    parser.add_argument('--store_dir', type=str, default=COUNTS_STORE_DIR, help='Directory the stores are written under')
+    args = parser.parse_args()
+
+    def print_progress(counts):
+        print(f"{counts['converted']} converted, {counts['unchanged']} unchanged, {counts['failed']} failed, "
+              f"{counts['bytes'] / 1e6:.0f} MB at {counts['mb_per_s']} MB/s")
+
+    def print_error(path, message):
+        print(f"Error converting {path}: {message}")
+
+    conn = configure_connection(sqlite3.connect(args.database))
+    counts = convert_raw_files(conn, args.dataset_id, workers=args.workers, root=args.root,
+                               store_root=args.store_dir, onprogress=print_progress, onerror=print_error)
+    print(json.dumps(counts, indent=2))
+    conn.close()
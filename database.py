@@ -0,0 +1,169 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+# Connection settings applied to every pooled connection
+JOURNAL_MODE = 'WAL'
+SYNCHRONOUS = 'NORMAL'
+MMAP_SIZE = 256 * 1024 * 1024      # bytes of the database file to memory-map
+CACHE_SIZE = -64000                # negative values are KiB, so ~64MB of page cache
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256         # prepared statements kept per connection
+
+
+def configure_connection(conn):
+    """
+    Apply the performance PRAGMAs used by the API to a sqlite3 connection.
+
+    Args:
+    conn (sqlite3.Connection): The connection to configure.
+
+    Returns:
+    sqlite3.Connection: The same connection, for chaining.
+    """
+    cur = conn.cursor()
+    cur.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+    cur.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+    cur.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    cur.execute(f"PRAGMA cache_size = {CACHE_SIZE}")
+    cur.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    cur.execute("PRAGMA temp_store = MEMORY")
+    cur.close()
+    return conn
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    A fixed-size pool of pre-opened, pre-configured SQLite connections.
+
+    Connections are created up front so requests never pay the open/PRAGMA
+    cost, and each keeps its own prepared statement cache between requests.
+    Async handlers use run() so queries execute on a bounded set of worker
+    threads (one per connection) instead of on the event loop.
+    """
+
+    def __init__(self, database, size=8, timeout=30.0):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Counters reported by stats()
+        self._acquisitions = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+        for _ in range(size):
+            self._idle.put(self._connect())
+
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='sqlite')
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        return configure_connection(conn)
+
+    def acquire(self):
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+            waited = False
+        except queue.Empty:
+            waited = True
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._timeouts += 1
+                raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        wait = time.perf_counter() - start
+
+        with self._lock:
+            self._acquisitions += 1
+            if waited:
+                self._waits += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        return conn
+
+    def release(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        # Never hand a half-finished transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a with-block.
+
+        The connection is always returned to the pool, and any transaction
+        left open by a failing query is rolled back first.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def _run_with_connection(self, func, args, kwargs):
+        with self.connection() as conn:
+            return func(conn, *args, **kwargs)
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run func(conn, *args, **kwargs) on a database worker thread and await the result.
+
+        Args:
+        func (callable): A blocking function taking a sqlite3 connection as its first argument.
+
+        Returns:
+        The return value of func. Exceptions raised by func propagate to the caller.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._run_with_connection, func, args, kwargs
+        )
+
+    def stats(self):
+        with self._lock:
+            acquisitions = self._acquisitions
+            return {
+                "size": self.size,
+                "idle": self._idle.qsize(),
+                "in_use": self.size - self._idle.qsize(),
+                "acquisitions": acquisitions,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "total_wait_ms": round(self._total_wait * 1000, 3),
+                "mean_wait_ms": round(self._total_wait * 1000 / acquisitions, 3) if acquisitions else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,331 @@
+import json
+import time
+
+
+# Raw files written per transaction by ingest_raw_files
+INGEST_CHUNK_SIZE = 5000
+
+# Seconds the result of a request with an idempotency key is kept for its retries
+IDEMPOTENCY_TTL = 7 * 24 * 3600
+
+# Longest NDJSON line accepted, so a body without line breaks cannot fill memory
+MAX_NDJSON_LINE_BYTES = 1024 * 1024
+
+
+def _create_staging_tables(cursor):
+    # Per-connection staging tables; the primary keys drop duplicates within a batch
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS ingest_raw_files (
+            dataset_id INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            raw_file_id INTEGER,
+            is_new INTEGER,
+            PRIMARY KEY (dataset_id, path)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS ingest_raw_files_metadata (
+            dataset_id INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            metadata_key TEXT NOT NULL,
+            metadata_value TEXT NOT NULL,
+            PRIMARY KEY (dataset_id, path, metadata_key, metadata_value)
+        )
+    ''')
+
+
+def _ingest_chunk(conn, chunk):
+    """
+    Upsert one chunk of raw files and their metadata in a single transaction.
+
+    Returns:
+    tuple: (inserted, updated) counts for the chunk. A file is updated when it already
+    existed and gained at least one new metadata row.
+    """
+    cursor = conn.cursor()
+    _create_staging_tables(cursor)
+    # Take the write lock up front: a deferred transaction that reads raw_files and then
+    # writes fails with "database is locked" if another ingest committed in between
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("DELETE FROM temp.ingest_raw_files")
+    cursor.execute("DELETE FROM temp.ingest_raw_files_metadata")
+
+    cursor.executemany(
+        "INSERT OR IGNORE INTO temp.ingest_raw_files (dataset_id, path) VALUES (?, ?)",
+        [(raw_file.dataset_id, raw_file.path) for raw_file in chunk],
+    )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO temp.ingest_raw_files_metadata (dataset_id, path, metadata_key, metadata_value) VALUES (?, ?, ?, ?)",
+        [(raw_file.dataset_id, raw_file.path, metadata.metadata_key, metadata.metadata_value)
+         for raw_file in chunk for metadata in (raw_file.metadata or [])],
+    )
+
+    cursor.execute('''
+        UPDATE temp.ingest_raw_files
+        SET raw_file_id = (SELECT rf.id FROM raw_files rf
+                           WHERE rf.dataset_id = ingest_raw_files.dataset_id AND rf.path = ingest_raw_files.path)
+    ''')
+    cursor.execute("UPDATE temp.ingest_raw_files SET is_new = (raw_file_id IS NULL)")
+
+    cursor.execute('''
+        INSERT INTO raw_files (dataset_id, path)
+        SELECT dataset_id, path FROM temp.ingest_raw_files WHERE is_new
+        ON CONFLICT (dataset_id, path) DO NOTHING
+    ''')
+    inserted = cursor.rowcount
+
+    cursor.execute('''
+        UPDATE temp.ingest_raw_files
+        SET raw_file_id = (SELECT rf.id FROM raw_files rf
+                           WHERE rf.dataset_id = ingest_raw_files.dataset_id AND rf.path = ingest_raw_files.path)
+        WHERE is_new
+    ''')
+
+    # Existing files that are about to gain metadata they did not have
+    cursor.execute('''
+        SELECT COUNT(DISTINCT f.raw_file_id)
+        FROM temp.ingest_raw_files_metadata m
+        JOIN temp.ingest_raw_files f ON f.dataset_id = m.dataset_id AND f.path = m.path
+        WHERE NOT f.is_new AND NOT EXISTS (
+            SELECT 1 FROM raw_files_metadata rfm
+            WHERE rfm.raw_file_id = f.raw_file_id
+              AND rfm.metadata_key = m.metadata_key
+              AND rfm.metadata_value = m.metadata_value
+        )
+    ''')
+    updated = cursor.fetchone()[0]
+
+    cursor.execute('''
+        INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value)
+        SELECT f.raw_file_id, m.metadata_key, m.metadata_value
+        FROM temp.ingest_raw_files_metadata m
+        JOIN temp.ingest_raw_files f ON f.dataset_id = m.dataset_id AND f.path = m.path
+        WHERE true
+        ON CONFLICT (raw_file_id, metadata_key, metadata_value) DO NOTHING
+    ''')
+
+    conn.commit()
+    return inserted, updated
+
+
+def ingest_raw_files(conn, raw_files, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    Register raw files and their metadata idempotently, committing every chunk_size files.
+
+    Re-sending a file that is already registered never fails: it is counted as updated if it
+    brings new metadata rows, otherwise as skipped.
+
+    Args:
+    conn (sqlite3.Connection): The database connection.
+    raw_files (iterable): RawFileCreate-like objects with dataset_id, path and metadata.
+    chunk_size (int): Number of files per transaction.
+
+    Returns:
+    dict: Counts of inserted, updated and skipped files.
+    """
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
+    chunk = []
+
+    def flush():
+        inserted, updated = _ingest_chunk(conn, chunk)
+        counts["inserted"] += inserted
+        counts["updated"] += updated
+        counts["skipped"] += len(chunk) - inserted - updated
+        chunk.clear()
+
+    for raw_file in raw_files:
+        chunk.append(raw_file)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return counts
+
+
+def _remove_chunk(conn, chunk):
+    """
+    Delete one chunk of raw files and their metadata in a single transaction.
+
+    Returns:
+    int: Number of files deleted; paths that are not registered are ignored.
+    """
+    cursor = conn.cursor()
+    _create_staging_tables(cursor)
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("DELETE FROM temp.ingest_raw_files")
+
+    cursor.executemany(
+        "INSERT OR IGNORE INTO temp.ingest_raw_files (dataset_id, path) VALUES (?, ?)",
+        [(raw_file.dataset_id, raw_file.path) for raw_file in chunk],
+    )
+    cursor.execute('''
+        UPDATE temp.ingest_raw_files
+        SET raw_file_id = (SELECT rf.id FROM raw_files rf
+                           WHERE rf.dataset_id = ingest_raw_files.dataset_id AND rf.path = ingest_raw_files.path)
+    ''')
+
+    # Metadata first: its triggers look up the file's dataset
+    cursor.execute('''
+        DELETE FROM raw_files_metadata
+        WHERE raw_file_id IN (SELECT raw_file_id FROM temp.ingest_raw_files WHERE raw_file_id IS NOT NULL)
+    ''')
+    cursor.execute('''
+        DELETE FROM raw_files
+        WHERE id IN (SELECT raw_file_id FROM temp.ingest_raw_files WHERE raw_file_id IS NOT NULL)
+    ''')
+    removed = cursor.rowcount
+
+    conn.commit()
+    return removed
+
+
+def remove_raw_files(conn, raw_files, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    Delete registered raw files and all their metadata, committing every chunk_size files.
+
+    Args:
+    conn (sqlite3.Connection): The database connection.
+    raw_files (iterable): Objects with dataset_id and path.
+    chunk_size (int): Number of files per transaction.
+
+    Returns:
+    dict: Counts of removed files and of files that were not registered.
+    """
+    counts = {"removed": 0, "missing": 0}
+    chunk = []
+
+    def flush():
+        removed = _remove_chunk(conn, chunk)
+        counts["removed"] += removed
+        counts["missing"] += len(chunk) - removed
+        chunk.clear()
+
+    for raw_file in raw_files:
+        chunk.append(raw_file)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return counts
+
+
+def run_once(conn, key, func, *args):
+    """
+    Run func(conn, *args) unless a request with the same idempotency key already has, and
+    return the result of the first run either way.
+
+    The writes themselves are idempotent, so this is not needed for correctness: it keeps a
+    retried upload chunk from being written again, and from reporting the files its first
+    attempt inserted as skipped.
+
+    Args:
+    conn (sqlite3.Connection): The database connection.
+    key (str): The request's idempotency key, or None to always run func.
+    func (callable): The write, returning a JSON-serializable result.
+    """
+    if key is None:
+        return func(conn, *args)
+
+    row = conn.execute("SELECT result FROM ingest_requests WHERE key = ?", (key,)).fetchone()
+    if row:
+        return json.loads(row[0])
+
+    result = func(conn, *args)
+    now = time.time()
+    conn.execute("INSERT OR IGNORE INTO ingest_requests (key, result, created_at) VALUES (?, ?, ?)",
+                 (key, json.dumps(result), now))
+    conn.execute("DELETE FROM ingest_requests WHERE created_at < ?", (now - IDEMPOTENCY_TTL,))
+    conn.commit()
+    return result
+
+
+def raw_files_metadata_page(conn, keys, dataset_id=None, after=0, limit=10000):
+    """
+    Return a keyset page of registered raw files with the values of some of their metadata
+    keys, for pipelines that compute per-file metadata.
+
+    Args:
+    conn (sqlite3.Connection): The database connection.
+    keys (list): The metadata keys to return; each is expected to hold one value per file.
+    dataset_id (int): Only this dataset's files; all datasets if None.
+    after (int): Return files with a higher id than this.
+    limit (int): Most files returned.
+
+    Returns:
+    list: (raw_file_id, path, {key: value}) tuples in id order; absent keys are left out.
+    """
+    placeholders = ', '.join('?' * len(keys))
+    rows = conn.execute(f'''
+        SELECT rf.id, rf.path, json_group_object(m.metadata_key, m.metadata_value)
+            FILTER (WHERE m.metadata_key IS NOT NULL)
+        FROM raw_files rf
+        LEFT JOIN raw_files_metadata m ON m.raw_file_id = rf.id AND m.metadata_key IN ({placeholders})
+        WHERE rf.id > ? AND (? IS NULL OR rf.dataset_id = ?) AND rf.path IS NOT NULL
+        GROUP BY rf.id
+        ORDER BY rf.id
+        LIMIT ?
+    ''', (*keys, after, dataset_id, dataset_id, limit)).fetchall()
+    return [(raw_file_id, path, json.loads(values) if values else {}) for raw_file_id, path, values in rows]
+
+
+def replace_raw_files_metadata(conn, keys, files):
+    """
+    Replace the values of some metadata keys of many raw files in one transaction: each
+    file's rows for keys are deleted and its new values inserted.
+
+    Args:
+    conn (sqlite3.Connection): The database connection.
+    keys (list): The metadata keys being replaced.
+    files (list): (raw_file_id, {key: value}) pairs; values are stored as strings.
+    """
+    placeholders = ', '.join('?' * len(keys))
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.executemany(
+        f"DELETE FROM raw_files_metadata WHERE raw_file_id = ? AND metadata_key IN ({placeholders})",
+        [(raw_file_id, *keys) for raw_file_id, _ in files])
+    cursor.executemany(
+        "INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value) VALUES (?, ?, ?)",
+        [(raw_file_id, key, str(value)) for raw_file_id, values in files for key, value in values.items()])
+    conn.commit()
+
+
+async def iter_ndjson(stream):
+    """
+    Parse an async stream of bytes as newline-delimited JSON, yielding one object per line
+    without holding more than one partial line in memory.
+
+    Each chunk is searched for line breaks once, and the pieces of a line spanning chunks
+    are only joined when its end arrives, so long lines cost linear time.
+
+    Yields:
+    tuple: (line_number, parsed object). Blank lines are ignored.
+
+    Raises:
+    ValueError: If a line is longer than MAX_NDJSON_LINE_BYTES (json.JSONDecodeError, also a
+    ValueError, if a line is not valid JSON).
+    """
+    pieces = []
+    pending = 0
+    line_number = 0
+    async for data in stream:
+        start = 0
+        while (end := data.find(b'\n', start)) != -1:
+            pieces.append(data[start:end])
+            line = b''.join(pieces)
+            pieces.clear()
+            pending = 0
+            line_number += 1
+            if len(line) > MAX_NDJSON_LINE_BYTES:
+                raise ValueError(f"line {line_number} is longer than {MAX_NDJSON_LINE_BYTES} bytes")
+            if line.strip():
+                yield line_number, json.loads(line)
+            start = end + 1
+        if start < len(data):
+            pieces.append(data[start:])
+            pending += len(data) - start
+            if pending > MAX_NDJSON_LINE_BYTES:
+                raise ValueError(f"line {line_number + 1} is longer than {MAX_NDJSON_LINE_BYTES} bytes")
+    line = b''.join(pieces)
+    if line.strip():
+        yield line_number + 1, json.loads(line)
@@ -1,117 +1,55 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Header, Path, Query, Request
+import json
+import os
 import sqlite3
-from pydantic import BaseModel
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from database import ConnectionPool, PoolTimeout
+from ingest import INGEST_CHUNK_SIZE, ingest_raw_files, iter_ndjson, remove_raw_files, run_once
+from migrations import migrate
+from cache import ResponseCache, cached_response
+from serialization import serializer_for
+from metadata_filter import FILTERABLE, ids_param, matching_ids, matching_ids_query, parse_predicates, predicates_key
+from pagination import NEXT_AFTER_HEADER, keyset_upper_bound, next_after_headers, streaming_response
+from scan_jobs import ScanJobRunner, fail_orphaned_jobs
+from checksums import fetch_duplicate_checksums
+from counts_store import SLICE_MEDIA_TYPES, STORE_KEY, iter_slice, open_store
 
-app = FastAPI()
+DATABASE = 'data/data_redmane.db'
 
-# Allow all origins (for development, consider restricting to specific origins in production)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3001"],
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE"],
-    allow_headers=["*"],
-)
+# Size the pool to the number of requests a single worker serves concurrently
+DB_POOL_SIZE = int(os.environ.get('REDMANE_DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('REDMANE_DB_POOL_TIMEOUT', 30))
 
-DATABASE = 'data/data_redmane.db'
+# Bounds of the per-worker response cache
+CACHE_MAX_ENTRIES = int(os.environ.get('REDMANE_CACHE_MAX_ENTRIES', 1024))
+CACHE_MAX_BYTES = int(os.environ.get('REDMANE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Scan jobs run at once per API worker, each in its own process
+SCAN_JOB_WORKERS = int(os.environ.get('REDMANE_SCAN_JOB_WORKERS', 2))
+# Scan jobs may only scan directories inside this one; without it they are refused, as a
+# scan registers whatever files the server can read
+SCAN_ROOT = os.environ.get('REDMANE_SCAN_ROOT')
 
-# Initialize the database and create the tables if they don't exist
-def init_db():
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS projects (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        status TEXT
-    );
-    ''')
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS datasets (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        project_id INTEGER NOT NULL,
-        name TEXT,
-        FOREIGN KEY (project_id) REFERENCES projects(id)
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS datasets_metadata (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        dataset_id INTEGER NOT NULL,
-        key TEXT NOT NULL,
-        value TEXT NOT NULL
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS patients (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        project_id INTEGER NOT NULL,
-        ext_patient_id TEXT,
-        ext_patient_url TEXT,
-        public_patient_id TEXT,
-        FOREIGN KEY (project_id) REFERENCES projects(id)
-    );
-    ''')
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS patients_metadata (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        patient_id INTEGER NOT NULL,
-        key TEXT,
-        value TEXT,
-        FOREIGN KEY (patient_id) REFERENCES patients(id)
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS samples (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        patient_id INTEGER NOT NULL,
-        ext_sample_id TEXT,
-        ext_sample_url TEXT,
-        FOREIGN KEY (patient_id) REFERENCES patients(id)
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS samples_metadata (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        sample_id INTEGER NOT NULL,
-        key TEXT,
-        value TEXT,
-        FOREIGN KEY (sample_id) REFERENCES samples(id)
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS raw_files (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        dataset_id INTEGER NOT NULL,
-        path TEXT,
-        UNIQUE(dataset_id, path),
-        FOREIGN KEY (dataset_id) REFERENCES datasets(id)
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS raw_files_metadata (
-        metadata_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        raw_file_id INTEGER,
-        metadata_key TEXT NOT NULL,
-        metadata_value TEXT NOT NULL,
-        FOREIGN KEY (raw_file_id) REFERENCES raw_files (id)
-    );
-    ''')
-from fastapi import FastAPI, HTTPException
-import sqlite3
-from pydantic import BaseModel
-from typing import List, Optional
-from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+# Open the connection pool on startup and close it on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.db_pool = ConnectionPool(DATABASE, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT)
+    app.state.response_cache = ResponseCache(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES)
+    app.state.scan_jobs = ScanJobRunner(DATABASE, workers=SCAN_JOB_WORKERS)
+    yield
+    app.state.scan_jobs.close()
+    app.state.db_pool.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow all origins (for development, consider restricting to specific origins in production)
 app.add_middleware(
@@ -120,111 +58,48 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=[NEXT_AFTER_HEADER],
 )
 
-DATABASE = 'data/data_redmane.db'
-
-# Initialize the database and create the tables if they don't exist
+# Initialize the database and bring its schema up to date
 def init_db():
     conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS projects (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        status TEXT
-    );
-    ''')
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS datasets (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        project_id INTEGER NOT NULL,
-        name TEXT,
-        FOREIGN KEY (project_id) REFERENCES projects(id)
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS datasets_metadata (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        dataset_id INTEGER NOT NULL,
-        key TEXT NOT NULL,
-        value TEXT NOT NULL
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS patients (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        project_id INTEGER NOT NULL,
-        ext_patient_id TEXT,
-        ext_patient_url TEXT,
-        public_patient_id TEXT,
-        FOREIGN KEY (project_id) REFERENCES projects(id)
-    );
-    ''')
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS patients_metadata (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        patient_id INTEGER NOT NULL,
-        key TEXT,
-        value TEXT,
-        FOREIGN KEY (patient_id) REFERENCES patients(id)
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS samples (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        patient_id INTEGER NOT NULL,
-        ext_sample_id TEXT,
-        ext_sample_url TEXT,
-        FOREIGN KEY (patient_id) REFERENCES patients(id)
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS samples_metadata (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        sample_id INTEGER NOT NULL,
-        key TEXT,
-        value TEXT,
-        FOREIGN KEY (sample_id) REFERENCES samples(id)
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS raw_files (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        dataset_id INTEGER NOT NULL,
-        path TEXT,
-        FOREIGN KEY (dataset_id) REFERENCES datasets(id)
-    );
-    ''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS raw_files_metadata (
-        metadata_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        raw_file_id INTEGER,
-        metadata_key TEXT NOT NULL,
-        metadata_value TEXT NOT NULL,
-        FOREIGN KEY (raw_file_id) REFERENCES raw_files (id)
-    );
-    ''')
-
-    conn.commit()
+    migrate(conn)
+    fail_orphaned_jobs(conn)
     conn.close()
 
 # Call the function to initialize the database
 init_db()
 
 
+# Dependency giving handlers the connection pool; queries are awaited with db.run(...)
+# so blocking sqlite3 work happens on the pool's worker threads, not the event loop
+def get_db(request: Request) -> ConnectionPool:
+    return request.app.state.db_pool
+
+# Dependency giving handlers the response cache
+def get_cache(request: Request) -> ResponseCache:
+    return request.app.state.response_cache
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
 # Pydantic model for Project
 class Project(BaseModel):
     id: int
     name: str
     status: str
 
+# Pydantic model for Project with its totals
+class ProjectSummary(Project):
+    patient_count: int
+    sample_count: int
+    dataset_count: int
+    raw_file_count: int
+    raw_bytes: int
+
 # Pydantic model for Dataset
 class Dataset(BaseModel):
     id: int
@@ -311,788 +186,948 @@ class RawFileCreate(BaseModel):
     metadata: Optional[List[RawFileMetadataCreate]] = []
 
 
+# Response for bulk raw file registration
+class RawFileIngestResult(BaseModel):
+    status: str
+    message: str
+    inserted: int
+    updated: int
+    skipped: int
 
-@app.post("/add_raw_files/")
-async def add_raw_files(raw_files: List[RawFileCreate]):
-    try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-
-        # Insert raw_files and fetch their IDs
-        raw_file_ids = []
-        for raw_file in raw_files:
-            cursor.execute('''
-                INSERT INTO raw_files (dataset_id, path)
-                VALUES (?, ?)
-            ''', (raw_file.dataset_id, raw_file.path))
-            raw_file_id = cursor.lastrowid
-            raw_file_ids.append(raw_file_id)
-
-            # Insert associated metadata for this raw_file
-            if raw_file.metadata:
-                for metadata in raw_file.metadata:
-                    cursor.execute('''
-                        INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value)
-                        VALUES (?, ?, ?)
-                    ''', (raw_file_id, metadata.metadata_key, metadata.metadata_value))
+# Raw file to unregister, e.g. because the tracker found it deleted
+class RawFileRemove(BaseModel):
+    dataset_id: int
+    path: str
 
-        conn.commit()
-        conn.close()
-        return {"status": "success", "message": "Raw files and metadata added successfully"}
+# Response for bulk raw file removal
+class RawFileRemoveResult(BaseModel):
+    status: str
+    message: str
+    removed: int
+    missing: int
+
+# Pydantic models for metadata value counts
+class FacetValue(BaseModel):
+    value: str
+    count: int
+
+class Facet(BaseModel):
+    key: str
+    values: List[FacetValue] = []
+
+# Clients retrying a request send the same Idempotency-Key header to get the first attempt's result
+@app.post("/add_raw_files/", response_model=RawFileIngestResult)
+async def add_raw_files(raw_files: List[RawFileCreate], db: ConnectionPool = Depends(get_db),
+                        cache: ResponseCache = Depends(get_cache), idempotency_key: Optional[str] = Header(None)):
+    try:
+        key = f'add_raw_files:{idempotency_key}' if idempotency_key else None
+        counts = await db.run(run_once, key, ingest_raw_files, raw_files)
+        for dataset_id in {raw_file.dataset_id for raw_file in raw_files}:
+            cache.invalidate(('dataset', dataset_id))
+        return {"status": "success", "message": "Raw files and metadata added successfully", **counts}
 
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-# Route to fetch all patients and their metadata for a project_id
-@app.get("/patients_metadata/{patient_id}", response_model=List[PatientWithSamples])
-async def get_patients_metadata(project_id: int,patient_id: int):
+# Same as /add_raw_files/ but takes one RawFileCreate JSON object per line, parsed as the
+# body arrives and written in chunks, so very large scans never sit in memory as one list
+@app.post("/add_raw_files/ndjson", response_model=RawFileIngestResult)
+async def add_raw_files_ndjson(request: Request, db: ConnectionPool = Depends(get_db),
+                               cache: ResponseCache = Depends(get_cache)):
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
+    chunk = []
+
+    async def flush():
+        chunk_counts = await db.run(ingest_raw_files, chunk)
+        for key in counts:
+            counts[key] += chunk_counts[key]
+        for dataset_id in {raw_file.dataset_id for raw_file in chunk}:
+            cache.invalidate(('dataset', dataset_id))
+        chunk.clear()
+
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async for line_number, item in iter_ndjson(request.stream()):
+            try:
+                chunk.append(RawFileCreate(**item))
+            except (TypeError, ValidationError) as e:
+                raise HTTPException(status_code=422, detail=f"Invalid raw file on line {line_number}: {e}")
+            if len(chunk) >= INGEST_CHUNK_SIZE:
+                await flush()
+        if chunk:
+            await flush()
+        return {"status": "success", "message": "Raw files and metadata added successfully", **counts}
+
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid NDJSON after {counts} were committed: {e}")
+    except ValueError as e:
+        # A line over MAX_NDJSON_LINE_BYTES
+        raise HTTPException(status_code=413, detail=f"NDJSON {e}, after {counts} were committed")
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error after {counts} were committed: {e}")
 
+@app.post("/remove_raw_files/", response_model=RawFileRemoveResult)
+async def post_remove_raw_files(raw_files: List[RawFileRemove], db: ConnectionPool = Depends(get_db),
+                                cache: ResponseCache = Depends(get_cache), idempotency_key: Optional[str] = Header(None)):
+    try:
+        key = f'remove_raw_files:{idempotency_key}' if idempotency_key else None
+        counts = await db.run(run_once, key, remove_raw_files, raw_files)
+        for dataset_id in {raw_file.dataset_id for raw_file in raw_files}:
+            cache.invalidate(('dataset', dataset_id))
+        return {"status": "success", "message": "Raw files and metadata removed successfully", **counts}
 
-        if patient_id != 0:
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-            cursor.execute('''
-                SELECT p.id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id,
-                       pm.id, pm.key, pm.value
-                FROM patients p
-                LEFT JOIN patients_metadata pm ON p.id = pm.patient_id
-                WHERE p.project_id = ? and p.id = ?
-                ORDER BY p.id
-            ''', (project_id,patient_id,))
-        else:
-    
-            cursor.execute('''
-                SELECT p.id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id,
-                       pm.id, pm.key, pm.value
-                FROM patients p
-                LEFT JOIN patients_metadata pm ON p.id = pm.patient_id
-                WHERE p.project_id = ?
-                ORDER BY p.id
-            ''', (project_id,))
-
-        rows = cursor.fetchall()
-
-        patients = []
-        current_patient = None
-        for row in rows:
-
-            if not current_patient or current_patient['id'] != row[0]:
-
-                if current_patient:
-                    patients.append(current_patient)
-
-                current_patient = {
-                    'id': row[0],
-                    'project_id': row[1],
-                    'ext_patient_id': row[2],
-                    'ext_patient_url': row[3],
-                    'public_patient_id': row[4],
-                    'samples': [],
-                    'metadata': [] 
-                }
+def fetch_patients_metadata(conn, project_id, patient_id, after=0, limit=None):
+    cursor = conn.cursor()
 
-            if row[5]:
-                current_patient['metadata'].append({
-                    'id': row[5],
-                    'patient_id': row[0],
-                    'key': row[6],
-                    'value': row[7]
-                })
-
-        if current_patient:
-            patients.append(current_patient)
-
-
-        for patient in patients:
-            cursor.execute('''
-                SELECT s.id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
-                       sm.id, sm.key, sm.value
-                FROM samples s
-                LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
-                WHERE s.patient_id = ?
-                ORDER BY s.id
-            ''', (patient['id'],))
-
-            sample_rows = cursor.fetchall()
-            current_sample = None
-            for sample_row in sample_rows:
-                if not current_sample or current_sample['id'] != sample_row[0]:
-                    if current_sample:
-                        patient['samples'].append(current_sample)
-                    current_sample = {
-                        'id': sample_row[0],
-                        'patient_id': sample_row[1],
-                        'ext_sample_id': sample_row[2],
-                        'ext_sample_url': sample_row[3],
-                        'metadata': []
-                    }
-                if sample_row[4]:
-                    current_sample['metadata'].append({
-                        'id': sample_row[4],
-                        'sample_id': sample_row[0],
-                        'key': sample_row[5],
-                        'value': sample_row[6]
-                    })
-            if current_sample:
-                patient['samples'].append(current_sample)
+    if patient_id != 0:
+        return select_patients_with_samples(cursor, "p.project_id = ? and p.id = ?", (project_id, patient_id))
 
-        conn.close()
+    # Keyset page of patients: id > after, up to limit patients
+    upper = keyset_upper_bound(cursor, '''
+        SELECT id FROM patients WHERE project_id = ? AND id > ?
+    ''', (project_id, after), limit)
 
-        return patients
+    return select_patients_with_samples(cursor, "p.project_id = ? AND p.id > ? AND p.id <= ?", (project_id, after, upper))
 
-    except sqlite3.Error as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+def select_patients_with_samples(cursor, where, params):
+    """
+    Fetch the patients matching where, with their metadata, samples and sample metadata,
+    in id order. where may refer to the patients table as p.
+    """
+    cursor.execute(f'''
+        SELECT p.id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id,
+               pm.id, pm.key, pm.value
+        FROM patients p
+        LEFT JOIN patients_metadata pm ON p.id = pm.patient_id
+        WHERE {where}
+        ORDER BY p.id, pm.id
+    ''', params)
 
-# Route to fetch all samples and metadata for a project_id and include patient information
-@app.get("/samples/{sample_id}", response_model=List[Sample])
-async def get_samples_per_patient(sample_id: int, project_id: int):
-    try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-
-        if sample_id != 0:
-            cursor.execute('''
-                SELECT s.id AS sample_id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
-                       sm.id AS metadata_id, sm.key, sm.value,
-                       p.id AS patient_id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id
-                FROM samples s
-                LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
-                LEFT JOIN patients p ON s.patient_id = p.id
-                WHERE p.project_id = ? and s.id = ?
-                ORDER BY s.id, sm.id
-            ''', (project_id,sample_id,))
-        else:
-            cursor.execute('''
-                SELECT s.id AS sample_id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
-                       sm.id AS metadata_id, sm.key, sm.value,
-                       p.id AS patient_id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id
-                FROM samples s
-                LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
-                LEFT JOIN patients p ON s.patient_id = p.id
-                WHERE p.project_id = ?
-                ORDER BY s.id, sm.id
-            ''', (project_id,))
- 
-
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        samples = []
-        current_sample = None
-        for row in rows:
-            if not current_sample or current_sample['id'] != row[0]:
-                if current_sample:
-                    samples.append(current_sample)
-                current_sample = {
-                    'id': row[0],
-                    'patient_id': row[1],
-                    'ext_sample_id': row[2],
-                    'ext_sample_url': row[3],
-                    'metadata': [],
-                    'patient': {
-                        'id': row[7],
-                        'project_id': row[8],
-                        'ext_patient_id': row[9],
-                        'ext_patient_url': row[10],
-                        'public_patient_id': row[11]
-                    }
-                }
+    rows = cursor.fetchall()
 
-            if row[4]:  # Check if metadata exists
-                current_sample['metadata'].append({
-                    'id': row[4],
-                    'sample_id': row[0],
-                    'key': row[5],
-                    'value': row[6]
-                })
+    patients = []
+    current_patient = None
+    for row in rows:
 
-        if current_sample:
-            samples.append(current_sample)
+        if not current_patient or current_patient['id'] != row[0]:
 
-        return samples
+            if current_patient:
+                patients.append(current_patient)
 
-    except sqlite3.Error as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {e}")
-
-# Route to fetch all patients with sample counts
-@app.get("/patients/{patient_id}", response_model=List[PatientWithSampleCount])
-async def get_patients(project_id: int, patient_id: int):
-    try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-
-        # Query to fetch all patients with sample counts
-        cursor.execute('''
-            SELECT patients.id, patients.project_id, patients.ext_patient_id, patients.ext_patient_url,
-                   patients.public_patient_id, COUNT(samples.id) AS sample_count
-            FROM patients
-            LEFT JOIN samples ON patients.id = samples.patient_id
-            WHERE patients.project_id = ?
-            GROUP BY patients.id
-            ORDER BY patients.id
-        ''', (project_id,))
-
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        patients = []
-        for row in rows:
-            patients.append({
+            current_patient = {
                 'id': row[0],
                 'project_id': row[1],
                 'ext_patient_id': row[2],
                 'ext_patient_url': row[3],
                 'public_patient_id': row[4],
-                'sample_count': row[5]
+                'metadata': [],
+                'samples': []
+            }
+
+        if row[5]:
+            current_patient['metadata'].append({
+                'id': row[5],
+                'patient_id': row[0],
+                'key': row[6],
+                'value': row[7]
             })
-        
-        return patients
-    
-    except sqlite3.Error as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-# Route to fetch all projects and their statuses
-@app.get("/projects/", response_model=List[Project])
-async def get_projects():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, status FROM projects")
-    rows = cursor.fetchall()
-    conn.close()
-    return [Project(id=row[0], name=row[1], status=row[2]) for row in rows]
+    if current_patient:
+        patients.append(current_patient)
 
-# Route to fetch all datasets
-@app.get("/datasets/{dataset_id}", response_model=List[Dataset])
-async def get_datasets(dataset_id: int, project_id: int):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    if dataset_id != 0:
-        cursor.execute('''SELECT id, project_id, name FROM datasets where project_id = ? and dataset_id = ?''', (project_id,dataset_id,))
-    else:
-        cursor.execute('''SELECT id, project_id, name FROM datasets where project_id = ?''', (project_id,))
+    # Fetch the samples and sample metadata of every selected patient in one query,
+    # instead of one query per patient, and attach them in a single pass
+    patients_by_id = {patient['id']: patient for patient in patients}
+    if not patients_by_id:
+        return patients
 
+    cursor.execute(f'''
+        SELECT s.id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
+               sm.id, sm.key, sm.value
+        FROM samples s
+        JOIN patients p ON s.patient_id = p.id
+        LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
+        WHERE {where}
+        ORDER BY s.patient_id, s.id, sm.id
+    ''', params)
+
+    current_sample = None
+    for sample_row in cursor:
+        if not current_sample or current_sample['id'] != sample_row[0]:
+            current_sample = {
+                'id': sample_row[0],
+                'patient_id': sample_row[1],
+                'ext_sample_id': sample_row[2],
+                'ext_sample_url': sample_row[3],
+                'metadata': []
+            }
+            patients_by_id[sample_row[1]]['samples'].append(current_sample)
+        if sample_row[4]:
+            current_sample['metadata'].append({
+                'id': sample_row[4],
+                'sample_id': sample_row[0],
+                'key': sample_row[5],
+                'value': sample_row[6]
+            })
 
-    rows = cursor.fetchall()
-    conn.close()
-    return [Dataset(id=row[0], project_id=row[1], name=row[2]) for row in rows]
+    return patients
 
+serialize_patients_with_samples = serializer_for(List[PatientWithSamples])
 
-# Endpoint to fetch dataset details and metadata by dataset_id
-@app.get("/datasets_with_metadata/{dataset_id}", response_model=DatasetWithMetadata)
-async def get_dataset_with_metadata(dataset_id: int, project_id: int):
+# Route to fetch all patients and their metadata for a project_id
+@app.get("/patients_metadata/{patient_id}", response_model=List[PatientWithSamples])
+async def get_patients_metadata(project_id: int,patient_id: int, request: Request,
+                                after: int = 0, limit: Optional[int] = Query(None, ge=1),
+                                stream: Optional[str] = Query(None, pattern='^(ndjson|json)$'),
+                                db: ConnectionPool = Depends(get_db), cache: ResponseCache = Depends(get_cache)):
+    if stream and patient_id == 0:
+        return streaming_response(db, partial(fetch_patients_metadata, project_id=project_id, patient_id=0), after, limit, stream)
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Fetch dataset details
-        cursor.execute('''
-            SELECT id, project_id, name
-            FROM datasets
-            WHERE id = ? AND project_id = ?
-        ''', (dataset_id, project_id))
-        dataset_row = cursor.fetchone()
-        
-        if not dataset_row:
-            raise HTTPException(status_code=404, detail="Dataset not found")
-
-        # Fetch dataset metadata
-        cursor.execute('''
-            SELECT id, dataset_id, key, value
-            FROM datasets_metadata
-            WHERE dataset_id = ?
-        ''', (dataset_id,))
-        metadata_rows = cursor.fetchall()
-        
-        conn.close()
-        
-        dataset = {
-            "id": dataset_row[0],
-            "project_id": dataset_row[1],
-            "name": dataset_row[2],
-            "metadata": [{"id": row[0], "dataset_id": row[1], "key": row[2], "value": row[3]} for row in metadata_rows]
-        }
-
-        return dataset
+        return await cached_response(
+            request, db, cache, ('patients_metadata', project_id, patient_id, after, limit),
+            [('project', project_id)], serialize_patients_with_samples,
+            fetch_patients_metadata, project_id, patient_id, after, limit,
+            headers_for=partial(next_after_headers, limit=limit))
 
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
+def fetch_patients_by_metadata(conn, project_id, predicates, after=0, limit=None):
+    ids = matching_ids(conn, 'patients', project_id, predicates, after, limit)
+    if not ids:
+        return []
+    return select_patients_with_samples(conn.cursor(), "p.id IN (SELECT value FROM json_each(?))", (ids_param(ids),))
+
+# Route to fetch the patients of a project whose metadata matches every filter, with their samples,
+# e.g. ?project_id=1&where=smoking=yes&where=age_range=45-54
+@app.get("/patients_by_metadata/", response_model=List[PatientWithSamples])
+async def get_patients_by_metadata(project_id: int, request: Request,
+                                   where: List[str] = Query(..., description="key=value; repeat a key to match any of its values"),
+                                   after: int = 0, limit: Optional[int] = Query(None, ge=1),
+                                   stream: Optional[str] = Query(None, pattern='^(ndjson|json)$'),
+                                   db: ConnectionPool = Depends(get_db), cache: ResponseCache = Depends(get_cache)):
+    try:
+        predicates = parse_predicates(where)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if stream:
+        return streaming_response(db, partial(fetch_patients_by_metadata, project_id=project_id, predicates=predicates), after, limit, stream)
+    try:
+        return await cached_response(
+            request, db, cache, ('patients_by_metadata', project_id, predicates_key(predicates), after, limit),
+            [('project', project_id)], serialize_patients_with_samples,
+            fetch_patients_by_metadata, project_id, predicates, after, limit,
+            headers_for=partial(next_after_headers, limit=limit))
 
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-# Run the app using Uvicorn server
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="localhost", port=8888)
-
-
-    conn.commit()
-    conn.close()
-
-# Call the function to initialize the database
-init_db()
-
-# Pydantic model for Project
-class Project(BaseModel):
-    id: int
-    name: str
-    status: str
-
-# Pydantic model for Dataset
-class Dataset(BaseModel):
-    id: int
-    project_id: int
-    name: str
-
-class DatasetMetadata(BaseModel):
-    id: int
-    dataset_id: int
-    key: str
-    value: str
-
-class DatasetWithMetadata(Dataset):
-    metadata: List[DatasetMetadata] = []
-
+def fetch_facets(conn, entity, project_id, keys=None, predicates=None):
+    cursor = conn.cursor()
+    key_filter = f" AND key IN ({', '.join('?' for _ in keys)})" if keys else ''
+
+    if not predicates:
+        # Unfiltered counts are kept up to date by triggers
+        cursor.execute(f'''
+            SELECT key, value, count FROM metadata_facets
+            WHERE entity = ? AND project_id = ?{key_filter}
+            ORDER BY key, count DESC, value
+        ''', (entity, project_id, *(keys or [])))
+    else:
+        # Filtered counts are taken over the metadata of the matching entities only
+        metadata_table, _, id_column, _ = FILTERABLE[entity]
+        ids_query, ids_params = matching_ids_query(cursor, entity, project_id, predicates)
+        cursor.execute(f'''
+            SELECT key, value, COUNT(DISTINCT {id_column}) AS count FROM {metadata_table}
+            WHERE {id_column} IN ({ids_query}) AND key IS NOT NULL AND value IS NOT NULL{key_filter}
+            GROUP BY key, value
+            ORDER BY key, count DESC, value
+        ''', (*ids_params, *(keys or [])))
+
+    facets = []
+    for key, value, count in cursor:
+        if not facets or facets[-1]['key'] != key:
+            facets.append({'key': key, 'values': []})
+        facets[-1]['values'].append({'value': value, 'count': count})
+    return facets
+
+serialize_facets = serializer_for(List[Facet])
+
+# Route to count the values of each metadata key over a project's samples or patients,
+# optionally only those matching where=key=value filters
+@app.get("/metadata_facets/{entity}", response_model=List[Facet])
+async def get_metadata_facets(request: Request, project_id: int,
+                              entity: str = Path(..., pattern='^(samples|patients)$'),
+                              key: Optional[List[str]] = Query(None, description="Only count these keys"),
+                              where: Optional[List[str]] = Query(None, description="key=value; repeat a key to match any of its values"),
+                              db: ConnectionPool = Depends(get_db), cache: ResponseCache = Depends(get_cache)):
+    try:
+        predicates = parse_predicates(where or [])
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    keys = sorted(set(key)) if key else None
+    try:
+        return await cached_response(
+            request, db, cache, ('metadata_facets', entity, project_id, tuple(keys or ()), predicates_key(predicates)),
+            [('project', project_id)], serialize_facets,
+            fetch_facets, entity, project_id, keys, predicates)
 
-# Pydantic model for Patient
-class Patient(BaseModel):
-    id: int
-    project_id: int
-    ext_patient_id: str
-    ext_patient_url: str
-    public_patient_id: Optional[str]
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-# Pydantic model for Patient with sample count
-class PatientWithSampleCount(Patient):
-    sample_count: int
+def fetch_samples(conn, sample_id, project_id, after=0, limit=None):
+    cursor = conn.cursor()
 
-# Pydantic model for PatientMetadata
-class PatientMetadata(BaseModel):
-    id: int
-    patient_id: int
-    key: str
-    value: str
+    if sample_id != 0:
+        return select_samples(cursor, "p.project_id = ? and s.id = ?", (project_id, sample_id))
 
-# Pydantic model for Patient with Metadata
-class PatientWithMetadata(Patient):
-    metadata: List[PatientMetadata] = []
+    # Keyset page of samples: id > after, up to limit samples
+    upper = keyset_upper_bound(cursor, '''
+        SELECT s.id FROM samples s JOIN patients p ON s.patient_id = p.id
+        WHERE p.project_id = ? AND s.id > ?
+    ''', (project_id, after), limit)
 
-# Pydantic model for SampleMetadata
-class SampleMetadata(BaseModel):
-    id: int
-    sample_id: int
-    key: str
-    value: str
+    return select_samples(cursor, "p.project_id = ? AND s.id > ? AND s.id <= ?", (project_id, after, upper))
 
-# Pydantic model for Sample
-class Sample(BaseModel):
-    id: int
-    patient_id: int
-    ext_sample_id: str
-    ext_sample_url: str
-    metadata: List[SampleMetadata] = []
-    patient: Patient
+def select_samples(cursor, where, params):
+    """
+    Fetch the samples matching where, with their metadata and patient, in id order.
+    where may refer to the samples table as s and the patients table as p.
+    """
+    cursor.execute(f'''
+        SELECT s.id AS sample_id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
+               sm.id AS metadata_id, sm.key, sm.value,
+               p.id AS patient_id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id
+        FROM samples s
+        LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
+        LEFT JOIN patients p ON s.patient_id = p.id
+        WHERE {where}
+        ORDER BY s.id, sm.id
+    ''', params)
 
-# Pydantic model for SampleWithoutPatient
-class SampleWithoutPatient(BaseModel):
-    id: int
-    patient_id: int
-    ext_sample_id: str
-    ext_sample_url: str
-    metadata: List[SampleMetadata] = []
+    rows = cursor.fetchall()
 
+    samples = []
+    current_sample = None
+    for row in rows:
+        if not current_sample or current_sample['id'] != row[0]:
+            if current_sample:
+                samples.append(current_sample)
+            current_sample = {
+                'id': row[0],
+                'patient_id': row[1],
+                'ext_sample_id': row[2],
+                'ext_sample_url': row[3],
+                'metadata': [],
+                'patient': {
+                    'id': row[7],
+                    'project_id': row[8],
+                    'ext_patient_id': row[9],
+                    'ext_patient_url': row[10],
+                    'public_patient_id': row[11]
+                }
+            }
+
+        if row[4]:  # Check if metadata exists
+            current_sample['metadata'].append({
+                'id': row[4],
+                'sample_id': row[0],
+                'key': row[5],
+                'value': row[6]
+            })
 
+    if current_sample:
+        samples.append(current_sample)
 
-# Pydantic model for Patient with Samples
-class PatientWithSamples(PatientWithMetadata):
-    samples: List[SampleWithoutPatient] = []
+    return samples
 
+serialize_samples = serializer_for(List[Sample])
 
-# Route to fetch all patients and their metadata for a project_id
-@app.get("/patients_metadata/{patient_id}", response_model=List[PatientWithSamples])
-async def get_patients_metadata(project_id: int,patient_id: int):
+# Route to fetch all samples and metadata for a project_id and include patient information
+@app.get("/samples/{sample_id}", response_model=List[Sample])
+async def get_samples_per_patient(sample_id: int, project_id: int, request: Request,
+                                  after: int = 0, limit: Optional[int] = Query(None, ge=1),
+                                  stream: Optional[str] = Query(None, pattern='^(ndjson|json)$'),
+                                  db: ConnectionPool = Depends(get_db), cache: ResponseCache = Depends(get_cache)):
+    if stream and sample_id == 0:
+        return streaming_response(db, partial(fetch_samples, sample_id=0, project_id=project_id), after, limit, stream)
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-
-
-        if patient_id != 0:
-
-            cursor.execute('''
-                SELECT p.id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id,
-                       pm.id, pm.key, pm.value
-                FROM patients p
-                LEFT JOIN patients_metadata pm ON p.id = pm.patient_id
-                WHERE p.project_id = ? and p.id = ?
-                ORDER BY p.id
-            ''', (project_id,patient_id,))
-        else:
-    
-            cursor.execute('''
-                SELECT p.id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id,
-                       pm.id, pm.key, pm.value
-                FROM patients p
-                LEFT JOIN patients_metadata pm ON p.id = pm.patient_id
-                WHERE p.project_id = ?
-                ORDER BY p.id
-            ''', (project_id,))
-
-        rows = cursor.fetchall()
-
-        patients = []
-        current_patient = None
-        for row in rows:
-
-            if not current_patient or current_patient['id'] != row[0]:
-
-                if current_patient:
-                    patients.append(current_patient)
-
-                current_patient = {
-                    'id': row[0],
-                    'project_id': row[1],
-                    'ext_patient_id': row[2],
-                    'ext_patient_url': row[3],
-                    'public_patient_id': row[4],
-                    'samples': [],
-                    'metadata': [] 
-                }
+        return await cached_response(
+            request, db, cache, ('samples', project_id, sample_id, after, limit),
+            [('project', project_id)], serialize_samples,
+            fetch_samples, sample_id, project_id, after, limit,
+            headers_for=partial(next_after_headers, limit=limit))
 
-            if row[5]:
-                current_patient['metadata'].append({
-                    'id': row[5],
-                    'patient_id': row[0],
-                    'key': row[6],
-                    'value': row[7]
-                })
-
-        if current_patient:
-            patients.append(current_patient)
-
-
-        for patient in patients:
-            cursor.execute('''
-                SELECT s.id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
-                       sm.id, sm.key, sm.value
-                FROM samples s
-                LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
-                WHERE s.patient_id = ?
-                ORDER BY s.id
-            ''', (patient['id'],))
-
-            sample_rows = cursor.fetchall()
-            current_sample = None
-            for sample_row in sample_rows:
-                if not current_sample or current_sample['id'] != sample_row[0]:
-                    if current_sample:
-                        patient['samples'].append(current_sample)
-                    current_sample = {
-                        'id': sample_row[0],
-                        'patient_id': sample_row[1],
-                        'ext_sample_id': sample_row[2],
-                        'ext_sample_url': sample_row[3],
-                        'metadata': []
-                    }
-                if sample_row[4]:
-                    current_sample['metadata'].append({
-                        'id': sample_row[4],
-                        'sample_id': sample_row[0],
-                        'key': sample_row[5],
-                        'value': sample_row[6]
-                    })
-            if current_sample:
-                patient['samples'].append(current_sample)
-
-        conn.close()
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-        return patients
+def fetch_samples_by_metadata(conn, project_id, predicates, after=0, limit=None):
+    ids = matching_ids(conn, 'samples', project_id, predicates, after, limit)
+    if not ids:
+        return []
+    return select_samples(conn.cursor(), "s.id IN (SELECT value FROM json_each(?))", (ids_param(ids),))
+
+# Route to fetch the samples of a project whose metadata matches every filter,
+# e.g. ?project_id=1&where=tissue=Liver&where=ext_sample_batch=3334
+@app.get("/samples_by_metadata/", response_model=List[Sample])
+async def get_samples_by_metadata(project_id: int, request: Request,
+                                  where: List[str] = Query(..., description="key=value; repeat a key to match any of its values"),
+                                  after: int = 0, limit: Optional[int] = Query(None, ge=1),
+                                  stream: Optional[str] = Query(None, pattern='^(ndjson|json)$'),
+                                  db: ConnectionPool = Depends(get_db), cache: ResponseCache = Depends(get_cache)):
+    try:
+        predicates = parse_predicates(where)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if stream:
+        return streaming_response(db, partial(fetch_samples_by_metadata, project_id=project_id, predicates=predicates), after, limit, stream)
+    try:
+        return await cached_response(
+            request, db, cache, ('samples_by_metadata', project_id, predicates_key(predicates), after, limit),
+            [('project', project_id)], serialize_samples,
+            fetch_samples_by_metadata, project_id, predicates, after, limit,
+            headers_for=partial(next_after_headers, limit=limit))
 
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-# Route to fetch all samples and metadata for a project_id and include patient information
-@app.get("/samples/{sample_id}", response_model=List[Sample])
-async def get_samples_per_patient(sample_id: int, project_id: int):
-    try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-
-        if sample_id != 0:
-            cursor.execute('''
-                SELECT s.id AS sample_id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
-                       sm.id AS metadata_id, sm.key, sm.value,
-                       p.id AS patient_id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id
-                FROM samples s
-                LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
-                LEFT JOIN patients p ON s.patient_id = p.id
-                WHERE p.project_id = ? and s.id = ?
-                ORDER BY s.id, sm.id
-            ''', (project_id,sample_id,))
-        else:
-            cursor.execute('''
-                SELECT s.id AS sample_id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
-                       sm.id AS metadata_id, sm.key, sm.value,
-                       p.id AS patient_id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id
-                FROM samples s
-                LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
-                LEFT JOIN patients p ON s.patient_id = p.id
-                WHERE p.project_id = ?
-                ORDER BY s.id, sm.id
-            ''', (project_id,))
- 
-
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        samples = []
-        current_sample = None
-        for row in rows:
-            if not current_sample or current_sample['id'] != row[0]:
-                if current_sample:
-                    samples.append(current_sample)
-                current_sample = {
-                    'id': row[0],
-                    'patient_id': row[1],
-                    'ext_sample_id': row[2],
-                    'ext_sample_url': row[3],
-                    'metadata': [],
-                    'patient': {
-                        'id': row[7],
-                        'project_id': row[8],
-                        'ext_patient_id': row[9],
-                        'ext_patient_url': row[10],
-                        'public_patient_id': row[11]
-                    }
-                }
+def fetch_patients_with_sample_counts(conn, project_id, after=0, limit=None):
+    cursor = conn.cursor()
+
+    # Keyset page of patients: id > after, up to limit patients
+    upper = keyset_upper_bound(cursor, '''
+        SELECT id FROM patients WHERE project_id = ? AND id > ?
+    ''', (project_id, after), limit)
+
+    # Query to fetch all patients with sample counts
+    cursor.execute('''
+        SELECT patients.id, patients.project_id, patients.ext_patient_id, patients.ext_patient_url,
+               patients.public_patient_id, COUNT(samples.id) AS sample_count
+        FROM patients
+        LEFT JOIN samples ON patients.id = samples.patient_id
+        WHERE patients.project_id = ? AND patients.id > ? AND patients.id <= ?
+        GROUP BY patients.id
+        ORDER BY patients.id
+    ''', (project_id, after, upper))
 
-            if row[4]:  # Check if metadata exists
-                current_sample['metadata'].append({
-                    'id': row[4],
-                    'sample_id': row[0],
-                    'key': row[5],
-                    'value': row[6]
-                })
+    rows = cursor.fetchall()
 
-        if current_sample:
-            samples.append(current_sample)
+    patients = []
+    for row in rows:
+        patients.append({
+            'id': row[0],
+            'project_id': row[1],
+            'ext_patient_id': row[2],
+            'ext_patient_url': row[3],
+            'public_patient_id': row[4],
+            'sample_count': row[5]
+        })
 
-        return samples
+    return patients
 
-    except sqlite3.Error as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+serialize_patients_with_sample_counts = serializer_for(List[PatientWithSampleCount])
 
 # Route to fetch all patients with sample counts
 @app.get("/patients/{patient_id}", response_model=List[PatientWithSampleCount])
-async def get_patients(project_id: int, patient_id: int):
+async def get_patients(project_id: int, patient_id: int, request: Request,
+                       after: int = 0, limit: Optional[int] = Query(None, ge=1),
+                       stream: Optional[str] = Query(None, pattern='^(ndjson|json)$'),
+                       db: ConnectionPool = Depends(get_db), cache: ResponseCache = Depends(get_cache)):
+    if stream:
+        return streaming_response(db, partial(fetch_patients_with_sample_counts, project_id=project_id), after, limit, stream)
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-
-        # Query to fetch all patients with sample counts
-        cursor.execute('''
-            SELECT patients.id, patients.project_id, patients.ext_patient_id, patients.ext_patient_url,
-                   patients.public_patient_id, COUNT(samples.id) AS sample_count
-            FROM patients
-            LEFT JOIN samples ON patients.id = samples.patient_id
-            WHERE patients.project_id = ?
-            GROUP BY patients.id
-            ORDER BY patients.id
-        ''', (project_id,))
-
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        patients = []
-        for row in rows:
-            patients.append({
-                'id': row[0],
-                'project_id': row[1],
-                'ext_patient_id': row[2],
-                'ext_patient_url': row[3],
-                'public_patient_id': row[4],
-                'sample_count': row[5]
-            })
-        
-        return patients
+        return await cached_response(
+            request, db, cache, ('patients', project_id, after, limit),
+            [('project', project_id)], serialize_patients_with_sample_counts,
+            fetch_patients_with_sample_counts, project_id, after, limit,
+            headers_for=partial(next_after_headers, limit=limit))
     
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-# Route to fetch all projects and their statuses
-@app.get("/projects/", response_model=List[Project])
-async def get_projects():
-    conn = sqlite3.connect(DATABASE)
+def fetch_projects(conn):
     cursor = conn.cursor()
     cursor.execute("SELECT id, name, status FROM projects")
     rows = cursor.fetchall()
-    conn.close()
-    return [Project(id=row[0], name=row[1], status=row[2]) for row in rows]
+    return [{'id': row[0], 'name': row[1], 'status': row[2]} for row in rows]
 
-# Route to fetch all datasets
-@app.get("/datasets/{dataset_id}", response_model=List[Dataset])
-async def get_datasets(dataset_id: int, project_id: int):
-    conn = sqlite3.connect(DATABASE)
+serialize_projects = serializer_for(List[Project])
+
+# Route to fetch all projects and their statuses
+@app.get("/projects/", response_model=List[Project])
+async def get_projects(request: Request, db: ConnectionPool = Depends(get_db), cache: ResponseCache = Depends(get_cache)):
+    return await cached_response(request, db, cache, ('projects',), [('projects', 0)], serialize_projects, fetch_projects)
+
+def fetch_project_summaries(conn, project_id=None):
+    cursor = conn.cursor()
+    # Totals come from project_summaries, which triggers keep up to date on every write
+    cursor.execute(f'''
+        SELECT pr.id, pr.name, pr.status,
+               COALESCE(ps.patient_count, 0), COALESCE(ps.sample_count, 0), COALESCE(ps.dataset_count, 0),
+               COALESCE(ps.raw_file_count, 0), COALESCE(ps.raw_bytes, 0)
+        FROM projects pr
+        LEFT JOIN project_summaries ps ON ps.project_id = pr.id
+        {'WHERE pr.id = ?' if project_id is not None else ''}
+        ORDER BY pr.id
+    ''', (project_id,) if project_id is not None else ())
+
+    rows = cursor.fetchall()
+    return [{
+        'id': row[0],
+        'name': row[1],
+        'status': row[2],
+        'patient_count': row[3],
+        'sample_count': row[4],
+        'dataset_count': row[5],
+        'raw_file_count': row[6],
+        'raw_bytes': row[7]
+    } for row in rows]
+
+# Route to fetch the totals of every project
+@app.get("/projects/summary", response_model=List[ProjectSummary])
+async def get_project_summaries(db: ConnectionPool = Depends(get_db)):
+    return await db.run(fetch_project_summaries)
+
+# Route to fetch the totals of one project
+@app.get("/projects/{project_id}/summary", response_model=ProjectSummary)
+async def get_project_summary(project_id: int, db: ConnectionPool = Depends(get_db)):
+    summaries = await db.run(fetch_project_summaries, project_id)
+    if not summaries:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return summaries[0]
+
+def fetch_datasets(conn, dataset_id, project_id):
     cursor = conn.cursor()
     if dataset_id != 0:
-        cursor.execute('''SELECT id, project_id, name FROM datasets where project_id = ? and dataset_id = ?''', (project_id,dataset_id,))
+        cursor.execute('''SELECT id, project_id, name FROM datasets where project_id = ? and id = ?''', (project_id,dataset_id,))
     else:
         cursor.execute('''SELECT id, project_id, name FROM datasets where project_id = ?''', (project_id,))
 
-
     rows = cursor.fetchall()
-    conn.close()
-    return [Dataset(id=row[0], project_id=row[1], name=row[2]) for row in rows]
+    return [{'id': row[0], 'project_id': row[1], 'name': row[2]} for row in rows]
+
+serialize_datasets = serializer_for(List[Dataset])
+
+# Route to fetch all datasets
+@app.get("/datasets/{dataset_id}", response_model=List[Dataset])
+async def get_datasets(dataset_id: int, project_id: int, request: Request,
+                       db: ConnectionPool = Depends(get_db), cache: ResponseCache = Depends(get_cache)):
+    return await cached_response(
+        request, db, cache, ('datasets', project_id, dataset_id), [('project', project_id)],
+        serialize_datasets, fetch_datasets, dataset_id, project_id)
+
 
+def fetch_dataset_with_metadata(conn, dataset_id, project_id):
+    cursor = conn.cursor()
+    
+    # Fetch dataset details
+    cursor.execute('''
+        SELECT id, project_id, name
+        FROM datasets
+        WHERE id = ? AND project_id = ?
+    ''', (dataset_id, project_id))
+    dataset_row = cursor.fetchone()
+    
+    if not dataset_row:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    # Fetch dataset metadata
+    cursor.execute('''
+        SELECT id, dataset_id, key, value
+        FROM datasets_metadata
+        WHERE dataset_id = ?
+    ''', (dataset_id,))
+    metadata_rows = cursor.fetchall()
+
+    return {
+        "id": dataset_row[0],
+        "project_id": dataset_row[1],
+        "name": dataset_row[2],
+        "metadata": [{"id": row[0], "dataset_id": row[1], "key": row[2], "value": row[3]} for row in metadata_rows]
+    }
+
+serialize_dataset_with_metadata = serializer_for(DatasetWithMetadata)
 
 # Endpoint to fetch dataset details and metadata by dataset_id
 @app.get("/datasets_with_metadata/{dataset_id}", response_model=DatasetWithMetadata)
-async def get_dataset_with_metadata(dataset_id: int, project_id: int):
+async def get_dataset_with_metadata(dataset_id: int, project_id: int, request: Request,
+                                    db: ConnectionPool = Depends(get_db), cache: ResponseCache = Depends(get_cache)):
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Fetch dataset details
-        cursor.execute('''
-            SELECT id, project_id, name
-            FROM datasets
-            WHERE id = ? AND project_id = ?
-        ''', (dataset_id, project_id))
-        dataset_row = cursor.fetchone()
-        
-        if not dataset_row:
-            raise HTTPException(status_code=404, detail="Dataset not found")
-
-        # Fetch dataset metadata
-        cursor.execute('''
-            SELECT id, dataset_id, key, value
-            FROM datasets_metadata
-            WHERE dataset_id = ?
-        ''', (dataset_id,))
-        metadata_rows = cursor.fetchall()
-        
-        conn.close()
-        
-        dataset = {
-            "id": dataset_row[0],
-            "project_id": dataset_row[1],
-            "name": dataset_row[2],
-            "metadata": [{"id": row[0], "dataset_id": row[1], "key": row[2], "value": row[3]} for row in metadata_rows]
-        }
-
-        return dataset
+        return await cached_response(
+            request, db, cache, ('datasets_with_metadata', project_id, dataset_id), [('dataset', dataset_id)],
+            serialize_dataset_with_metadata, fetch_dataset_with_metadata, dataset_id, project_id)
 
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-@app.get("/raw_files_with_metadata/{dataset_id}", response_model=List[RawFileResponse])
-async def get_raw_files_with_metadata(dataset_id: int):
-    conn = sqlite3.connect(DATABASE)
+def fetch_raw_files_with_metadata(conn, dataset_id, after=0, limit=None):
     cursor = conn.cursor()
+
+    # Keyset page of raw files: id > after, up to limit files
+    upper = keyset_upper_bound(cursor, """
+    SELECT id FROM raw_files WHERE dataset_id = ? AND id > ?
+    """, (dataset_id, after), limit)
     
-    # Query to get raw files and their associated metadata
+    # Raw files with their linked samples, one row per link. Files without a sample link
+    # are still listed, with a null sample_id.
     query = """
-    SELECT rf.id, rf.path, rfm.metadata_value AS sample_id, s.ext_sample_id
+    SELECT rf.id, rf.path, rs.sample_id, s.ext_sample_id
     FROM raw_files rf
-    LEFT JOIN raw_files_metadata rfm ON rf.id = rfm.raw_file_id
-    LEFT JOIN samples s ON rfm.metadata_value = s.id
-    WHERE rf.dataset_id = ? AND rfm.metadata_key = 'sample_id'
+    LEFT JOIN raw_file_samples rs ON rs.raw_file_id = rf.id
+    LEFT JOIN samples s ON s.id = rs.sample_id
+    WHERE rf.dataset_id = ? AND rf.id > ? AND rf.id <= ?
+    ORDER BY rf.id, rs.sample_id
     """
-    cursor.execute(query, (dataset_id,))
+    cursor.execute(query, (dataset_id, after, upper))
     raw_files = cursor.fetchall()
 
+    # Fetch the metadata of every sample linked to the page's files in one query,
+    # so files sharing a sample share one lookup
+    cursor.execute("""
+    SELECT id, sample_id, key, value
+    FROM samples_metadata
+    WHERE sample_id IN (
+        SELECT rs.sample_id
+        FROM raw_files rf
+        JOIN raw_file_samples rs ON rs.raw_file_id = rf.id
+        WHERE rf.dataset_id = ? AND rf.id > ? AND rf.id <= ?
+    )
+    ORDER BY sample_id, id
+    """, (dataset_id, after, upper))
+
+    sample_metadata = {}
+    for row in cursor:
+        sample_metadata.setdefault(row[1], []).append({
+            'id': row[0],
+            'sample_id': row[1],
+            'key': row[2],
+            'value': row[3]
+        })
+
     response = []
     
     for raw_file in raw_files:
         raw_file_id, path, sample_id, ext_sample_id = raw_file
-        
-        # Fetch sample metadata
-        cursor.execute("SELECT id, sample_id, key, value FROM samples_metadata WHERE sample_id = ?", (sample_id,))
-        sample_metadata_rows = cursor.fetchall()
-
-        sample_metadata_list = []
-        for row in sample_metadata_rows:
-            sample_metadata_list.append({
-                'id': row[0],
-                'sample_id': row[1],
-                'key': row[2],
-                'value': row[3]
-                
 
-            }) 
-        print(sample_metadata_list)
+        response.append({
+            'id': raw_file_id,
+            'path': path,
+            'sample_id': str(sample_id) if sample_id is not None else None,
+            'ext_sample_id': ext_sample_id,
+            'sample_metadata': sample_metadata.get(sample_id, [])
+        })
 
+    return response
 
-        response.append(RawFileResponse(
-            id=raw_file_id,
-            path=path,
-            sample_id=sample_id,
-            ext_sample_id=ext_sample_id,
-            sample_metadata=sample_metadata_list
-        ))
+serialize_raw_files = serializer_for(List[RawFileResponse])
 
-    conn.close()
-    return response
+@app.get("/raw_files_with_metadata/{dataset_id}", response_model=List[RawFileResponse])
+async def get_raw_files_with_metadata(dataset_id: int, request: Request,
+                                      after: int = 0, limit: Optional[int] = Query(None, ge=1),
+                                      stream: Optional[str] = Query(None, pattern='^(ndjson|json)$'),
+                                      db: ConnectionPool = Depends(get_db), cache: ResponseCache = Depends(get_cache)):
+    if stream:
+        return streaming_response(db, partial(fetch_raw_files_with_metadata, dataset_id=dataset_id), after, limit, stream)
+    return await cached_response(
+        request, db, cache, ('raw_files_with_metadata', dataset_id, after, limit), [('dataset', dataset_id)],
+        serialize_raw_files, fetch_raw_files_with_metadata, dataset_id, after, limit,
+        headers_for=partial(next_after_headers, limit=limit))
 
 class MetadataUpdate(BaseModel):
     dataset_id: int
     raw_file_size: str
     last_size_update: str
 
-@app.put("/datasets_metadata/size_update", response_model=MetadataUpdate)
-def update_metadata(update: MetadataUpdate):
-    conn = sqlite3.connect(DATABASE)
+# Pydantic models for bulk dataset metadata upserts
+class DatasetMetadataUpsert(BaseModel):
+    dataset_id: int
+    key: str
+    value: str
+
+class DatasetMetadataUpsertResult(BaseModel):
+    status: str
+    message: str
+    written: int
+    unchanged: int
+
+def upsert_dataset_metadata(conn, entries):
+    """
+    Set datasets_metadata key/value pairs for any number of datasets in one transaction.
+
+    Each (dataset_id, key) holds one value, so an entry replaces the dataset's current value
+    for its key or adds it. Rows whose value does not change are not rewritten, so re-sending
+    an unchanged sweep leaves cached responses valid.
+
+    Args:
+    conn (sqlite3.Connection): The database connection.
+    entries (list): DatasetMetadataUpsert-like objects with dataset_id, key and value.
+
+    Returns:
+    dict: Counts of (dataset, key) values written and left unchanged.
+
+    Raises:
+    HTTPException: 404 if any dataset does not exist; nothing is written then.
+    """
+    # Later entries for the same dataset and key replace earlier ones
+    values = {(entry.dataset_id, entry.key): entry.value for entry in entries}
+
     cursor = conn.cursor()
-    
-    # Update record with key 'raw_file_extension_size_of_all_files' for the given dataset_id
-    if update.raw_file_size:
-        cursor.execute(
-            "SELECT id, value FROM datasets_metadata WHERE key = 'raw_file_extension_size_of_all_files' AND dataset_id = ?",
-            (update.dataset_id,)
-        )
-        record = cursor.fetchone()
-        if record:
-            record_id, value_str = record
-            # Update the metadata with the new value
-            cursor.execute(
-                "UPDATE datasets_metadata SET value = ? WHERE id = ?",
-                (update.raw_file_size, record_id)
-            )
-        else:
-            # Insert a new record if it doesn't exist
-            cursor.execute(
-                "INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, 'raw_file_extension_size_of_all_files', ?)",
-                (update.dataset_id, update.raw_file_size))
-            
-    
-    # Update record with key 'last_size_update' for the given dataset_id
-    if update.last_size_update:
-        cursor.execute(
-            "SELECT id, value FROM datasets_metadata WHERE key = 'last_size_update' AND dataset_id = ?",
-            (update.dataset_id,)
-        )
-        record = cursor.fetchone()
-        if record:
-            record_id, value_str = record
-            # Update the metadata with the new value
-            cursor.execute(
-                "UPDATE datasets_metadata SET value = ? WHERE id = ?",
-                (update.last_size_update, record_id)
-            )
-        else:
-            # Insert a new record if it doesn't exist
-            cursor.execute(
-                "INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, 'last_size_update', ?)",
-                (update.dataset_id, update.last_size_update))
-    
+    # Take the write lock before checking the datasets, so they cannot be deleted in between
+    cursor.execute("BEGIN IMMEDIATE")
+    dataset_ids = sorted({dataset_id for dataset_id, _ in values})
+    cursor.execute(
+        "SELECT value FROM json_each(?) WHERE value NOT IN (SELECT id FROM datasets)",
+        (ids_param(dataset_ids),))
+    missing = [row[0] for row in cursor]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Datasets not found: {missing}")
+
+    cursor.executemany('''
+        INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, ?, ?)
+        ON CONFLICT (dataset_id, key) DO UPDATE SET value = excluded.value
+        WHERE value IS NOT excluded.value
+    ''', [(dataset_id, key, value) for (dataset_id, key), value in values.items()])
+    written = cursor.rowcount
     conn.commit()
-    conn.close()
+    return {"written": written, "unchanged": len(values) - written}
+
+# Endpoint to upsert metadata keys of many datasets in one request and one commit
+@app.put("/datasets_metadata/", response_model=DatasetMetadataUpsertResult)
+async def put_datasets_metadata(entries: List[DatasetMetadataUpsert], db: ConnectionPool = Depends(get_db),
+                                cache: ResponseCache = Depends(get_cache)):
+    try:
+        counts = await db.run(upsert_dataset_metadata, entries) if entries else {"written": 0, "unchanged": 0}
+        for dataset_id in {entry.dataset_id for entry in entries}:
+            cache.invalidate(('dataset', dataset_id))
+        return {"status": "success", "message": "Dataset metadata updated successfully", **counts}
+
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+def upsert_dataset_size_metadata(conn, update):
+    # Empty values leave the stored value as it is
+    entries = [
+        DatasetMetadataUpsert(dataset_id=update.dataset_id, key=key, value=value)
+        for key, value in (('raw_file_extension_size_of_all_files', update.raw_file_size),
+                           ('last_size_update', update.last_size_update))
+        if value
+    ]
+    if entries:
+        upsert_dataset_metadata(conn, entries)
+
+@app.put("/datasets_metadata/size_update", response_model=MetadataUpdate)
+async def update_metadata(update: MetadataUpdate, db: ConnectionPool = Depends(get_db),
+                          cache: ResponseCache = Depends(get_cache)):
+    try:
+        await db.run(upsert_dataset_size_metadata, update)
+        cache.invalidate(('dataset', update.dataset_id))
+        return update
+
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+# Pydantic models for server-side scan jobs
+class ScanJobCreate(BaseModel):
+    dataset_id: int
+    # Defaults to the dataset's raw_file_directory metadata
+    directory: Optional[str] = None
+
+class ScanJob(BaseModel):
+    id: int
+    dataset_id: int
+    directory: str
+    status: str
+    cancel_requested: bool
+    files_seen: int
+    files_matched: int
+    bytes_seen: int
+    files_registered: int
+    files_removed: int
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+SCAN_JOB_COLUMNS = ', '.join(ScanJob.model_fields)
+
+def fetch_scan_job(conn, job_id):
+    cursor = conn.execute(f"SELECT {SCAN_JOB_COLUMNS} FROM scan_jobs WHERE id = ?", (job_id,))
+    row = cursor.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    return dict(zip(ScanJob.model_fields, row))
+
+def fetch_scan_jobs(conn, dataset_id):
+    cursor = conn.execute(f'''
+        SELECT {SCAN_JOB_COLUMNS} FROM scan_jobs
+        WHERE dataset_id = ?
+        ORDER BY id DESC
+    ''', (dataset_id,))
+    return [dict(zip(ScanJob.model_fields, row)) for row in cursor]
+
+def create_scan_job(conn, job):
+    """
+    Queue a scan of a dataset's directory, after checking the dataset can be scanned.
+
+    Returns:
+    dict: The queued job.
+
+    Raises:
+    HTTPException: 403 if no scan root is configured, 404 if the dataset does not exist, 400
+    if it has no directory inside the scan root, matching mode or file extension to scan with,
+    and 409 if a scan of it is already unfinished.
+    """
+    if not SCAN_ROOT:
+        raise HTTPException(status_code=403, detail="Scan jobs are disabled; set REDMANE_SCAN_ROOT to the directory they may scan")
+    if not conn.execute("SELECT 1 FROM datasets WHERE id = ?", (job.dataset_id,)).fetchone():
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    settings = dict(conn.execute('''
+        SELECT key, value FROM datasets_metadata
+        WHERE dataset_id = ? AND key IN ('raw_file_directory', 'sample_info_stored', 'raw_file_extensions')
+    ''', (job.dataset_id,)).fetchall())
+
+    directory = job.directory or settings.get('raw_file_directory')
+    if not directory:
+        raise HTTPException(status_code=400, detail="No directory given and the dataset has no raw_file_directory")
+    # Checked, stored and scanned resolved, so the job walks the directory that was checked
+    directory = os.path.realpath(directory)
+    root = os.path.realpath(SCAN_ROOT)
+    if os.path.commonpath([root, directory]) != root:
+        raise HTTPException(status_code=400, detail=f"Directory is outside {SCAN_ROOT}")
+    if not os.path.isdir(directory):
+        raise HTTPException(status_code=400, detail=f"Not a directory: {directory}")
+    missing = [key for key in ('sample_info_stored', 'raw_file_extensions') if key not in settings]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Dataset metadata missing: {missing}")
+
+    try:
+        cursor = conn.execute('''
+            INSERT INTO scan_jobs (dataset_id, directory, server_pid, created_at) VALUES (?, ?, ?, ?)
+        ''', (job.dataset_id, directory, os.getpid(), time.time()))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail=f"A scan of dataset {job.dataset_id} is already queued or running")
+    return fetch_scan_job(conn, cursor.lastrowid)
+
+def cancel_scan_job(conn, job_id):
+    conn.execute('''
+        UPDATE scan_jobs SET cancel_requested = 1
+        WHERE id = ? AND status IN ('queued', 'running')
+    ''', (job_id,))
+    conn.commit()
+    return fetch_scan_job(conn, job_id)
+
+# Endpoint to start scanning a dataset's directory on the server; the scan matches files to
+# samples like the file tracker and writes the results straight into raw_files
+@app.post("/scan_jobs/", response_model=ScanJob)
+async def post_scan_job(job: ScanJobCreate, request: Request, db: ConnectionPool = Depends(get_db)):
+    try:
+        created = await db.run(create_scan_job, job)
+        request.app.state.scan_jobs.submit(created["id"])
+        return created
+
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+# Endpoint to follow a scan job's status and progress counters
+@app.get("/scan_jobs/{job_id}", response_model=ScanJob)
+async def get_scan_job(job_id: int, db: ConnectionPool = Depends(get_db)):
+    return await db.run(fetch_scan_job, job_id)
+
+# Endpoint to list a dataset's scan jobs, newest first
+@app.get("/scan_jobs/", response_model=List[ScanJob])
+async def get_scan_jobs(dataset_id: int, db: ConnectionPool = Depends(get_db)):
+    return await db.run(fetch_scan_jobs, dataset_id)
+
+# Endpoint to stop a scan job; a running scan stops after the batch of files in progress
+@app.post("/scan_jobs/{job_id}/cancel", response_model=ScanJob)
+async def post_cancel_scan_job(job_id: int, db: ConnectionPool = Depends(get_db)):
+    return await db.run(cancel_scan_job, job_id)
+
+# Pydantic models for raw files sharing the same content
+class DuplicateRawFile(BaseModel):
+    id: int
+    dataset_id: int
+    path: str
+
+class DuplicateRawFiles(BaseModel):
+    checksum: str
+    files: List[DuplicateRawFile]
+
+# Endpoint to find raw files with identical content across datasets, from the checksums
+# stored by checksums.py
+@app.get("/duplicate_raw_files/", response_model=List[DuplicateRawFiles])
+async def get_duplicate_raw_files(dataset_id: Optional[int] = None, db: ConnectionPool = Depends(get_db)):
+    try:
+        return await db.run(fetch_duplicate_checksums, dataset_id)
+
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+def fetch_counts_store(conn, raw_file_id):
+    """
+    Return the directory of a raw file's counts store, as recorded by counts_store.py.
+
+    Raises:
+    HTTPException: 404 if the raw file does not exist or has not been converted.
+    """
+    row = conn.execute('''
+        SELECT rf.id, m.metadata_value FROM raw_files rf
+        LEFT JOIN raw_files_metadata m ON m.raw_file_id = rf.id AND m.metadata_key = ?
+        WHERE rf.id = ?
+    ''', (STORE_KEY, raw_file_id)).fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Raw file not found")
+    if row[1] is None:
+        raise HTTPException(status_code=404, detail="Raw file has no counts store; run counts_store.py to convert it")
+    return row[1]
+
+def select_counts_slice(store_dir, genes, samples):
+    """
+    Open a counts store and find the rows of the requested genes, or every row if none
+    are requested, and the requested samples, or every sample.
+
+    Raises:
+    HTTPException: 404 if the store is missing or does not have some of the genes or samples.
+    """
+    try:
+        store = open_store(store_dir)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Counts store is missing; run counts_store.py to convert the file again")
+
+    missing_samples = store.missing_samples(samples)
+    rows, missing_genes = store.gene_list_rows(genes) if genes else (range(store.rows), [])
+    if missing_genes or missing_samples:
+        raise HTTPException(status_code=404, detail={"missing_genes": missing_genes, "missing_samples": missing_samples})
+    return store, rows, samples or store.samples
+
+# Endpoint to read part of a registered counts table by gene ID and ext_sample_id, from the
+# memory-mapped store written by counts_store.py, so only the requested values are read
+@app.get("/raw_file_counts/{raw_file_id}")
+async def get_raw_file_counts(raw_file_id: int,
+                              gene: Optional[List[str]] = Query(None, description="Gene IDs, as in the file's first column; all if omitted"),
+                              sample: Optional[List[str]] = Query(None, description="ext_sample_ids, as in the file's header; all if omitted"),
+                              fmt: str = Query('json', alias='format', pattern='^(json|ndjson|npy)$'),
+                              db: ConnectionPool = Depends(get_db)):
+    try:
+        store_dir = await db.run(fetch_counts_store, raw_file_id)
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+    store, rows, samples = await run_in_threadpool(select_counts_slice, store_dir, gene or [], sample or [])
+    return StreamingResponse(iter_slice(store, rows, samples, fmt), media_type=SLICE_MEDIA_TYPES[fmt])
+
+# Route to report response cache hit, miss and eviction counters
+@app.get("/cache_stats/")
+async def get_cache_stats(cache: ResponseCache = Depends(get_cache)):
+    return cache.stats()
 
-    return update
+# Route to report connection pool usage, for sizing DB_POOL_SIZE against worker concurrency
+@app.get("/db_pool_stats/")
+async def get_db_pool_stats(request: Request):
+    return request.app.state.db_pool.stats()
 
 # Run the app using Uvicorn server
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+import json
+
+
+# Filterable entities: (metadata table, attributes pivot, id column, query restricting ids to a project)
+FILTERABLE = {
+    'samples': ('samples_metadata', 'samples_attributes', 'sample_id',
+                "SELECT 1 FROM samples s JOIN patients p ON p.id = s.patient_id WHERE s.id = m.sample_id AND p.project_id = ?"),
+    'patients': ('patients_metadata', 'patients_attributes', 'patient_id',
+                 "SELECT 1 FROM patients p WHERE p.id = m.patient_id AND p.project_id = ?"),
+}
+
+# Matches counted per predicate when choosing which one drives the index scan; counting
+# stops here, since past this point any predicate is a poor driver
+SELECTIVITY_SAMPLE = 10000
+
+
+# Separators of the attributes pivot rows built by migration 5
+PAIR_SEPARATOR = '\x1f'
+KEY_SEPARATOR = '\x1e'
+
+
+def attribute_token(key, value):
+    """
+    Return the substring an attributes pivot row contains exactly when the entity has
+    metadata key=value.
+    """
+    return f'{PAIR_SEPARATOR}{key}{KEY_SEPARATOR}{value}{PAIR_SEPARATOR}'
+
+
+def parse_predicates(where):
+    """
+    Parse 'key=value' filter strings into {key: [values]}, in the order given.
+
+    Values given for the same key are alternatives (tissue=Liver&tissue=Lung); different
+    keys must all match. Spaces around keys and values are ignored, so 'tissue = Liver'
+    is the same filter as 'tissue=Liver'.
+
+    Raises:
+    ValueError: If a filter has no '=', an empty key, or contains a pivot separator.
+    """
+    predicates = {}
+    for predicate in where:
+        key, separator, value = predicate.partition('=')
+        key, value = key.strip(), value.strip()
+        if not separator or not key:
+            raise ValueError(f"Invalid filter {predicate!r}, expected key=value")
+        if PAIR_SEPARATOR in predicate or KEY_SEPARATOR in predicate:
+            raise ValueError(f"Invalid filter {predicate!r}, control characters are not allowed")
+        values = predicates.setdefault(key, [])
+        if value not in values:
+            values.append(value)
+    return predicates
+
+
+def predicates_key(predicates):
+    """
+    Return a hashable form of predicates that ignores the order filters were given in.
+    """
+    return tuple((key, tuple(sorted(values))) for key, values in sorted(predicates.items()))
+
+
+def _estimate_matches(cursor, metadata_table, key, values):
+    cursor.execute(f'''
+        SELECT COUNT(*) FROM (
+            SELECT 1 FROM {metadata_table} WHERE key = ? AND value IN ({', '.join('?' for _ in values)}) LIMIT ?
+        )
+    ''', (key, *values, SELECTIVITY_SAMPLE))
+    return cursor.fetchone()[0]
+
+
+def matching_ids_query(cursor, entity, project_id, predicates, after=0, limit=None):
+    """
+    Build the query selecting the ids of the samples or patients in a project whose metadata
+    matches every predicate, in ascending id order, as one keyset page.
+
+    The most selective predicate is answered from the (key, value, id) index, one ordered
+    scan per value so a page can stop early. Each remaining predicate is a substring test
+    on the candidate's row in the attributes pivot, so the query needs no self-join per key
+    however many predicates there are.
+
+    The pivot is one attrs string per entity rather than a table with a column per key:
+    metadata keys are free-form and differ between projects, so a column per key would mean
+    altering the schema whenever the tracker sends a new key. Separators are control
+    characters that filters may not contain, and pairs holding one are left out of the pivot.
+
+    Args:
+    cursor (sqlite3.Cursor): Used to estimate how selective each predicate is.
+    entity (str): 'samples' or 'patients'.
+    project_id (int): The project to search.
+    predicates (dict): {key: [values]} as returned by parse_predicates.
+    after (int): Only select ids greater than this.
+    limit (int): The page size, or None for every match.
+
+    Returns:
+    tuple: (sql, params) for a query with a single id column.
+    """
+    metadata_table, attributes_table, id_column, in_project = FILTERABLE[entity]
+    if not predicates:
+        raise ValueError("At least one filter is required")
+
+    keys = sorted(predicates, key=lambda key: _estimate_matches(cursor, metadata_table, key, predicates[key]))
+    driver, others = keys[0], keys[1:]
+
+    join = f"JOIN {attributes_table} a ON a.{id_column} = m.{id_column}" if others else ''
+    conditions = ''.join(
+        ' AND (' + ' OR '.join('instr(a.attrs, ?) > 0' for _ in predicates[key]) + ')' for key in others
+    )
+    tokens = [attribute_token(key, value) for key in others for value in predicates[key]]
+    page = ' LIMIT ?' if limit is not None else ''
+
+    branches, params = [], []
+    for value in predicates[driver]:
+        branches.append(f'''
+            SELECT id FROM (
+                SELECT DISTINCT m.{id_column} AS id
+                FROM {metadata_table} m
+                {join}
+                WHERE m.key = ? AND m.value = ? AND m.{id_column} > ?{conditions}
+                  AND EXISTS ({in_project})
+                ORDER BY m.{id_column}{page}
+            )
+        ''')
+        params += [driver, value, after, *tokens, project_id]
+        if limit is not None:
+            params.append(limit)
+
+    # UNION merges the per-value branches and drops ids matched by several values
+    return ' UNION '.join(branches) + ' ORDER BY 1' + page, params + ([limit] if limit is not None else [])
+
+
+def matching_ids(conn, entity, project_id, predicates, after=0, limit=None):
+    """
+    Return the ids of the samples or patients in a project whose metadata matches every
+    predicate, in ascending id order, as one keyset page. See matching_ids_query.
+    """
+    cursor = conn.cursor()
+    cursor.execute(*matching_ids_query(cursor, entity, project_id, predicates, after, limit))
+    return [row[0] for row in cursor]
+
+
+def ids_param(ids):
+    """
+    Encode ids for a 'column IN (SELECT value FROM json_each(?))' condition.
+    """
+    return json.dumps(ids)
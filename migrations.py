@@ -0,0 +1,744 @@
+import argparse
+import re
+import sqlite3
+from datetime import datetime
+
+
+def _bump_epoch(scope, id_expr):
+    # Statement bumping one cache epoch; NULL ids (orphan rows) are ignored
+    return f'''
+        INSERT INTO cache_epochs (scope, scope_id, version)
+        SELECT '{scope}', {id_expr}, 1 WHERE {id_expr} IS NOT NULL
+        ON CONFLICT (scope, scope_id) DO UPDATE SET version = version + 1;
+    '''
+
+
+def _bump_project_epochs(id_expr):
+    # Project-level rows (patients, samples and their metadata) also appear in the
+    # raw file listings of every dataset in the project
+    return _bump_epoch('project', id_expr) + f'''
+        INSERT INTO cache_epochs (scope, scope_id, version)
+        SELECT 'dataset', id, 1 FROM datasets WHERE project_id = {id_expr}
+        ON CONFLICT (scope, scope_id) DO UPDATE SET version = version + 1;
+    '''
+
+
+def _row_triggers(prefix, table, bump):
+    """
+    Build AFTER INSERT/UPDATE/DELETE triggers named prefix_table_event that run bump(row)
+    for the affected row(s), where bump maps 'NEW' or 'OLD' to the statements to execute.
+    """
+    statements = []
+    for event, rows in (('insert', ['NEW']), ('update', ['OLD', 'NEW']), ('delete', ['OLD'])):
+        body = ''.join(bump(row) for row in rows)
+        statements.append(f"DROP TRIGGER IF EXISTS {prefix}_{table}_{event}")
+        statements.append(f"CREATE TRIGGER {prefix}_{table}_{event} AFTER {event.upper()} ON {table} BEGIN {body} END")
+    return statements
+
+
+def _epoch_triggers(table, bump):
+    return _row_triggers('cache_epoch', table, bump)
+
+
+def _attributes_select(metadata_table, id_column, where):
+    # One row per entity with all its metadata encoded as \x1fkey\x1evalue\x1fkey\x1evalue\x1f,
+    # so a key=value predicate is a substring test (see metadata_filter.attribute_token).
+    # Pairs holding a separator are left out: they could read as other pairs, and filters
+    # cannot ask for them anyway
+    return f'''
+        SELECT {id_column}, char(31) || group_concat(key || char(30) || value, char(31)) || char(31)
+        FROM {metadata_table}
+        WHERE {where} AND key IS NOT NULL AND value IS NOT NULL
+          AND instr(key || value, char(30)) = 0 AND instr(key || value, char(31)) = 0
+        GROUP BY {id_column}
+    '''
+
+
+def _attributes_pivot(metadata_table, attributes_table, id_column):
+    """
+    Build the statements creating attributes_table, a materialized pivot of metadata_table
+    holding all of an entity's metadata in one row, filling it, and keeping it in sync with
+    triggers that rebuild an entity's row whenever its metadata changes.
+    """
+    def refresh(row):
+        return f'''
+            DELETE FROM {attributes_table} WHERE {id_column} = {row}.{id_column};
+            INSERT INTO {attributes_table} ({id_column}, attrs)
+            {_attributes_select(metadata_table, id_column, f"{id_column} = {row}.{id_column}")};
+        '''
+
+    return [
+        f'''
+        CREATE TABLE IF NOT EXISTS {attributes_table} (
+            {id_column} INTEGER PRIMARY KEY,
+            attrs TEXT NOT NULL
+        )
+        ''',
+        f"DELETE FROM {attributes_table}",
+        f"INSERT INTO {attributes_table} ({id_column}, attrs) {_attributes_select(metadata_table, id_column, 'true')}",
+        *_row_triggers('attributes', metadata_table, refresh),
+    ]
+
+
+# Metadata tables counted in metadata_facets: entity -> (metadata table, id column,
+# expression giving the project of an entity id)
+FACET_SOURCES = {
+    'samples': ('samples_metadata', 'sample_id',
+                '(SELECT p.project_id FROM samples s JOIN patients p ON p.id = s.patient_id WHERE s.id = {id})'),
+    'patients': ('patients_metadata', 'patient_id', '(SELECT project_id FROM patients WHERE id = {id})'),
+}
+
+
+def _facet_entities_delta(entity, project_expr, ids_sql, sign):
+    # Add (sign '+') or remove (sign '-') every metadata value of the entities in ids_sql
+    # to or from the facet counts of a project
+    metadata_table, id_column, _ = FACET_SOURCES[entity]
+    if sign == '+':
+        return f'''
+            INSERT INTO metadata_facets (entity, project_id, key, value, count)
+            SELECT '{entity}', {project_expr}, key, value, COUNT(DISTINCT {id_column})
+            FROM {metadata_table}
+            WHERE {id_column} IN ({ids_sql}) AND key IS NOT NULL AND value IS NOT NULL
+              AND {project_expr} IS NOT NULL
+            GROUP BY key, value
+            ON CONFLICT (entity, project_id, key, value) DO UPDATE SET count = count + excluded.count;
+        '''
+    return f'''
+        UPDATE metadata_facets
+        SET count = count - (SELECT COUNT(DISTINCT m.{id_column}) FROM {metadata_table} m
+                             WHERE m.{id_column} IN ({ids_sql})
+                               AND m.key = metadata_facets.key AND m.value = metadata_facets.value)
+        WHERE entity = '{entity}' AND project_id = {project_expr}
+          AND (key, value) IN (SELECT key, value FROM {metadata_table} WHERE {id_column} IN ({ids_sql}));
+        DELETE FROM metadata_facets WHERE entity = '{entity}' AND project_id = {project_expr} AND count <= 0;
+    '''
+
+
+def _facet_row_delta(entity, row, sign):
+    # Count (sign '+') or uncount (sign '-') one metadata row, unless its entity has another
+    # row with the same key and value; entities without a project are not counted
+    metadata_table, id_column, project = FACET_SOURCES[entity]
+    project_expr = project.format(id=f'{row}.{id_column}')
+    others = f'''
+        SELECT 1 FROM {metadata_table} WHERE {id_column} = {row}.{id_column}
+        AND key = {row}.key AND value = {row}.value{f' AND id != {row}.id' if sign == '+' else ''}
+    '''
+    if sign == '+':
+        return f'''
+            INSERT INTO metadata_facets (entity, project_id, key, value, count)
+            SELECT '{entity}', {project_expr}, {row}.key, {row}.value, 1
+            WHERE {row}.key IS NOT NULL AND {row}.value IS NOT NULL AND {project_expr} IS NOT NULL
+              AND NOT EXISTS ({others})
+            ON CONFLICT (entity, project_id, key, value) DO UPDATE SET count = count + 1;
+        '''
+    return f'''
+        UPDATE metadata_facets SET count = count - 1
+        WHERE entity = '{entity}' AND project_id = {project_expr} AND key = {row}.key AND value = {row}.value
+          AND NOT EXISTS ({others});
+        DELETE FROM metadata_facets
+        WHERE entity = '{entity}' AND project_id = {project_expr} AND key = {row}.key AND value = {row}.value
+          AND count <= 0;
+    '''
+
+
+def _trigger(name, event, table, body, when=None):
+    return [
+        f"DROP TRIGGER IF EXISTS {name}",
+        f"CREATE TRIGGER {name} AFTER {event} ON {table} {f'WHEN {when} ' if when else ''}BEGIN {body} END",
+    ]
+
+
+def _facet_triggers():
+    """
+    Build the triggers keeping metadata_facets in step with metadata writes, with samples
+    and patients being added, moved between projects or deleted.
+    """
+    statements = []
+    for entity, (metadata_table, id_column, _) in FACET_SOURCES.items():
+        changed = f"OLD.{id_column} IS NOT NEW.{id_column} OR OLD.key IS NOT NEW.key OR OLD.value IS NOT NEW.value"
+        statements += _trigger(f'facets_{metadata_table}_insert', 'INSERT', metadata_table,
+                               _facet_row_delta(entity, 'NEW', '+'))
+        statements += _trigger(f'facets_{metadata_table}_update', 'UPDATE', metadata_table,
+                               _facet_row_delta(entity, 'OLD', '-') + _facet_row_delta(entity, 'NEW', '+'), when=changed)
+        statements += _trigger(f'facets_{metadata_table}_delete', 'DELETE', metadata_table,
+                               _facet_row_delta(entity, 'OLD', '-'))
+
+    def patient_project(row):
+        return f'(SELECT project_id FROM patients WHERE id = {row}.patient_id)'
+
+    def samples(row):
+        return _facet_entities_delta('samples', patient_project(row), f'SELECT {row}.id', '+' if row == 'NEW' else '-')
+
+    # Entities are normally inserted before their metadata, so these only fire when there is something to count
+    def sample_has_metadata(row):
+        return f'EXISTS (SELECT 1 FROM samples_metadata WHERE sample_id = {row}.id)'
+
+    statements += _trigger('facets_samples_insert', 'INSERT', 'samples', samples('NEW'), when=sample_has_metadata('NEW'))
+    statements += _trigger('facets_samples_update', 'UPDATE OF id, patient_id', 'samples', samples('OLD') + samples('NEW'),
+                           when=f"{sample_has_metadata('OLD')} OR {sample_has_metadata('NEW')}")
+    statements += _trigger('facets_samples_delete', 'DELETE', 'samples', samples('OLD'), when=sample_has_metadata('OLD'))
+
+    # A patient's samples belong to its project too
+    def patients(row):
+        sign = '+' if row == 'NEW' else '-'
+        return (_facet_entities_delta('patients', f'{row}.project_id', f'SELECT {row}.id', sign)
+                + _facet_entities_delta('samples', f'{row}.project_id', f'SELECT id FROM samples WHERE patient_id = {row}.id', sign))
+
+    def patient_has_metadata(row):
+        return (f'EXISTS (SELECT 1 FROM patients_metadata WHERE patient_id = {row}.id) '
+                f'OR EXISTS (SELECT 1 FROM samples WHERE patient_id = {row}.id)')
+
+    statements += _trigger('facets_patients_insert', 'INSERT', 'patients', patients('NEW'), when=patient_has_metadata('NEW'))
+    statements += _trigger('facets_patients_update', 'UPDATE OF id, project_id', 'patients', patients('OLD') + patients('NEW'),
+                           when=f"{patient_has_metadata('OLD')} OR {patient_has_metadata('NEW')}")
+    statements += _trigger('facets_patients_delete', 'DELETE', 'patients', patients('OLD'), when=patient_has_metadata('OLD'))
+    return statements
+
+
+# datasets_metadata key holding a dataset's total raw file size, as reported by the tracker
+RAW_SIZE_KEY = 'raw_file_extension_size_of_all_files'
+
+
+def _size_bytes(expr):
+    # Bytes in a size such as '123MB', '1.5 GB' or '2048'; unknown units count as 0
+    unit = f"upper(trim(ltrim({expr}, '0123456789. ')))"
+    return f'''CAST(CAST({expr} AS REAL) * CASE {unit}
+        WHEN '' THEN 1 WHEN 'B' THEN 1 WHEN 'KB' THEN 1024 WHEN 'MB' THEN 1048576
+        WHEN 'GB' THEN 1073741824 WHEN 'TB' THEN 1099511627776 ELSE 0 END AS INTEGER)'''
+
+
+def _dataset_raw_bytes(dataset_expr):
+    return f'''(SELECT COALESCE(SUM({_size_bytes('value')}), 0) FROM datasets_metadata
+                WHERE dataset_id = {dataset_expr} AND key = '{RAW_SIZE_KEY}')'''
+
+
+def _summary_recount(project_expr):
+    # A project's summary row computed from scratch
+    return f'''
+        SELECT {project_expr},
+               (SELECT COUNT(*) FROM patients WHERE project_id = {project_expr}),
+               (SELECT COUNT(*) FROM samples s JOIN patients p ON p.id = s.patient_id WHERE p.project_id = {project_expr}),
+               (SELECT COUNT(*) FROM datasets WHERE project_id = {project_expr}),
+               (SELECT COUNT(*) FROM raw_files rf JOIN datasets d ON d.id = rf.dataset_id WHERE d.project_id = {project_expr}),
+               (SELECT COALESCE(SUM({_size_bytes('dm.value')}), 0) FROM datasets_metadata dm
+                JOIN datasets d ON d.id = dm.dataset_id WHERE d.project_id = {project_expr} AND dm.key = '{RAW_SIZE_KEY}')
+    '''
+
+
+SUMMARY_COLUMNS = ('patient_count', 'sample_count', 'dataset_count', 'raw_file_count', 'raw_bytes')
+
+
+def _summary_delta(project_expr, sign, **deltas):
+    # Add (sign '+') or subtract (sign '-') deltas to the summary row of a project
+    sets = ', '.join(f'{column} = {column} {sign} ({value})' for column, value in deltas.items())
+    return f'''
+        UPDATE project_summaries SET {sets} WHERE project_id = {project_expr};
+    '''
+
+
+def _summary_triggers():
+    """
+    Build the triggers keeping project_summaries in step with writes to the tables it counts.
+    Each write adjusts its project's counters by a delta, so it costs the same however large
+    the project is.
+    """
+    def patient_project(row):
+        return f'(SELECT project_id FROM patients WHERE id = {row}.patient_id)'
+
+    def dataset_project(row):
+        return f'(SELECT project_id FROM datasets WHERE id = {row}.dataset_id)'
+
+    def patient(row, sign):
+        return _summary_delta(f'{row}.project_id', sign, patient_count=1,
+                              sample_count=f'SELECT COUNT(*) FROM samples WHERE patient_id = {row}.id')
+
+    def sample(row, sign):
+        return _summary_delta(patient_project(row), sign, sample_count=1)
+
+    def dataset(row, sign):
+        return _summary_delta(f'{row}.project_id', sign, dataset_count=1,
+                              raw_file_count=f'SELECT COUNT(*) FROM raw_files WHERE dataset_id = {row}.id',
+                              raw_bytes=_dataset_raw_bytes(f'{row}.id'))
+
+    def raw_file(row, sign):
+        return _summary_delta(dataset_project(row), sign, raw_file_count=1)
+
+    def raw_size(row, sign):
+        return _summary_delta(dataset_project(row), sign,
+                              raw_bytes=f"CASE WHEN {row}.key = '{RAW_SIZE_KEY}' THEN {_size_bytes(f'{row}.value')} ELSE 0 END")
+
+    statements = []
+    statements += _trigger('summary_projects_insert', 'INSERT', 'projects', f'''
+        INSERT OR REPLACE INTO project_summaries (project_id, {', '.join(SUMMARY_COLUMNS)}) {_summary_recount('NEW.id')};
+    ''')
+    statements += _trigger('summary_projects_delete', 'DELETE', 'projects',
+                           'DELETE FROM project_summaries WHERE project_id = OLD.id;')
+    for table, delta, moved in (
+        ('patients', patient, 'id, project_id'),
+        ('samples', sample, 'patient_id'),
+        ('datasets', dataset, 'id, project_id'),
+        ('raw_files', raw_file, 'dataset_id'),
+        ('datasets_metadata', raw_size, 'dataset_id, key, value'),
+    ):
+        statements += _trigger(f'summary_{table}_insert', 'INSERT', table, delta('NEW', '+'))
+        statements += _trigger(f'summary_{table}_update', f'UPDATE OF {moved}', table, delta('OLD', '-') + delta('NEW', '+'))
+        statements += _trigger(f'summary_{table}_delete', 'DELETE', table, delta('OLD', '-'))
+    return statements
+
+
+def _sample_link(row):
+    # raw_file_samples row for a raw_files_metadata row, if it is a sample_id link; only
+    # canonical integers link, so each link has exactly one metadata row
+    return f'''
+        SELECT {row}.raw_file_id, CAST({row}.metadata_value AS INTEGER)
+        WHERE {row}.metadata_key = 'sample_id' AND {row}.raw_file_id IS NOT NULL
+          AND CAST(CAST({row}.metadata_value AS INTEGER) AS TEXT) = {row}.metadata_value
+    '''
+
+
+def _sample_link_triggers():
+    """
+    Build the triggers keeping raw_file_samples in step with the sample_id rows of
+    raw_files_metadata, which /add_raw_files/ and the tracker scripts write.
+    """
+    def link(row):
+        return f"INSERT OR IGNORE INTO raw_file_samples (raw_file_id, sample_id) {_sample_link(row)};"
+
+    def unlink(row):
+        return f"DELETE FROM raw_file_samples WHERE (raw_file_id, sample_id) IN ({_sample_link(row)});"
+
+    statements = []
+    statements += _trigger('sample_links_raw_files_metadata_insert', 'INSERT', 'raw_files_metadata', link('NEW'))
+    statements += _trigger('sample_links_raw_files_metadata_update', 'UPDATE', 'raw_files_metadata', unlink('OLD') + link('NEW'))
+    statements += _trigger('sample_links_raw_files_metadata_delete', 'DELETE', 'raw_files_metadata', unlink('OLD'))
+    statements += _trigger('sample_links_raw_files_delete', 'DELETE', 'raw_files',
+                           'DELETE FROM raw_file_samples WHERE raw_file_id = OLD.id;')
+    return statements
+
+
+# Ordered schema migrations. Each entry is (version, name, statements); statements must be
+# idempotent so a migration can be applied to databases created before versioning existed.
+# Append new migrations with the next version number; never edit or reorder applied ones.
+MIGRATIONS = [
+    (1, 'base schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            status TEXT
+        );
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS datasets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            name TEXT,
+            FOREIGN KEY (project_id) REFERENCES projects(id)
+        );
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS datasets_metadata (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dataset_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL
+        );
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS patients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            ext_patient_id TEXT,
+            ext_patient_url TEXT,
+            public_patient_id TEXT,
+            FOREIGN KEY (project_id) REFERENCES projects(id)
+        );
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS patients_metadata (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL,
+            key TEXT,
+            value TEXT,
+            FOREIGN KEY (patient_id) REFERENCES patients(id)
+        );
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS samples (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL,
+            ext_sample_id TEXT,
+            ext_sample_url TEXT,
+            FOREIGN KEY (patient_id) REFERENCES patients(id)
+        );
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS samples_metadata (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sample_id INTEGER NOT NULL,
+            key TEXT,
+            value TEXT,
+            FOREIGN KEY (sample_id) REFERENCES samples(id)
+        );
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS raw_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dataset_id INTEGER NOT NULL,
+            path TEXT,
+            UNIQUE(dataset_id, path),
+            FOREIGN KEY (dataset_id) REFERENCES datasets(id)
+        );
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS raw_files_metadata (
+            metadata_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            raw_file_id INTEGER,
+            metadata_key TEXT NOT NULL,
+            metadata_value TEXT NOT NULL,
+            FOREIGN KEY (raw_file_id) REFERENCES raw_files (id)
+        );
+        ''',
+    ]),
+    (2, 'secondary indexes for hot lookups', [
+        'CREATE INDEX IF NOT EXISTS idx_datasets_project_id ON datasets(project_id)',
+        'CREATE INDEX IF NOT EXISTS idx_datasets_metadata_dataset_key ON datasets_metadata(dataset_id, key)',
+        'CREATE INDEX IF NOT EXISTS idx_patients_project_id ON patients(project_id)',
+        'CREATE INDEX IF NOT EXISTS idx_patients_metadata_patient_id ON patients_metadata(patient_id)',
+        'CREATE INDEX IF NOT EXISTS idx_samples_patient_id ON samples(patient_id)',
+        'CREATE INDEX IF NOT EXISTS idx_samples_metadata_sample_id ON samples_metadata(sample_id)',
+        'CREATE INDEX IF NOT EXISTS idx_raw_files_dataset_id ON raw_files(dataset_id)',
+        'CREATE INDEX IF NOT EXISTS idx_raw_files_metadata_raw_file_key ON raw_files_metadata(raw_file_id, metadata_key)',
+    ]),
+    # Databases created from the older init_db have no UNIQUE(dataset_id, path) and may hold
+    # duplicate registrations; fold them into the lowest id before adding the unique keys
+    # that let /add_raw_files/ upsert with ON CONFLICT.
+    (3, 'unique raw file paths and metadata rows', [
+        '''
+        CREATE TEMP TABLE raw_file_keep AS
+        SELECT id, MIN(id) OVER (PARTITION BY dataset_id, path) AS keep_id
+        FROM raw_files
+        WHERE path IS NOT NULL
+        ''',
+        '''
+        UPDATE raw_files_metadata
+        SET raw_file_id = (SELECT keep_id FROM raw_file_keep WHERE raw_file_keep.id = raw_files_metadata.raw_file_id)
+        WHERE raw_file_id IN (SELECT id FROM raw_file_keep WHERE id != keep_id)
+        ''',
+        'DELETE FROM raw_files WHERE id IN (SELECT id FROM raw_file_keep WHERE id != keep_id)',
+        'DROP TABLE temp.raw_file_keep',
+        '''
+        DELETE FROM raw_files_metadata
+        WHERE metadata_id NOT IN (
+            SELECT MIN(metadata_id) FROM raw_files_metadata
+            GROUP BY raw_file_id, metadata_key, metadata_value
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_raw_files_dataset_path ON raw_files(dataset_id, path)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_raw_files_metadata_unique ON raw_files_metadata(raw_file_id, metadata_key, metadata_value)',
+        # The unique index covers (raw_file_id, metadata_key) lookups on its own
+        'DROP INDEX IF EXISTS idx_raw_files_metadata_raw_file_key',
+    ]),
+    # Version counters for the response cache, bumped by triggers on every write from any
+    # process (API workers and import scripts alike) so cached responses can be validated
+    # against the scopes they were built from
+    (4, 'response cache epochs', [
+        '''
+        CREATE TABLE IF NOT EXISTS cache_epochs (
+            scope TEXT NOT NULL,
+            scope_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (scope, scope_id)
+        ) WITHOUT ROWID
+        ''',
+        *_epoch_triggers('projects', lambda row: _bump_epoch('projects', '0')),
+        *_epoch_triggers('datasets', lambda row: _bump_epoch('project', f'{row}.project_id') + _bump_epoch('dataset', f'{row}.id')),
+        *_epoch_triggers('datasets_metadata', lambda row: _bump_epoch('dataset', f'{row}.dataset_id')),
+        *_epoch_triggers('patients', lambda row: _bump_project_epochs(f'{row}.project_id')),
+        *_epoch_triggers('patients_metadata', lambda row: _bump_project_epochs(
+            f'(SELECT project_id FROM patients WHERE id = {row}.patient_id)')),
+        *_epoch_triggers('samples', lambda row: _bump_project_epochs(
+            f'(SELECT project_id FROM patients WHERE id = {row}.patient_id)')),
+        *_epoch_triggers('samples_metadata', lambda row: _bump_project_epochs(
+            f'(SELECT p.project_id FROM samples s JOIN patients p ON p.id = s.patient_id WHERE s.id = {row}.sample_id)')),
+        *_epoch_triggers('raw_files', lambda row: _bump_epoch('dataset', f'{row}.dataset_id')),
+        *_epoch_triggers('raw_files_metadata', lambda row: _bump_epoch(
+            'dataset', f'(SELECT dataset_id FROM raw_files WHERE id = {row}.raw_file_id)')),
+    ]),
+    # Metadata filters: (key, value) indexes find the entities matching the most selective
+    # predicate, and the attributes pivots let the remaining predicates be checked with one
+    # primary key lookup per candidate instead of one self-join per key
+    (5, 'metadata filter indexes and attribute pivots', [
+        'CREATE INDEX IF NOT EXISTS idx_samples_metadata_key_value ON samples_metadata(key, value, sample_id)',
+        'CREATE INDEX IF NOT EXISTS idx_patients_metadata_key_value ON patients_metadata(key, value, patient_id)',
+        *_attributes_pivot('samples_metadata', 'samples_attributes', 'sample_id'),
+        *_attributes_pivot('patients_metadata', 'patients_attributes', 'patient_id'),
+    ]),
+    # Value counts per project and metadata key for /metadata_facets/, counting each entity
+    # once per key and value, maintained by triggers so reading them is an index range scan
+    (6, 'metadata facet counts', [
+        '''
+        CREATE TABLE IF NOT EXISTS metadata_facets (
+            entity TEXT NOT NULL,
+            project_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (entity, project_id, key, value)
+        ) WITHOUT ROWID
+        ''',
+        'DELETE FROM metadata_facets',
+        '''
+        INSERT INTO metadata_facets (entity, project_id, key, value, count)
+        SELECT 'samples', p.project_id, sm.key, sm.value, COUNT(DISTINCT sm.sample_id)
+        FROM samples_metadata sm
+        JOIN samples s ON s.id = sm.sample_id
+        JOIN patients p ON p.id = s.patient_id
+        WHERE sm.key IS NOT NULL AND sm.value IS NOT NULL
+        GROUP BY p.project_id, sm.key, sm.value
+        ''',
+        '''
+        INSERT INTO metadata_facets (entity, project_id, key, value, count)
+        SELECT 'patients', p.project_id, pm.key, pm.value, COUNT(DISTINCT pm.patient_id)
+        FROM patients_metadata pm
+        JOIN patients p ON p.id = pm.patient_id
+        WHERE pm.key IS NOT NULL AND pm.value IS NOT NULL
+        GROUP BY p.project_id, pm.key, pm.value
+        ''',
+        *_facet_triggers(),
+    ]),
+    # Per-project totals for /projects/{id}/summary, adjusted by triggers on every write
+    (7, 'project summaries', [
+        f'''
+        CREATE TABLE IF NOT EXISTS project_summaries (
+            project_id INTEGER PRIMARY KEY,
+            {', '.join(f'{column} INTEGER NOT NULL DEFAULT 0' for column in SUMMARY_COLUMNS)}
+        )
+        ''',
+        'DELETE FROM project_summaries',
+        f"INSERT INTO project_summaries (project_id, {', '.join(SUMMARY_COLUMNS)}) {_summary_recount('pr.id')} FROM projects pr",
+        *_summary_triggers(),
+    ]),
+    # Typed raw file -> sample links, replacing joins on the TEXT raw_files_metadata.metadata_value.
+    # A file may link to several samples (e.g. a counts matrix); both directions are index lookups.
+    (8, 'raw file sample links', [
+        '''
+        CREATE TABLE IF NOT EXISTS raw_file_samples (
+            raw_file_id INTEGER NOT NULL,
+            sample_id INTEGER NOT NULL,
+            PRIMARY KEY (raw_file_id, sample_id),
+            FOREIGN KEY (raw_file_id) REFERENCES raw_files(id),
+            FOREIGN KEY (sample_id) REFERENCES samples(id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_raw_file_samples_sample_id ON raw_file_samples(sample_id, raw_file_id)',
+        'DELETE FROM raw_file_samples',
+        f'''
+        INSERT OR IGNORE INTO raw_file_samples (raw_file_id, sample_id)
+        SELECT rfm.raw_file_id, CAST(rfm.metadata_value AS INTEGER)
+        FROM raw_files_metadata rfm
+        JOIN raw_files rf ON rf.id = rfm.raw_file_id
+        WHERE rfm.metadata_key = 'sample_id'
+          AND CAST(CAST(rfm.metadata_value AS INTEGER) AS TEXT) = rfm.metadata_value
+        ''',
+        *_sample_link_triggers(),
+    ]),
+    # One value per dataset and key, so metadata writes can upsert with ON CONFLICT instead of
+    # a read-then-write that concurrent tracker runs could both take the insert branch of.
+    # Duplicates already written that way are folded into the lowest id, the row updates went to.
+    (9, 'unique dataset metadata keys', [
+        '''
+        DELETE FROM datasets_metadata
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM datasets_metadata
+            GROUP BY dataset_id, key
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_datasets_metadata_unique ON datasets_metadata(dataset_id, key)',
+        # The unique index covers (dataset_id, key) lookups on its own
+        'DROP INDEX IF EXISTS idx_datasets_metadata_dataset_key',
+    ]),
+    # Results of bulk writes sent with an Idempotency-Key, so a retried upload chunk gets the
+    # first attempt's result instead of being written again
+    (10, 'ingest idempotency keys', [
+        '''
+        CREATE TABLE IF NOT EXISTS ingest_requests (
+            key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_ingest_requests_created_at ON ingest_requests(created_at)',
+    ]),
+    # Server-side tracker runs, with progress counters the scan worker updates as it goes
+    (11, 'scan jobs', [
+        '''
+        CREATE TABLE IF NOT EXISTS scan_jobs (
+            id INTEGER PRIMARY KEY,
+            dataset_id INTEGER NOT NULL,
+            directory TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            files_seen INTEGER NOT NULL DEFAULT 0,
+            files_matched INTEGER NOT NULL DEFAULT 0,
+            bytes_seen INTEGER NOT NULL DEFAULT 0,
+            files_registered INTEGER NOT NULL DEFAULT 0,
+            files_removed INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            server_pid INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            FOREIGN KEY (dataset_id) REFERENCES datasets(id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_scan_jobs_dataset_id ON scan_jobs(dataset_id, id)',
+        # At most one unfinished job per dataset, so two scans never write the same files
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_scan_jobs_active ON scan_jobs(dataset_id)
+        WHERE status IN ('queued', 'running')
+        ''',
+    ]),
+    # Content checksums are stored as raw_files_metadata; this finds files with the same
+    # content, across all datasets, from the index alone
+    (12, 'raw file checksum index', [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_raw_files_metadata_checksum ON raw_files_metadata(metadata_value, raw_file_id)
+        WHERE metadata_key = 'checksum'
+        ''',
+    ]),
+    # Rebuild the attribute pivots without metadata values holding a pivot separator, which
+    # could make an entity look like it has a key=value pair it does not have
+    (13, 'attribute pivots without separator values', [
+        *_attributes_pivot('samples_metadata', 'samples_attributes', 'sample_id'),
+        *_attributes_pivot('patients_metadata', 'patients_attributes', 'patient_id'),
+    ]),
+]
+
+
+# Lookups the API runs on every request, with the index each one must use (None for any).
+# check_query_plans() fails if any of them falls back to a full table scan.
+HOT_QUERIES = [
+    ("patients by project", "SELECT id FROM patients WHERE project_id = ? AND id > ?", (1, 0), 'idx_patients_project_id'),
+    ("samples by patient", "SELECT id FROM samples WHERE patient_id = ?", (1,), 'idx_samples_patient_id'),
+    ("samples_metadata by sample", "SELECT id, key, value FROM samples_metadata WHERE sample_id = ?", (1,), 'idx_samples_metadata_sample_id'),
+    ("patients_metadata by patient", "SELECT id, key, value FROM patients_metadata WHERE patient_id = ?", (1,), 'idx_patients_metadata_patient_id'),
+    ("datasets_metadata by dataset and key", "SELECT id, value FROM datasets_metadata WHERE dataset_id = ? AND key = ?", (1, 'last_size_update'), 'idx_datasets_metadata_unique'),
+    ("raw_files_metadata by file and key", "SELECT metadata_value FROM raw_files_metadata WHERE raw_file_id = ? AND metadata_key = ?", (1, 'sample_id'), 'idx_raw_files_metadata_unique'),
+    # Either the UNIQUE(dataset_id, path) autoindex or idx_raw_files_dataset_id will do
+    ("raw_files by dataset", "SELECT id FROM raw_files WHERE dataset_id = ? AND id > ?", (1, 0), None),
+    ("samples by metadata value", "SELECT sample_id FROM samples_metadata WHERE key = ? AND value = ? AND sample_id > ?", ('tissue', 'Liver', 0), 'idx_samples_metadata_key_value'),
+    ("patients by metadata value", "SELECT patient_id FROM patients_metadata WHERE key = ? AND value = ? AND patient_id > ?", ('sex', 'Female', 0), 'idx_patients_metadata_key_value'),
+    ("sample attributes by sample", "SELECT attrs FROM samples_attributes WHERE sample_id = ?", (1,), None),
+    ("samples of a raw file", "SELECT sample_id FROM raw_file_samples WHERE raw_file_id = ?", (1,), 'PRIMARY KEY'),
+    ("raw files of a sample", "SELECT raw_file_id FROM raw_file_samples WHERE sample_id = ?", (1,), 'idx_raw_file_samples_sample_id'),
+    ("raw files of a dataset under a directory", "SELECT id, path FROM raw_files WHERE dataset_id = ? AND path >= ? AND path < ?", (1, 'data/', 'data0'), None),
+    ("scan jobs of a dataset", "SELECT id FROM scan_jobs WHERE dataset_id = ? ORDER BY id DESC", (1,), 'idx_scan_jobs_dataset_id'),
+    ("raw files by checksum", "SELECT raw_file_id FROM raw_files_metadata WHERE metadata_key = 'checksum' AND metadata_value = ?", ('blake2b:00',), 'idx_raw_files_metadata_checksum'),
+    ("facet counts by project", "SELECT key, value, count FROM metadata_facets WHERE entity = ? AND project_id = ?", ('samples', 1), 'PRIMARY KEY'),
+]
+
+
+# Tables with fewer rows than this are not checked by default: once ANALYZE has seen how
+# small they are, the planner rightly prefers scanning them to searching an index
+PLAN_CHECK_MIN_ROWS = 1000
+
+
+def current_version(conn):
+    """
+    Return the highest applied migration version, or 0 for an unversioned database.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    """
+    Apply every pending migration in order, each in its own transaction.
+
+    BEGIN IMMEDIATE takes the write lock before the version check, so several
+    workers starting at once apply each migration exactly once.
+
+    Args:
+    conn (sqlite3.Connection): The database to migrate.
+
+    Returns:
+    list: The (version, name) pairs that were applied.
+    """
+    applied = []
+    current_version(conn)
+    conn.commit()
+
+    for version, name, statements in MIGRATIONS:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.now().isoformat(timespec='seconds')),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append((version, name))
+
+    if applied:
+        conn.execute('PRAGMA optimize')
+    return applied
+
+
+def check_query_plans(conn, min_rows=PLAN_CHECK_MIN_ROWS):
+    """
+    Run EXPLAIN QUERY PLAN over HOT_QUERIES and report any that do not use their index.
+
+    Args:
+    conn (sqlite3.Connection): The migrated database.
+    min_rows (int): Skip queries on tables with fewer rows than this; 0 checks them all.
+
+    Returns:
+    list: (description, plan) pairs for queries that scan instead of searching an index.
+    """
+    problems = []
+    for description, query, params, index in HOT_QUERIES:
+        table = re.search(r'FROM (\w+)', query).group(1)
+        if min_rows and conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} LIMIT ?)", (min_rows,)).fetchone()[0] < min_rows:
+            continue
+        plan = ' | '.join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params))
+        if 'SEARCH' not in plan or (index and index not in plan):
+            problems.append((description, plan))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply schema migrations and check that hot queries use indexes.')
+    parser.add_argument('database', type=str, nargs='?', default='data/data_redmane.db', help='Path to the SQLite database')
+    parser.add_argument('--check-plans', action='store_true', help='Fail if a hot query does not use its index')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    for version, name in migrate(conn):
+        print(f"Applied migration {version}: {name}")
+    print(f"Schema version: {current_version(conn)}")
+
+    if args.check_plans:
+        problems = check_query_plans(conn)
+        for description, plan in problems:
+            print(f"No index used for {description}: {plan}")
+        conn.close()
+        if problems:
+            raise SystemExit(1)
+        print("All hot queries use their indexes")
+    else:
+        conn.close()
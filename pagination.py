@@ -0,0 +1,92 @@
+from fastapi.responses import StreamingResponse
+
+from serialization import dump_json
+
+
+# Largest SQLite integer, used as the open upper bound of an unpaged keyset range
+MAX_ID = 2**63 - 1
+
+# Number of entities read per query while streaming
+STREAM_PAGE_SIZE = 1000
+
+# Response header carrying the cursor for the next page
+NEXT_AFTER_HEADER = 'X-Next-After'
+
+STREAM_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+def keyset_upper_bound(cursor, id_query, params, limit):
+    """
+    Find the largest id on a keyset page, so the page can be selected with an id range.
+
+    Args:
+    cursor (sqlite3.Cursor): The cursor to run the query on.
+    id_query (str): A query selecting the candidate ids, already filtered to id > after.
+    params (tuple): Parameters for id_query.
+    limit (int): The page size, or None for no limit.
+
+    Returns:
+    int: The id of the limit-th candidate, or MAX_ID if there are fewer candidates.
+    """
+    if limit is None:
+        return MAX_ID
+    cursor.execute(id_query + " ORDER BY 1 LIMIT 1 OFFSET ?", (*params, limit - 1))
+    row = cursor.fetchone()
+    return row[0] if row else MAX_ID
+
+
+def next_after_headers(items, limit):
+    """
+    Return the next-page cursor header when a paged response came back full.
+    """
+    if limit is not None and items and len(items) >= limit:
+        return {NEXT_AFTER_HEADER: str(items[-1]['id'])}
+    return {}
+
+
+def iter_pages(db, fetch_page, after, limit, fmt):
+    """
+    Yield the rows of a keyset-paginated fetch function as NDJSON lines or a chunked
+    JSON array, one page at a time, so memory stays flat however many rows there are.
+
+    fetch_page is called as fetch_page(conn, after=..., limit=...) and must return
+    dicts with an 'id' key in ascending id order. A pooled connection is borrowed for each
+    page and returned before the page is sent, so clients reading slowly do not hold
+    connections the other requests need. Pages are read in separate transactions; the
+    keyset cursor still returns every row that exists throughout the stream exactly once.
+    """
+    separator = b',' if fmt == 'json' else b'\n'
+    if fmt == 'json':
+        yield b'['
+
+    first = True
+    remaining = limit
+    while remaining is None or remaining > 0:
+        page_size = STREAM_PAGE_SIZE if remaining is None else min(STREAM_PAGE_SIZE, remaining)
+        with db.connection() as conn:
+            page = fetch_page(conn, after=after, limit=page_size)
+        if not page:
+            break
+
+        chunk = separator.join(dump_json(item) for item in page)
+        if fmt == 'json':
+            yield chunk if first else separator + chunk
+        else:
+            yield chunk + separator
+        first = False
+
+        after = page[-1]['id']
+        if remaining is not None:
+            remaining -= len(page)
+        if len(page) < page_size:
+            break
+
+    if fmt == 'json':
+        yield b']'
+
+
+def streaming_response(db, fetch_page, after, limit, fmt):
+    return StreamingResponse(iter_pages(db, fetch_page, after, limit, fmt), media_type=STREAM_MEDIA_TYPES[fmt])
@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from database import configure_connection
+from ingest import raw_files_metadata_page, replace_raw_files_metadata
+
+# The statistics engine lives with the file tracker's other file readers
+TRACKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_files', 'tracker')
+if TRACKER_DIR not in sys.path:
+    sys.path.insert(0, TRACKER_DIR)
+
+from file_stats import file_stats, stats_kind
+
+
+# Files read at once, each in its own process
+STATS_WORKERS = os.cpu_count() or 1
+
+# Files looked up per query, and results written every STATS_BATCH_SIZE files or
+# STATS_FLUSH_SECONDS, so an interrupted run keeps what it has done
+STATS_PAGE_SIZE = 10000
+STATS_BATCH_SIZE = 1000
+STATS_FLUSH_SECONDS = 5
+
+# raw_files_metadata keys: the size and mtime the statistics were computed at, and the
+# statistics of FASTQ files and of counts tables; column_totals is a JSON object
+STATS_SIZE_KEY = 'stats_size'
+STATS_MTIME_KEY = 'stats_mtime_ns'
+STATS_KEYS = [STATS_SIZE_KEY, STATS_MTIME_KEY,
+              'read_count', 'base_count', 'mean_read_length', 'min_read_length', 'max_read_length',
+              'row_count', 'column_count', 'column_totals']
+
+
+def _stats_task(task):
+    # Runs in a worker process; returns (raw_file_id, metadata or None if unchanged or
+    # failed, bytes read, error)
+    raw_file_id, path, size, mtime_ns = task
+    try:
+        before = os.stat(path)
+        if before.st_size == size and before.st_mtime_ns == mtime_ns:
+            return raw_file_id, None, 0, None
+        stats = file_stats(path)
+        after = os.stat(path)
+        if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+            return raw_file_id, None, 0, "changed while it was read"
+    except (OSError, EOFError, ValueError, zlib.error) as e:
+        return raw_file_id, None, 0, str(e)
+
+    metadata = {key: json.dumps(value) if isinstance(value, dict) else value for key, value in stats.items()}
+    metadata[STATS_SIZE_KEY] = after.st_size
+    metadata[STATS_MTIME_KEY] = after.st_mtime_ns
+    return raw_file_id, metadata, after.st_size, None
+
+
+def compute_raw_file_stats(conn, dataset_id=None, workers=STATS_WORKERS, root='.', onprogress=None, onerror=None):
+    """
+    Read registered FASTQ files and counts tables on a process pool and store their
+    statistics (see file_stats.fastq_stats and counts_stats) in raw_files_metadata, with
+    the size and mtime they were computed at.
+
+    Files whose size and mtime still match their stored statistics are not read again, and
+    files of other kinds are skipped, so repeated runs only read new and changed files.
+
+    Args:
+    conn (sqlite3.Connection): The database connection.
+    dataset_id (int): Only this dataset's files; all datasets if None.
+    workers (int): Files read at once.
+    root (str): Directory relative raw file paths are resolved against.
+    onprogress (callable): Called with the counts after every stored batch.
+    onerror (callable): Called with (path, message) for each file that could not be read.
+
+    Returns:
+    dict: Counts of read, unchanged, skipped and failed files, bytes read (as stored,
+    before decompression), seconds and MB/s.
+    """
+    counts = {"read": 0, "unchanged": 0, "skipped": 0, "failed": 0, "bytes": 0, "seconds": 0.0, "mb_per_s": 0.0}
+    started = last_flush = time.perf_counter()
+    batch = []
+
+    def flush():
+        nonlocal last_flush
+        replace_raw_files_metadata(conn, STATS_KEYS, batch)
+        batch.clear()
+        last_flush = time.perf_counter()
+        counts["seconds"] = round(last_flush - started, 3)
+        counts["mb_per_s"] = round(counts["bytes"] / 1e6 / counts["seconds"], 1) if counts["seconds"] else 0.0
+        if onprogress is not None:
+            onprogress(dict(counts))
+
+    # spawn, not fork, so this also works from the API process and its threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+        after = 0
+        while page := raw_files_metadata_page(conn, [STATS_SIZE_KEY, STATS_MTIME_KEY], dataset_id, after, STATS_PAGE_SIZE):
+            after = page[-1][0]
+            paths = {raw_file_id: path for raw_file_id, path, _ in page}
+            tasks = [(raw_file_id, os.path.join(root, path),
+                      int(stored.get(STATS_SIZE_KEY, -1)), int(stored.get(STATS_MTIME_KEY, -1)))
+                     for raw_file_id, path, stored in page if stats_kind(path)]
+            counts["skipped"] += len(page) - len(tasks)
+            for raw_file_id, metadata, size, error in pool.map(_stats_task, tasks, chunksize=4):
+                if error is not None:
+                    counts["failed"] += 1
+                    if onerror is not None:
+                        onerror(paths[raw_file_id], error)
+                elif metadata is None:
+                    counts["unchanged"] += 1
+                else:
+                    counts["read"] += 1
+                    counts["bytes"] += size
+                    batch.append((raw_file_id, metadata))
+                    if len(batch) >= STATS_BATCH_SIZE or time.perf_counter() - last_flush >= STATS_FLUSH_SECONDS:
+                        flush()
+    flush()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Store read and base counts of FASTQ files and column totals of counts tables.')
+    parser.add_argument('database', type=str, nargs='?', default='data/data_redmane.db', help='Path to the SQLite database')
+    parser.add_argument('--dataset_id', type=int, help='Only read this dataset\'s files')
+    parser.add_argument('--workers', type=int, default=STATS_WORKERS, help='Files read at once')
+    parser.add_argument('--root', type=str, default='.', help='Directory relative raw file paths are resolved against')
+    args = parser.parse_args()
+
+    def print_progress(counts):
+        print(f"{counts['read']} read, {counts['unchanged']} unchanged, {counts['skipped']} skipped, "
+              f"{counts['failed']} failed, {counts['bytes'] / 1e6:.0f} MB at {counts['mb_per_s']} MB/s")
+
+    def print_error(path, message):
+        print(f"Error reading {path}: {message}")
+
+    conn = configure_connection(sqlite3.connect(args.database))
+    counts = compute_raw_file_stats(conn, args.dataset_id, workers=args.workers, root=args.root,
+                                    onprogress=print_progress, onerror=print_error)
+    print(json.dumps(counts, indent=2))
+    conn.close()
@@ -1,38 +1,37 @@
 import requests
 from datetime import datetime
-import os,re
-import requests
 import argparse
-import subprocess
-import platform
 import json
 
-def get_total_size(extension,directory):
-    total_size = 0
-    for root, dirs, files in os.walk('.'):
-        for file in files:
-            if file.endswith(extension):
-                file_path = os.path.join(root, file)
-                total_size += os.path.getsize(file_path)
-    return total_size
+from header_reader import read_headers
+from manifest import DEFAULT_MANIFEST, MANIFEST_BATCH_SIZE, Manifest, match_fingerprint
+from matcher import SampleMatcher
+from scanner import SCAN_WORKERS, scan_tree
+from uploader import UPLOAD_CHUNK_SIZE, UPLOAD_CONCURRENCY, ChunkUploader
 
-def find_files(directory, extension=".fastq"):
+def find_files(directory, extension=".fastq", workers=SCAN_WORKERS, batch_size=MANIFEST_BATCH_SIZE):
     """
-    Recursively search for files with the given extension in the specified directory.
+    Recursively search for files with the given extension in the specified directory,
+    in a single pass that also collects each file's size and mtime.
     
     Args:
     directory (str): The root directory to start the search from.
     extension (str): The file extension to search for (default is ".fastq").
+    workers (int): Directories listed at once.
+    batch_size (int): Files per batch.
     
-    Returns:
-    list: A list of paths to files matching the extension.
+    Yields:
+    list: Batches of ScannedFile tuples (path, size, mtime, extension, inode) of the matching
+    files, as the scan finds them.
     """
-    matches = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith(extension):
-                matches.append(os.path.join(root, file))
-    return matches
+    batch = []
+    for file in scan_tree(directory, extension, workers=workers):
+        batch.append(file)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 def get_dataset_metadata(url):
     response = requests.get(url)
@@ -73,30 +72,20 @@ def get_sample_data(url):
     
     return result
 
-def check_patient_in_filename(filename, ext_patient_id):
-    """
-    Check if ext_patient_id is found in the filename, treating spaces as wildcards.
-    
-    Args:
-    filename (str): The filename.
-    ext_patient_id (str): The ext_patient_id to search for, with spaces treated as wildcards.
-    
-    Returns:
-    bool: True if the ext_patient_id is found in the filename, False otherwise.
-    """
-    # Create a regex pattern to match ext_patient_id with spaces as wildcards
-    pattern = re.compile(re.escape(ext_patient_id).replace(r'\ ', '.*'))
-    
-    if pattern.search(filename):
-        return True
-    
-    return False
-
 parser = argparse.ArgumentParser(description='Search for patient or sample IDs in file names.')
-parser.add_argument('--directory', type=str, help='The root directory to search')
+parser.add_argument('--directory', type=str, default='.', help='The root directory to search')
 parser.add_argument('--dataset_id', type=int, required=True, help='The dataset ID to use')
 parser.add_argument('--project_id', type=int, required=True, help='The project ID to use')
+parser.add_argument('--workers', type=int, default=SCAN_WORKERS, help='Directories listed, or headers read, at once')
+parser.add_argument('--manifest', type=str, default=DEFAULT_MANIFEST, help='Local record of the files seen by earlier runs')
+parser.add_argument('--full', action='store_true', help='Ignore the manifest and send every matched file again')
+parser.add_argument('--api_url', type=str, default='http://localhost:8888', help='The REDMANE API to send results to')
+parser.add_argument('--chunk_size', type=int, default=UPLOAD_CHUNK_SIZE, help='Files sent per request')
+parser.add_argument('--concurrency', type=int, default=UPLOAD_CONCURRENCY, help='Requests in flight at once')
 args = parser.parse_args()
+for name in ('chunk_size', 'concurrency'):
+    if getattr(args, name) < 1:
+        parser.error(f"--{name} must be at least 1")
 
 directory_to_search = args.directory
 dataset_id = args.dataset_id
@@ -105,34 +94,113 @@ project_id = args.project_id
 print(args)
 
 
+api_url = args.api_url.rstrip('/')
+
 # Get sample data
-url = "http://localhost:8888/samples/0?project_id="+str(project_id)
+url = api_url+"/samples/0?project_id="+str(project_id)
 sample_data = get_sample_data(url)
 
-url = "http://localhost:8888/datasets_with_metadata/"+str(dataset_id)+"?project_id="+str(project_id)
+url = api_url+"/datasets_with_metadata/"+str(dataset_id)+"?project_id="+str(project_id)
 dataset_metadata = get_dataset_metadata(url)
 
 sample_info_stored = dataset_metadata["sample_info_stored"]
 raw_file_extensions = dataset_metadata["raw_file_extensions"]
 extension = raw_file_extensions.lstrip("*")  # Remove the asterisk to get the actual extension
 
-total_size_bytes = get_total_size(extension,directory_to_search)
+# Only files that are new or changed since the last run are matched and sent, unless the
+# samples or the matching mode changed, in which case every file is matched again
+manifest = Manifest(args.manifest)
+if args.full:
+    manifest.reset(dataset_id)
+fingerprint = match_fingerprint(sample_info_stored, sample_data)
+rematch_all = manifest.fingerprint(dataset_id) != fingerprint
+manifest.start_scan()
+
+# Match every file against all samples at once instead of sample by sample
+matcher = SampleMatcher(sample_data)
+
+def print_read_error(path, error):
+    print(f"Error reading file {path}: {error}")
+
+# New files are sent in chunks while the scan goes on. Files registered before with other
+# samples are sent once their old registrations are removed, after the scan.
+add_uploader = ChunkUploader(api_url+'/add_raw_files/', chunk_size=args.chunk_size, concurrency=args.concurrency)
+reregister_raw_files = []
+remove_raw_files = []
+checked_files = []
+checked_count = 0
+found_count = 0
+total_size_bytes = 0
+
+def match_file(path, size, mtime, inode, header, previous_samples):
+    if sample_info_stored == "header" and header is None:
+        return  # Unreadable, so not recorded and tried again next run
+    samples = [data["sample_id"] for data in matcher.match(sample_info_stored, path, header)]
+
+    if samples != (previous_samples or []):
+        raw_file = {"path": path,"dataset_id":dataset_id,"metadata":[{"metadata_key": "sample_id","metadata_value":str(sample_id)} for sample_id in samples]}
+        # Registered with other samples before: drop the old registration first
+        if previous_samples:
+            remove_raw_files.append({"path": path, "dataset_id": dataset_id})
+            if samples:
+                reregister_raw_files.append(raw_file)
+        elif samples:
+            add_uploader.add(raw_file)
+    checked_files.append((path, size, mtime, inode, header, samples))
+
+# Find files; one scan gives both the file list and their total size
+with add_uploader:
+    for found in find_files(directory_to_search, extension, workers=args.workers):
+        found_count += len(found)
+        total_size_bytes += sum(file.size for file in found)
+        batch = manifest.stage(found)
+        changed_files = manifest.changed(dataset_id, batch)
+        unchanged_files = manifest.unchanged(dataset_id, batch) if rematch_all else []
+
+        # Read the headers of every file in the batch that needs one, many at a time
+        file_headers = {}
+        if sample_info_stored == "header":
+            paths = [row[0] for row in changed_files] + [row[0] for row in unchanged_files if row[4] is None]
+            file_headers = dict(read_headers(paths, workers=args.workers, onerror=print_read_error))
+
+        for path, size, mtime, inode, previous_samples in changed_files:
+            match_file(path, size, mtime, inode, file_headers.get(path), previous_samples)
+        for path, size, mtime, inode, header, previous_samples in unchanged_files:
+            match_file(path, size, mtime, inode, file_headers.get(path, header), previous_samples)
+
+        # Kept only once the manifest is committed, after everything has been sent
+        manifest.record(dataset_id, checked_files)
+        checked_count += len(checked_files)
+        checked_files.clear()
+    added = add_uploader.close()
+
+deleted_files = manifest.deleted(dataset_id)
+remove_raw_files += [{"path": path, "dataset_id": dataset_id} for path, samples in deleted_files if samples]
+
 total_size_mb = total_size_bytes / (1024 * 1024)
 print(f"Total size of files with extension '{extension}': {total_size_mb:.2f} MB")
-
-
-# Run the command and capture the output
-# Check the operating system
-os_type = platform.system()
-
-if os_type == 'Linux':
-    command = ['du', '--max-depth=1', '-m', directory_to_search]
-elif os_type == 'Darwin':  # macOS
-    command = ['du', '-d', '1', '-m', directory_to_search]
-else:
-    raise OSError(f"Unsupported operating system: {os_type}")
-
-result = subprocess.run(command, capture_output=True, text=True)
+print(f"{found_count} files found, {checked_count} new or changed, "
+      f"{add_uploader.items + len(reregister_raw_files)} to register, {len(remove_raw_files)} to remove")
+
+# Send POST requests to remove deleted files and files whose samples changed
+if remove_raw_files:
+    with ChunkUploader(api_url+'/remove_raw_files/', chunk_size=args.chunk_size, concurrency=args.concurrency) as remove_uploader:
+        for raw_file in remove_raw_files:
+            remove_uploader.add(raw_file)
+        removed = remove_uploader.close()
+    print(f"Raw files removal response: {json.dumps(removed)} in {remove_uploader.chunks} requests")
+
+# Send POST requests to register files again with their new samples
+add_requests = add_uploader.chunks
+if reregister_raw_files:
+    with ChunkUploader(api_url+'/add_raw_files/', chunk_size=args.chunk_size, concurrency=args.concurrency) as reregister_uploader:
+        for raw_file in reregister_raw_files:
+            reregister_uploader.add(raw_file)
+        reregistered = reregister_uploader.close()
+    add_requests += reregister_uploader.chunks
+    for key, value in reregistered.items():
+        added[key] = added.get(key, 0) + value
+print(f"Raw files update response: {json.dumps(added)} in {add_requests} requests")
 
 # Get today's date
 today_date = datetime.now().strftime('%Y-%m-%d')
@@ -142,46 +210,10 @@ update_dataset_metadata_size = {
         "raw_file_size": str(int(total_size_mb))+"MB" ,
         "last_size_update": today_date
     }
-
-
-# Find files
-found_files = find_files(directory_to_search, extension)
-
-update_raw_files = [] 
-
-if sample_info_stored == "header":
-    # Print the found files
-    for file in found_files:
-        try:
-            with open(file, 'r') as file:
-                header = file.readline().strip()
-        except Exception as e:
-            print(f"Error reading file {filename}: {e}")
-
-        components = re.split(r'\s+', header.strip())
-        for data in sample_data:
-            if data["ext_sample_id"] in components:
-                status = "sample_found"
-                update_raw_files.append({"raw_file": file.name,"sample_id":data["sample_id"],"dataset_id":dataset_id,"project_id":project_id})
-                
-
-if sample_info_stored == "filename":
-    # Print the found files
-    for file in found_files:
-        status = "Not found"
-        for data in sample_data:
-            if data["ext_sample_id"] in file:
-                update_raw_files.append({"path": file,"dataset_id":dataset_id,"metadata":[{"metadata_key": "sample_id","metadata_value":str(data["sample_id"])}]})
-            elif check_patient_in_filename(file, data["ext_patient_id"]):
-                status = "patient_found"
-                update_raw_files.append({"path": file,"dataset_id":dataset_id,"metadata":[{"metadata_key": "sample_id","metadata_value":str(data["sample_id"])}]})
-                break
-
-print(json.dumps(update_raw_files,indent=2))
 print(json.dumps(update_dataset_metadata_size,indent=2))
 
 # Send PUT request to update dataset metadata
-update_metadata_url = 'http://localhost:8888/datasets_metadata/size_update'
+update_metadata_url = api_url+'/datasets_metadata/size_update'
 headers = {
     'accept': 'application/json',
     'Content-Type': 'application/json'
@@ -190,10 +222,8 @@ response = requests.put(update_metadata_url, headers=headers, json=update_datase
 response.raise_for_status()
 print(f"Metadata update response: {response.status_code} {response.reason}")
 
-
-
-# Send POST request to add raw files
-add_raw_files_url = 'http://localhost:8888/add_raw_files/'
-response = requests.post(add_raw_files_url, headers=headers, json=update_raw_files)
-response.raise_for_status()
-print(f"Raw files update response: {response.status_code} {response.reason}")
+# The API has everything now, so the next run can start from this one
+manifest.forget(dataset_id, [path for path, samples in deleted_files])
+manifest.set_fingerprint(dataset_id, fingerprint)
+manifest.commit()
+manifest.close()
@@ -0,0 +1,236 @@
+import bz2
+import gzip
+
+from header_reader import BZIP2_MAGIC, GZIP_MAGIC, ZSTD_MAGIC, zstandard
+
+
+# Bytes of decompressed data read per step. Counts tables split into many small tokens, so
+# they are read in smaller blocks to keep the token lists of one block small.
+FASTQ_BLOCK_SIZE = 8 * 1024 * 1024
+COUNTS_BLOCK_SIZE = 1024 * 1024
+
+# Longest line accepted, so a file without line breaks cannot fill memory
+MAX_LINE_BYTES = 64 * 1024 * 1024
+
+FASTQ_SUFFIXES = ('.fastq', '.fq')
+COUNTS_SUFFIXES = ('.tsv',)
+COMPRESSION_SUFFIXES = ('.gz', '.bgz', '.bz2', '.zst')
+
+
+def open_decompressed(path):
+    """
+    Open a file for binary reads, decompressing gzip/bgzip, bzip2 and zstd transparently.
+    Compression is recognised from the file's leading bytes, not its name.
+    """
+    with open(path, 'rb') as file:
+        magic = file.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, 'rb')
+    if magic.startswith(BZIP2_MAGIC):
+        return bz2.open(path, 'rb')
+    if magic.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise OSError("zstd compressed; pip install zstandard to read it")
+        return zstandard.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def line_blocks(path, block_size):
+    """
+    Yield a file's content as blocks of whole lines of roughly block_size bytes, each
+    ending with a line break, so memory stays bounded however large the file is.
+    """
+    carry = b''
+    with open_decompressed(path) as file:
+        while chunk := file.read(block_size):
+            data = carry + chunk if carry else chunk
+            end = data.rfind(b'\n') + 1
+            if end:
+                yield data[:end]
+            carry = data[end:]
+            if len(carry) > MAX_LINE_BYTES:
+                raise ValueError(f"line longer than {MAX_LINE_BYTES} bytes")
+    if carry:
+        yield carry + b'\n'
+
+
+def stats_kind(path):
+    """
+    Return 'fastq' or 'counts' for the files fastq_stats and counts_stats read, judged by
+    name with any compression suffix removed, or None.
+    """
+    name = path.lower()
+    for suffix in COMPRESSION_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    if name.endswith(FASTQ_SUFFIXES):
+        return 'fastq'
+    if name.endswith(COUNTS_SUFFIXES):
+        return 'counts'
+    return None
+
+
+def fastq_stats(path, block_size=FASTQ_BLOCK_SIZE):
+    """
+    Count the reads and bases of a FASTQ file, plain or compressed, in one streaming pass.
+
+    Blocks of whole lines are split and sliced into sequence lines, and everything else is
+    done by bytes methods and builtins running in C, so there is no Python loop per read.
+
+    Returns:
+    dict: read_count, base_count, mean_read_length, min_read_length and max_read_length.
+
+    Raises:
+    ValueError: If the file is not FASTQ, is truncated mid-record or has a line longer
+    than MAX_LINE_BYTES.
+    """
+    lines_seen = 0
+    bases = 0
+    shortest = None
+    longest = 0
+
+    for block in line_blocks(path, block_size):
+        if lines_seen == 0 and not block.startswith(b'@'):
+            raise ValueError("not a FASTQ file: the first line does not start with @")
+        if b'\r' in block:
+            block = block.replace(b'\r', b'')
+        lines = block.split(b'\n')
+        lines.pop()  # Empty, after the block's final line break
+        # Sequences are the second line of each four-line record
+        sequences = lines[(1 - lines_seen) % 4::4]
+        lines_seen += len(lines)
+        if not sequences:
+            continue
+
+        lengths = list(map(len, sequences))
+        bases += sum(lengths)
+        shortest = min(lengths) if shortest is None else min(shortest, min(lengths))
+        longest = max(longest, max(lengths))
+
+    if lines_seen % 4:
+        raise ValueError(f"truncated FASTQ file: {lines_seen} lines is not a whole number of records")
+    reads = lines_seen // 4
+    return {
+        "read_count": reads,
+        "base_count": bases,
+        "mean_read_length": round(bases / reads, 2) if reads else 0,
+        "min_read_length": shortest or 0,
+        "max_read_length": longest,
+    }
+
+
+def _column_total(values):
+    # float() parses faster than int(), and sums of whole counts stay exact below 2**53;
+    # columns without decimals or exponents are returned as integers
+    total = sum(map(float, values))
+    if total.is_integer():
+        joined = b''.join(values)
+        if b'.' not in joined and b'e' not in joined and b'E' not in joined:
+            return int(total)
+    return total
+
+
+def table_lines(block):
+    """
+    Return a block of whole lines of a table without carriage returns and empty lines, e.g.
+    the blank line many tables end with.
+    """
+    if b'\r' in block:
+        block = block.replace(b'\r', b'')
+    if b'\n\n' in block or block.startswith(b'\n'):
+        block = b''.join(line + b'\n' for line in block.split(b'\n') if line)
+    return block
+
+
+def split_header(header):
+    """
+    Split the header line of a counts table into its column names. Tables are tab-separated,
+    or, when the header has no tab, separated by runs of spaces, as the tracker's header
+    matching reads them.
+
+    Returns:
+    tuple: (column names, separator to pass to split_cells).
+
+    Raises:
+    ValueError: If the header has fewer than two columns, i.e. no sample columns.
+    """
+    text = header.decode('utf-8', errors='replace')
+    separator = b'\t' if '\t' in text else None
+    columns = text.split('\t') if separator else text.split()
+    if len(columns) < 2:
+        raise ValueError(f"counts header has {len(columns)} column(s), not an ID column and sample columns "
+                         "separated by tabs or spaces")
+    return columns, separator
+
+
+def split_cells(block, separator):
+    """
+    Return every cell of a block of whole lines, row after row, split as split_header
+    split the header.
+    """
+    if separator is None:
+        return block.split()
+    cells = block.replace(b'\n', separator).split(separator)
+    cells.pop()  # Empty, after the block's final line break
+    return cells
+
+
+def counts_stats(path, block_size=COUNTS_BLOCK_SIZE):
+    """
+    Count the rows and columns of a tab- or space-separated counts table with a header line,
+    e.g. GeneID then one column per sample, and total each sample's column, in one streaming pass.
+
+    Each block of lines is split into cells at once and every column is a slice of them,
+    summed by builtins running in C, so there is no Python loop per row.
+
+    Returns:
+    dict: row_count (excluding the header), column_count (including the first, ID column)
+    and column_totals, each sample column's name mapped to its total.
+
+    Raises:
+    ValueError: If the header has no sample columns, a row has a different number of cells
+    than the header, or a sample column holds something other than numbers.
+    """
+    columns = None
+    totals = None
+    rows = 0
+
+    for block in line_blocks(path, block_size):
+        block = table_lines(block)
+        if columns is None:
+            if not block:
+                continue
+            header, _, block = block.partition(b'\n')
+            columns, separator = split_header(header)
+            totals = [0] * len(columns)
+            if not block:
+                continue
+
+        block_rows = block.count(b'\n')
+        cells = split_cells(block, separator)
+        if len(cells) != block_rows * len(columns):
+            raise ValueError(f"rows after row {rows} do not all have the header's {len(columns)} columns")
+        for column in range(1, len(columns)):
+            totals[column] += _column_total(cells[column::len(columns)])
+        rows += block_rows
+
+    if columns is None:
+        raise ValueError("empty counts file")
+    return {
+        "row_count": rows,
+        "column_count": len(columns),
+        "column_totals": dict(zip(columns[1:], totals[1:])),
+    }
+
+
+def file_stats(path):
+    """
+    Return fastq_stats or counts_stats for a file, by its kind; None for other files.
+    """
+    kind = stats_kind(path)
+    if kind == 'fastq':
+        return fastq_stats(path)
+    if kind == 'counts':
+        return counts_stats(path)
+    return None
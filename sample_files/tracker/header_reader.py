@@ -0,0 +1,166 @@
+import bz2
+import os
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Longest first line returned, after decompression; longer lines are cut here, so a file
+# without line breaks costs at most this much
+HEADER_MAX_BYTES = 64 * 1024
+
+# Bytes read from disk per step, and most bytes decompressed per step
+READ_SIZE = 16 * 1024
+
+# Bytes decompressed by the first step, growing fourfold up to READ_SIZE. Most header lines
+# are far shorter than a read, so this avoids inflating data that is never looked at.
+FIRST_STEP = 1024
+
+# Files read at once; reads are mostly waiting on storage, and zlib/bz2/zstd release the GIL
+HEADER_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+GZIP_MAGIC = b'\x1f\x8b'
+BZIP2_MAGIC = b'BZh'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# zlib window bits for gzip streams (bgzip files are gzip streams of many members)
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def _plain_chunks(file):
+    while chunk := file.read(READ_SIZE):
+        yield chunk
+
+
+def _gzip_chunks(file):
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    data = file.read(READ_SIZE)
+    step = FIRST_STEP
+    while data:
+        yield decompressor.decompress(data, step)
+        step = min(step * 4, READ_SIZE)
+        if decompressor.eof:
+            # Start the next member, e.g. the next bgzip block
+            data = decompressor.unused_data or file.read(READ_SIZE)
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+        else:
+            data = decompressor.unconsumed_tail or file.read(READ_SIZE)
+
+
+def _bzip2_chunks(file):
+    # bzip2 has to decode a whole block (up to 900 kB) before it returns any of it, so
+    # only the amount copied out can be kept small
+    decompressor = bz2.BZ2Decompressor()
+    data = file.read(READ_SIZE)
+    step = FIRST_STEP
+    while data or not decompressor.needs_input:
+        yield decompressor.decompress(data, step)
+        step = min(step * 4, READ_SIZE)
+        if decompressor.eof:
+            # Start the next stream, as written by pbzip2
+            data = decompressor.unused_data or file.read(READ_SIZE)
+            decompressor = bz2.BZ2Decompressor()
+        elif decompressor.needs_input:
+            data = file.read(READ_SIZE)
+        else:
+            data = b''
+
+
+# zstd decompression contexts are costly to create and may not be shared between threads
+_zstd_contexts = threading.local()
+
+
+def _zstd_chunks(file):
+    if zstandard is None:
+        raise OSError("zstd compressed; pip install zstandard to read it")
+    if not hasattr(_zstd_contexts, 'decompressor'):
+        _zstd_contexts.decompressor = zstandard.ZstdDecompressor()
+    reader = _zstd_contexts.decompressor.stream_reader(file, read_size=READ_SIZE, read_across_frames=True)
+    step = FIRST_STEP
+    while chunk := reader.read(step):
+        yield chunk
+        step = min(step * 4, READ_SIZE)
+
+
+def read_header(path, max_bytes=HEADER_MAX_BYTES):
+    """
+    Return the first line of a file, decompressing gzip, bgzip, bzip2 and zstd files just far
+    enough to reach it. Compression is recognised from the file's leading bytes, not its name.
+
+    Args:
+    path (str): The file to read.
+    max_bytes (int): Longest line returned; a longer first line is cut at this length.
+
+    Returns:
+    str: The first line without its line break, decoded as UTF-8 with invalid bytes replaced.
+
+    Raises:
+    OSError: If the file cannot be read. zlib.error, EOFError: If it is corrupt.
+    """
+    with open(path, 'rb') as file:
+        magic = file.read(4)
+        file.seek(0)
+        if magic.startswith(GZIP_MAGIC):
+            chunks = _gzip_chunks(file)
+        elif magic.startswith(BZIP2_MAGIC):
+            chunks = _bzip2_chunks(file)
+        elif magic.startswith(ZSTD_MAGIC):
+            chunks = _zstd_chunks(file)
+        else:
+            chunks = _plain_chunks(file)
+
+        line = b''
+        for chunk in chunks:
+            line += chunk
+            end = line.find(b'\n')
+            if end >= 0:
+                line = line[:end]
+                break
+            if len(line) >= max_bytes:
+                break
+    return line[:max_bytes].rstrip(b'\r').decode('utf-8', errors='replace')
+
+
+def _read_header_or_error(path, max_bytes):
+    try:
+        return read_header(path, max_bytes), None
+    except (OSError, EOFError, ValueError, zlib.error) as e:
+        return None, e
+
+
+def read_headers(paths, workers=HEADER_WORKERS, max_bytes=HEADER_MAX_BYTES, onerror=None):
+    """
+    Read the first line of many files on a thread pool, keeping a bounded number of reads
+    in flight so memory stays flat however many paths there are.
+
+    Args:
+    paths (iterable): The files to read.
+    workers (int): Files read at once.
+    max_bytes (int): Longest line returned, see read_header.
+    onerror (callable): Called with (path, exception) for each file that cannot be read.
+
+    Yields:
+    tuple: (path, first line), in the order of paths; the line is None if the file could
+    not be read.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='header') as pool:
+        in_flight = deque()
+
+        def drain(limit):
+            while len(in_flight) > limit:
+                path, future = in_flight.popleft()
+                header, error = future.result()
+                if error is not None and onerror is not None:
+                    onerror(path, error)
+                yield path, header
+
+        for path in paths:
+            in_flight.append((path, pool.submit(_read_header_or_error, path, max_bytes)))
+            yield from drain(workers * 4)
+        yield from drain(0)
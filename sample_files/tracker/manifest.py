@@ -0,0 +1,182 @@
+import hashlib
+import json
+import sqlite3
+
+
+# Default manifest location, relative to the directory file_report.py is run from
+DEFAULT_MANIFEST = 'file_report_manifest.db'
+
+# Scanned files staged, matched and uploaded per batch
+MANIFEST_BATCH_SIZE = 10000
+
+
+def match_fingerprint(mode, samples):
+    """
+    Return a digest of everything a file's match result depends on besides the file itself,
+    so a run can tell whether files it has already matched need matching again.
+
+    Args:
+    mode (str): The dataset's sample_info_stored, 'filename' or 'header'.
+    samples (list): Sample dicts with sample_id, ext_sample_id and ext_patient_id.
+    """
+    key = [mode, [(sample["sample_id"], sample["ext_sample_id"], sample["ext_patient_id"]) for sample in samples]]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+class Manifest:
+    """
+    Local SQLite record of the files a tracker run saw for each dataset (path, size, mtime,
+    inode, header) and the samples they were registered with, so the next run only has to
+    match the files that are new or changed and send the API the difference.
+
+    Changes are only kept once commit() is called, so a run whose requests to the API fail
+    leaves the manifest as it was and the next run sends the same difference again.
+
+    Args:
+    path (str): The manifest database file; created if it does not exist.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            PRAGMA temp_store = MEMORY;
+            CREATE TABLE IF NOT EXISTS manifest_datasets (
+                dataset_id INTEGER PRIMARY KEY,
+                fingerprint TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS manifest_files (
+                dataset_id INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                inode INTEGER NOT NULL,
+                header TEXT,
+                samples TEXT NOT NULL,
+                PRIMARY KEY (dataset_id, path)
+            ) WITHOUT ROWID;
+            CREATE TEMP TABLE IF NOT EXISTS scan (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                inode INTEGER NOT NULL,
+                batch INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS temp.idx_scan_batch ON scan (batch);
+        ''')
+        self.batches = 0
+
+    def fingerprint(self, dataset_id):
+        """
+        Return the match_fingerprint the dataset's files were last matched with, or None.
+        """
+        row = self.conn.execute("SELECT fingerprint FROM manifest_datasets WHERE dataset_id = ?", (dataset_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_fingerprint(self, dataset_id, fingerprint):
+        self.conn.execute('''
+            INSERT INTO manifest_datasets (dataset_id, fingerprint) VALUES (?, ?)
+            ON CONFLICT (dataset_id) DO UPDATE SET fingerprint = excluded.fingerprint
+        ''', (dataset_id, fingerprint))
+
+    def reset(self, dataset_id):
+        """
+        Forget everything recorded for a dataset, so every file counts as new.
+        """
+        self.conn.execute("DELETE FROM manifest_files WHERE dataset_id = ?", (dataset_id,))
+        self.conn.execute("DELETE FROM manifest_datasets WHERE dataset_id = ?", (dataset_id,))
+
+    def start_scan(self):
+        """
+        Forget the files staged by an earlier scan on this connection.
+        """
+        self.conn.execute("DELETE FROM temp.scan")
+        self.batches = 0
+
+    def stage(self, files):
+        """
+        Stage a batch of the files found by this run's scan, to be compared with the manifest.
+        A scan is staged batch by batch as it goes, so matching can start before it ends.
+
+        Args:
+        files (list): ScannedFile-like objects with path, size, mtime and inode.
+
+        Returns:
+        int: The batch number, to pass to changed() and unchanged().
+        """
+        batch = self.batches
+        self.batches += 1
+        self.conn.executemany("INSERT OR REPLACE INTO temp.scan VALUES (?, ?, ?, ?, ?)",
+                              [(file.path, file.size, file.mtime, file.inode, batch) for file in files])
+        return batch
+
+    def changed(self, dataset_id, batch=None):
+        """
+        Return the scanned files that are not in the manifest or whose size, mtime or inode
+        differ, as (path, size, mtime, inode, previous samples or None) tuples.
+
+        Args:
+        batch (int): Only look at this staged batch; all of them if None.
+        """
+        rows = self.conn.execute('''
+            SELECT s.path, s.size, s.mtime, s.inode, m.samples
+            FROM temp.scan s
+            LEFT JOIN manifest_files m ON m.dataset_id = ? AND m.path = s.path
+            WHERE (m.path IS NULL OR m.size != s.size OR m.mtime != s.mtime OR m.inode != s.inode)
+              AND (? IS NULL OR s.batch = ?)
+            ORDER BY s.path
+        ''', (dataset_id, batch, batch)).fetchall()
+        return [(*row[:4], json.loads(row[4]) if row[4] is not None else None) for row in rows]
+
+    def unchanged(self, dataset_id, batch=None):
+        """
+        Return the scanned files the manifest already has as they are now, as
+        (path, size, mtime, inode, header, samples) tuples.
+
+        Args:
+        batch (int): Only look at this staged batch; all of them if None.
+        """
+        rows = self.conn.execute('''
+            SELECT s.path, s.size, s.mtime, s.inode, m.header, m.samples
+            FROM temp.scan s
+            JOIN manifest_files m ON m.dataset_id = ? AND m.path = s.path
+            WHERE m.size = s.size AND m.mtime = s.mtime AND m.inode = s.inode
+              AND (? IS NULL OR s.batch = ?)
+            ORDER BY s.path
+        ''', (dataset_id, batch, batch)).fetchall()
+        return [(*row[:5], json.loads(row[5])) for row in rows]
+
+    def deleted(self, dataset_id):
+        """
+        Return the files the manifest has that the scan no longer found, as (path, samples) tuples.
+        """
+        rows = self.conn.execute('''
+            SELECT m.path, m.samples
+            FROM manifest_files m
+            WHERE m.dataset_id = ? AND NOT EXISTS (SELECT 1 FROM temp.scan s WHERE s.path = m.path)
+            ORDER BY m.path
+        ''', (dataset_id,)).fetchall()
+        return [(path, json.loads(samples)) for path, samples in rows]
+
+    def record(self, dataset_id, files):
+        """
+        Store files as matched by this run.
+
+        Args:
+        files (iterable): (path, size, mtime, inode, header, sample ids) tuples.
+        """
+        self.conn.executemany('''
+            INSERT OR REPLACE INTO manifest_files (dataset_id, path, size, mtime, inode, header, samples)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(dataset_id, path, size, mtime, inode, header, json.dumps(samples))
+              for path, size, mtime, inode, header, samples in files])
+
+    def forget(self, dataset_id, paths):
+        self.conn.executemany("DELETE FROM manifest_files WHERE dataset_id = ? AND path = ?",
+                              [(dataset_id, path) for path in paths])
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,143 @@
+import re
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+class SubstringIndex:
+    """
+    Find which of a fixed set of strings occur anywhere in a text.
+
+    Uses an Aho-Corasick automaton (pip install pyahocorasick) when available, so a text is
+    scanned once however many strings there are. Otherwise each substring of the text with
+    the length of some key is looked up in a set, which is linear in the text for a handful
+    of distinct key lengths.
+    """
+
+    def __init__(self, keys):
+        keys = set(keys)
+        # The empty string occurs in every text
+        self.always = {''} & keys
+        keys.discard('')
+        self.keys = keys
+        self.automaton = None
+        if ahocorasick is not None and keys:
+            self.automaton = ahocorasick.Automaton()
+            for key in keys:
+                self.automaton.add_word(key, key)
+            self.automaton.make_automaton()
+        self.lengths = sorted({len(key) for key in keys})
+
+    def find(self, text):
+        """
+        Return the set of keys occurring in text.
+        """
+        found = set(self.always)
+        if self.automaton is not None:
+            found.update(key for _, key in self.automaton.iter(text))
+        else:
+            for length in self.lengths:
+                found.update(self.keys.intersection(text[i:i + length] for i in range(len(text) - length + 1)))
+        return found
+
+
+def patient_pattern(ext_patient_id):
+    """
+    Compile the pattern matching ext_patient_id in a filename, with spaces as wildcards.
+    """
+    return re.compile(re.escape(ext_patient_id).replace(r'\ ', '.*'))
+
+
+class SampleMatcher:
+    """
+    Match filenames and file headers against every sample of a project, built once per run.
+
+    Filenames match a sample when they contain its ext_sample_id, or else its patient's
+    ext_patient_id with spaces as wildcards; headers match a sample when one of their
+    whitespace-separated words is its ext_sample_id.
+
+    Args:
+    samples (list): Dicts with at least ext_sample_id and ext_patient_id, e.g. from
+    file_report.get_sample_data. Matches are returned as these dicts, in this order.
+    """
+
+    def __init__(self, samples):
+        self.samples = samples
+
+        self.by_ext_sample_id = {}
+        self.by_ext_patient_id = {}
+        for index, sample in enumerate(samples):
+            self.by_ext_sample_id.setdefault(sample["ext_sample_id"], []).append(index)
+            self.by_ext_patient_id.setdefault(sample["ext_patient_id"], []).append(index)
+        self.sample_index = SubstringIndex(self.by_ext_sample_id)
+
+        # A patient pattern can only match a filename containing its longest literal part,
+        # so the index narrows the patients down and only those with wildcards run a regex
+        self.patient_keys = {}
+        self.patient_patterns = {}
+        for ext_patient_id in self.by_ext_patient_id:
+            key = max(ext_patient_id.split(' '), key=len)
+            self.patient_keys.setdefault(key, []).append(ext_patient_id)
+            if ' ' in ext_patient_id:
+                self.patient_patterns[ext_patient_id] = patient_pattern(ext_patient_id)
+        self.patient_index = SubstringIndex(self.patient_keys)
+
+    def _patients_in(self, filename):
+        for key in self.patient_index.find(filename):
+            for ext_patient_id in self.patient_keys[key]:
+                pattern = self.patient_patterns.get(ext_patient_id)
+                if pattern is None or pattern.search(filename):
+                    yield ext_patient_id
+
+    def match_filename(self, filename):
+        """
+        Return the samples a filename belongs to, with the semantics of the former per-sample
+        loop: going through the samples in order, every sample whose ext_sample_id is in the
+        filename, up to and including the first other sample whose patient matches.
+
+        Returns:
+        list: The matching sample dicts, in sample order.
+        """
+        by_sample = set()
+        for ext_sample_id in self.sample_index.find(filename):
+            by_sample.update(self.by_ext_sample_id[ext_sample_id])
+
+        first_by_patient = None
+        for ext_patient_id in self._patients_in(filename):
+            for index in self.by_ext_patient_id[ext_patient_id]:
+                if index not in by_sample:
+                    if first_by_patient is None or index < first_by_patient:
+                        first_by_patient = index
+                    break
+
+        if first_by_patient is None:
+            indices = sorted(by_sample)
+        else:
+            indices = sorted(index for index in by_sample if index < first_by_patient) + [first_by_patient]
+        return [self.samples[index] for index in indices]
+
+    def match_header(self, components):
+        """
+        Return the samples whose ext_sample_id is one of a header's words, in sample order.
+        """
+        indices = set()
+        for component in set(components):
+            indices.update(self.by_ext_sample_id.get(component, ()))
+        return [self.samples[index] for index in sorted(indices)]
+
+    def match(self, mode, path, header=None):
+        """
+        Return the samples a file belongs to under a dataset's sample_info_stored mode:
+        'filename' matches its path, 'header' the words of its first line; anything else
+        matches nothing.
+
+        Returns:
+        list: The matching sample dicts, in sample order.
+        """
+        if mode == "header":
+            return self.match_header(re.split(r'\s+', header.strip())) if header is not None else []
+        if mode == "filename":
+            return self.match_filename(path)
+        return []
@@ -0,0 +1,106 @@
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+
+# Directories listed at once. Network filesystems (Lustre, NFS) answer each readdir/stat
+# with a round trip, so more requests in flight than cores still pays off.
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Suffixes that wrap another format, so 'a.fastq.gz' has the extension '.fastq.gz'
+COMPRESSION_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+
+
+class ScannedFile(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    extension: str
+    inode: int
+
+
+def file_extension(name):
+    """
+    Return the extension of a file name, including the inner one of compressed files.
+    """
+    stem, extension = os.path.splitext(name)
+    if extension.lower() in COMPRESSION_SUFFIXES:
+        extension = os.path.splitext(stem)[1] + extension
+    return extension
+
+
+def _scan_directory(path, extensions, onerror):
+    # List one directory: its matching files with their stat results, and its subdirectories.
+    # Only matching files are stat'ed; directories are recognised from the readdir entry type.
+    files, subdirectories = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif (extensions is None or entry.name.endswith(extensions)) and entry.is_file():
+                        stat = entry.stat()
+                        files.append(ScannedFile(entry.path, stat.st_size, stat.st_mtime, file_extension(entry.name), stat.st_ino))
+                except OSError as e:
+                    if onerror is not None:
+                        onerror(e)
+    except OSError as e:
+        if onerror is not None:
+            onerror(e)
+    return files, subdirectories
+
+
+def scan_tree(directory, extensions=None, workers=SCAN_WORKERS, onerror=None):
+    """
+    Walk a directory tree once, yielding the path, size, mtime, extension and inode of every file
+    whose name ends with one of extensions.
+
+    Subdirectories are listed concurrently on a thread pool, so files are yielded in no
+    particular order. Symlinked directories are not followed, as with os.walk.
+
+    Args:
+    directory (str): The root directory to scan.
+    extensions (str or iterable): Name suffixes to keep, e.g. '.fastq'; None keeps every file.
+    workers (int): Directories listed at once; 1 scans on the calling thread.
+    onerror (callable): Called with the OSError of an unreadable directory or file, which is
+    then skipped; by default errors are ignored, as with os.walk.
+
+    Yields:
+    ScannedFile: One per matching file.
+    """
+    if isinstance(extensions, str):
+        extensions = (extensions,)
+    elif extensions is not None:
+        extensions = tuple(extensions)
+
+    if workers <= 1:
+        pending = [directory]
+        while pending:
+            files, subdirectories = _scan_directory(pending.pop(), extensions, onerror)
+            pending.extend(subdirectories)
+            yield from files
+        return
+
+    # Finished listings come back through a queue rather than concurrent.futures.wait(),
+    # which rescans every outstanding future on each call
+    done = queue.Queue()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan') as pool:
+        def submit(path):
+            pool.submit(_scan_directory, path, extensions, onerror).add_done_callback(done.put)
+
+        outstanding = 1
+        submit(directory)
+        try:
+            while outstanding:
+                files, subdirectories = done.get().result()
+                outstanding -= 1
+                for subdirectory in subdirectories:
+                    submit(subdirectory)
+                outstanding += len(subdirectories)
+                yield from files
+        finally:
+            # Stop listing the rest of the tree if the caller stops early
+            pool.shutdown(wait=True, cancel_futures=True)
+
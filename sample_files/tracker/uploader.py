@@ -0,0 +1,196 @@
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Items sent per request
+UPLOAD_CHUNK_SIZE = 1000
+
+# Requests in flight at once
+UPLOAD_CONCURRENCY = 4
+
+# Attempts per chunk, and the delay before the first retry in seconds; each retry waits
+# twice as long as the one before, plus jitter, unless the API says how long to wait
+UPLOAD_ATTEMPTS = 6
+UPLOAD_BACKOFF = 1.0
+
+# (connect, read) timeouts in seconds
+UPLOAD_TIMEOUT = (10, 300)
+
+# Responses worth retrying: rate limited, or the API (or a proxy in front of it) was briefly
+# unavailable, e.g. its connection pool was exhausted
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChunkUploader:
+    """
+    POST items to an API endpoint as JSON lists of at most chunk_size items, with up to
+    concurrency requests in flight over keep-alive connections.
+
+    add() returns as soon as the item is buffered, so callers keep working while chunks are
+    sent; it only blocks while 2 * concurrency chunks are already queued or in flight, which
+    keeps memory bounded. Each chunk carries an Idempotency-Key made of a per-uploader run id
+    and the chunk's number, and a failed chunk is retried on its own with the same key, so the
+    API applies it once however many attempts reach it.
+
+    Args:
+    url (str): The endpoint, e.g. http://localhost:8888/add_raw_files/.
+    chunk_size (int): Items per request.
+    concurrency (int): Requests in flight at once.
+    attempts (int): Attempts per chunk before giving up.
+    backoff (float): Seconds before the first retry.
+
+    Raises:
+    ValueError: If chunk_size, concurrency or attempts is less than 1.
+    """
+
+    def __init__(self, url, chunk_size=UPLOAD_CHUNK_SIZE, concurrency=UPLOAD_CONCURRENCY,
+                 attempts=UPLOAD_ATTEMPTS, backoff=UPLOAD_BACKOFF):
+        # With no request slots, add() would wait forever for one
+        for name, value in (('chunk_size', chunk_size), ('concurrency', concurrency), ('attempts', attempts)):
+            if value < 1:
+                raise ValueError(f"{name} must be at least 1, not {value}")
+        self.url = url
+        self.chunk_size = chunk_size
+        self.attempts = attempts
+        self.backoff = backoff
+        self.run_id = uuid.uuid4().hex
+        self.totals = {}
+        self.submitted = 0
+        self.chunks = 0
+        self.items = 0
+        self.retries = 0
+        self.buffer = []
+        self.error = None
+        self._lock = threading.Lock()
+        self._sessions = threading.local()
+        self._slots = threading.BoundedSemaphore(concurrency * 2)
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='upload')
+        self._concurrency = concurrency
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def _session(self):
+        # One keep-alive session per worker thread, as sessions are not thread-safe
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.headers.update({'accept': 'application/json'})
+            self._sessions.session = session
+        return session
+
+    def _delay(self, attempt, response):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff * 2 ** attempt * (1 + random.random() / 2)
+
+    def _send(self, number, chunk):
+        key = f'{self.run_id}-{number}'
+        try:
+            for attempt in range(self.attempts):
+                response = None
+                try:
+                    response = self._session().post(self.url, json=chunk, timeout=UPLOAD_TIMEOUT,
+                                                    headers={'Idempotency-Key': key})
+                    if response.status_code not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        self._record(response.json(), len(chunk))
+                        return
+                except (requests.ConnectionError, requests.Timeout):
+                    pass
+                if attempt + 1 < self.attempts:
+                    with self._lock:
+                        self.retries += 1
+                    time.sleep(self._delay(attempt, response))
+            raise UploadError(f"Chunk {key} of {len(chunk)} items to {self.url} failed after {self.attempts} attempts"
+                              + (f": {response.status_code} {response.text[:200]}" if response is not None else ""))
+        except Exception as e:
+            with self._lock:
+                if self.error is None:
+                    self.error = e
+        finally:
+            self._slots.release()
+
+    def _record(self, result, items):
+        with self._lock:
+            self.chunks += 1
+            self.items += items
+            for key, value in result.items():
+                if isinstance(value, int):
+                    self.totals[key] = self.totals.get(key, 0) + value
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def _submit(self):
+        chunk, self.buffer = self.buffer, []
+        self._slots.acquire()
+        if self.error is not None:
+            self._slots.release()
+            raise self.error
+        self._pool.submit(self._send, self.submitted, chunk)
+        self.submitted += 1
+
+    def add(self, item):
+        """
+        Queue one item; sends a chunk once chunk_size items are queued.
+
+        Raises:
+        UploadError: If an earlier chunk failed for good, so the caller can stop early.
+        """
+        self._raise_error()
+        self.buffer.append(item)
+        if len(self.buffer) >= self.chunk_size:
+            self._submit()
+
+    def flush(self):
+        """
+        Send any queued items and wait until every chunk so far has been sent.
+
+        Raises:
+        UploadError: If any chunk failed for good.
+        """
+        if self.buffer:
+            self._submit()
+        # Every slot free means nothing is queued or in flight
+        for _ in range(self._concurrency * 2):
+            self._slots.acquire()
+        for _ in range(self._concurrency * 2):
+            self._slots.release()
+        self._raise_error()
+
+    def close(self):
+        """
+        Send any queued items, wait for every chunk and stop the workers.
+
+        Returns:
+        dict: Sums of the integer fields of every chunk's response, e.g. inserted and skipped.
+        """
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown(wait=True)
+        return self.totals
@@ -0,0 +1,309 @@
+import os
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from database import configure_connection
+from ingest import ingest_raw_files, remove_raw_files
+
+# The scan reuses the file tracker's scanner, header reader and matching rules
+TRACKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_files', 'tracker')
+if TRACKER_DIR not in sys.path:
+    sys.path.insert(0, TRACKER_DIR)
+
+from header_reader import read_headers
+from matcher import SampleMatcher
+from scanner import scan_tree
+
+
+# Files matched and written per batch; progress and cancellation are checked between batches
+SCAN_JOB_BATCH_SIZE = 2000
+
+# Unreadable paths named in a finished job's error field
+SKIPPED_PATHS_REPORTED = 10
+
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+# Shaped like the API's RawFileCreate/RawFileRemove for ingest_raw_files and remove_raw_files
+ScanRawFile = namedtuple('ScanRawFile', ['dataset_id', 'path', 'metadata'])
+ScanRawFileMetadata = namedtuple('ScanRawFileMetadata', ['metadata_key', 'metadata_value'])
+
+
+class ScanCancelled(Exception):
+    pass
+
+
+def directory_bounds(directory):
+    """
+    Return the [low, high) path range covering every file under directory, so the
+    UNIQUE(dataset_id, path) index finds them without a LIKE.
+    """
+    prefix = directory.rstrip('/') + '/'
+    return prefix, prefix[:-1] + chr(ord('/') + 1)
+
+
+def _dataset_settings(conn, dataset_id):
+    rows = conn.execute('''
+        SELECT key, value FROM datasets_metadata
+        WHERE dataset_id = ? AND key IN ('sample_info_stored', 'raw_file_extensions')
+    ''', (dataset_id,)).fetchall()
+    settings = dict(rows)
+    return settings.get('sample_info_stored'), settings.get('raw_file_extensions', '').lstrip('*')
+
+
+def _project_samples(conn, dataset_id):
+    # The same fields, in the same order, as the tracker gets from /samples/0
+    rows = conn.execute('''
+        SELECT s.id, s.patient_id, s.ext_sample_id, p.ext_patient_id
+        FROM datasets d
+        JOIN patients p ON p.project_id = d.project_id
+        JOIN samples s ON s.patient_id = p.id
+        WHERE d.id = ?
+        ORDER BY s.id
+    ''', (dataset_id,)).fetchall()
+    return [{"sample_id": row[0], "patient_id": row[1], "ext_sample_id": row[2], "ext_patient_id": row[3]}
+            for row in rows]
+
+
+def _registered_samples(conn, dataset_id, paths):
+    """
+    Return {path: set of sample ids} for the paths already registered in the dataset.
+    """
+    conn.execute("DELETE FROM temp.scan_job_paths")
+    conn.executemany("INSERT OR IGNORE INTO temp.scan_job_paths (path) VALUES (?)", [(path,) for path in paths])
+    registered = {}
+    for path, sample_id in conn.execute('''
+        SELECT rf.path, rfs.sample_id
+        FROM temp.scan_job_paths t
+        JOIN raw_files rf ON rf.dataset_id = ? AND rf.path = t.path
+        LEFT JOIN raw_file_samples rfs ON rfs.raw_file_id = rf.id
+    ''', (dataset_id,)):
+        samples = registered.setdefault(path, set())
+        if sample_id is not None:
+            samples.add(sample_id)
+    return registered
+
+
+def _update_job(conn, job_id, **fields):
+    assignments = ', '.join(f"{name} = ?" for name in fields)
+    conn.execute(f"UPDATE scan_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+    conn.commit()
+
+
+def _add_progress(conn, job_id, counts):
+    conn.execute('''
+        UPDATE scan_jobs SET files_seen = files_seen + ?, files_matched = files_matched + ?,
+            bytes_seen = bytes_seen + ?, files_registered = files_registered + ?,
+            files_removed = files_removed + ?
+        WHERE id = ?
+    ''', (counts["seen"], counts["matched"], counts["bytes"], counts["registered"], counts["removed"], job_id))
+    cancel_requested = conn.execute("SELECT cancel_requested FROM scan_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    conn.commit()
+    if cancel_requested:
+        raise ScanCancelled()
+
+
+def _scan_batch(conn, job_id, dataset_id, mode, matcher, files):
+    registered = _registered_samples(conn, dataset_id, [file.path for file in files])
+    conn.executemany("INSERT OR IGNORE INTO temp.scan_job_seen (path) VALUES (?)", [(file.path,) for file in files])
+    # Close the implicit transaction, as the writes below begin their own
+    conn.commit()
+
+    headers = {}
+    if mode == "header":
+        headers = dict(read_headers([file.path for file in files]))
+
+    to_add = []
+    to_remove = []
+    matched = 0
+    unregistered = 0
+    for file in files:
+        header = headers.get(file.path)
+        if mode == "header" and header is None:
+            continue  # Unreadable, so left as it is registered
+        samples = [sample["sample_id"] for sample in matcher.match(mode, file.path, header)]
+        if samples:
+            matched += 1
+        previous = registered.get(file.path, set())
+        if set(samples) == previous:
+            continue
+        # Registered with other samples before: drop the old registration first
+        if previous:
+            to_remove.append(ScanRawFile(dataset_id, file.path, None))
+            if not samples:
+                unregistered += 1
+        if samples:
+            to_add.append(ScanRawFile(dataset_id, file.path, [ScanRawFileMetadata("sample_id", str(sample_id))
+                                                               for sample_id in samples]))
+
+    if to_remove:
+        remove_raw_files(conn, to_remove)
+    counts = ingest_raw_files(conn, to_add) if to_add else {"inserted": 0, "updated": 0}
+    _add_progress(conn, job_id, {"seen": len(files), "matched": matched, "bytes": sum(file.size for file in files),
+                                 "registered": counts["inserted"] + counts["updated"], "removed": unregistered})
+
+
+def _remove_missing(conn, job_id, dataset_id, directory, skipped):
+    # Files registered under the directory that the scan did not find any more. Files at or
+    # under a path the scan could not read may still be there, so they are kept.
+    conn.execute("DELETE FROM temp.scan_job_skipped")
+    conn.executemany("INSERT OR IGNORE INTO temp.scan_job_skipped (path, low, high) VALUES (?, ?, ?)",
+                     [(path, *directory_bounds(path)) for path in skipped])
+    # Close the implicit transaction, as remove_raw_files begins its own
+    conn.commit()
+    low, high = directory_bounds(directory)
+    missing = [ScanRawFile(dataset_id, path, None) for (path,) in conn.execute('''
+        SELECT rf.path FROM raw_files rf
+        WHERE rf.dataset_id = ? AND rf.path >= ? AND rf.path < ?
+          AND NOT EXISTS (SELECT 1 FROM temp.scan_job_seen s WHERE s.path = rf.path)
+          AND NOT EXISTS (SELECT 1 FROM temp.scan_job_skipped k
+                          WHERE rf.path = k.path OR (rf.path >= k.low AND rf.path < k.high))
+    ''', (dataset_id, low, high)).fetchall()]
+    removed = remove_raw_files(conn, missing)["removed"] if missing else 0
+    _add_progress(conn, job_id, {"seen": 0, "matched": 0, "bytes": 0, "registered": 0, "removed": removed})
+
+
+def run_scan_job(database, job_id, batch_size=SCAN_JOB_BATCH_SIZE):
+    """
+    Run one scan job in a worker process: scan its directory, match the files against the
+    samples of the dataset's project with the file tracker's rules and write the difference
+    straight into raw_files, batch by batch, updating the job's progress as it goes.
+
+    Files whose samples changed are registered again, and files registered under the
+    directory that are gone or no longer match any sample are removed. Subdirectories and
+    files that cannot be read are skipped, leaving their registrations as they are, and
+    listed in the job's error field; the job fails only if the directory itself cannot be
+    read. A cancelled job stops after the batch in progress, keeping what it has written so far.
+
+    Args:
+    database (str): Path to the SQLite database.
+    job_id (int): The queued scan_jobs row to run.
+    batch_size (int): Files matched and written per batch.
+    """
+    conn = configure_connection(sqlite3.connect(database))
+    try:
+        row = conn.execute("SELECT dataset_id, directory, cancel_requested FROM scan_jobs WHERE id = ?", (job_id,)).fetchone()
+        dataset_id, directory, cancel_requested = row
+        if cancel_requested:
+            _update_job(conn, job_id, status='cancelled', finished_at=time.time())
+            return
+        _update_job(conn, job_id, status='running', started_at=time.time())
+
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS scan_job_paths (path TEXT PRIMARY KEY) WITHOUT ROWID")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS scan_job_seen (path TEXT PRIMARY KEY) WITHOUT ROWID")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS scan_job_skipped (path TEXT PRIMARY KEY, low TEXT, high TEXT) WITHOUT ROWID")
+
+        mode, extension = _dataset_settings(conn, dataset_id)
+        matcher = SampleMatcher(_project_samples(conn, dataset_id))
+
+        # Files and directories deleted while the scan runs are simply gone. Other unreadable
+        # paths (e.g. a subdirectory without permission) are skipped and kept registered.
+        # Called on the scanner's threads, so the paths are only collected here.
+        skipped = []
+
+        def skip_error(error):
+            if isinstance(error, FileNotFoundError):
+                return
+            if error.filename is None or os.fspath(error.filename) == directory:
+                raise error
+            skipped.append(os.fspath(error.filename))
+
+        batch = []
+        for file in scan_tree(directory, extension, onerror=skip_error):
+            batch.append(file)
+            if len(batch) >= batch_size:
+                _scan_batch(conn, job_id, dataset_id, mode, matcher, batch)
+                batch = []
+        if batch:
+            _scan_batch(conn, job_id, dataset_id, mode, matcher, batch)
+        _remove_missing(conn, job_id, dataset_id, directory, skipped)
+
+        error = None
+        if skipped:
+            skipped.sort()
+            error = f"Skipped {len(skipped)} unreadable paths: {', '.join(skipped[:SKIPPED_PATHS_REPORTED])}"
+            if len(skipped) > SKIPPED_PATHS_REPORTED:
+                error += ', ...'
+        _update_job(conn, job_id, status='succeeded', error=error, finished_at=time.time())
+    except ScanCancelled:
+        _update_job(conn, job_id, status='cancelled', finished_at=time.time())
+    except Exception as e:
+        conn.rollback()
+        _update_job(conn, job_id, status='failed', error=f"{type(e).__name__}: {e}", finished_at=time.time())
+    finally:
+        conn.close()
+
+
+class ScanJobRunner:
+    """
+    Run scan jobs on a pool of worker processes, so scans of different datasets proceed in
+    parallel without holding the API's event loop or its GIL.
+
+    Jobs live in the scan_jobs table: the API queues them and reads their progress and
+    status from there, and asks a job to stop by setting cancel_requested.
+
+    Args:
+    database (str): Path to the SQLite database.
+    workers (int): Jobs run at once; further jobs wait in the queue.
+    """
+
+    def __init__(self, database, workers=2):
+        self.database = database
+        # spawn, not fork: the API process has threads (connection pool, event loop)
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+
+    def submit(self, job_id):
+        future = self._pool.submit(run_scan_job, self.database, job_id)
+        future.add_done_callback(lambda future: self._check_crash(job_id, future))
+
+    def _check_crash(self, job_id, future):
+        # run_scan_job records its own failures; this catches a worker that died outright
+        if future.cancelled() or future.exception() is None:
+            return
+        conn = sqlite3.connect(self.database)
+        try:
+            conn.execute('''
+                UPDATE scan_jobs SET status = 'failed', error = ?, finished_at = ?
+                WHERE id = ? AND status IN ('queued', 'running')
+            ''', (f"Scan worker failed: {future.exception()!r}", time.time(), job_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def close(self):
+        """
+        Ask this server's unfinished jobs to stop, then wait for the workers to exit.
+        """
+        conn = sqlite3.connect(self.database)
+        try:
+            conn.execute('''
+                UPDATE scan_jobs SET cancel_requested = 1
+                WHERE server_pid = ? AND status IN ('queued', 'running')
+            ''', (os.getpid(),))
+            conn.commit()
+        finally:
+            conn.close()
+        self._pool.shutdown(wait=True)
+
+
+def fail_orphaned_jobs(conn):
+    """
+    Mark unfinished jobs whose API process is gone, e.g. after a crash, as failed, so they
+    do not block new scans of their datasets.
+    """
+    orphaned = []
+    for job_id, server_pid in conn.execute("SELECT id, server_pid FROM scan_jobs WHERE status IN ('queued', 'running')").fetchall():
+        try:
+            os.kill(server_pid, 0)
+        except ProcessLookupError:
+            orphaned.append((time.time(), job_id))
+        except PermissionError:
+            pass  # Alive, but another user's process
+    conn.executemany('''
+        UPDATE scan_jobs SET status = 'failed', error = 'Interrupted by a server restart', finished_at = ?
+        WHERE id = ?
+    ''', orphaned)
+    conn.commit()
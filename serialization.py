@@ -0,0 +1,49 @@
+import os
+
+from pydantic import TypeAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    from pydantic_core import to_json
+
+
+# Set REDMANE_VALIDATE_RESPONSES=1 in development to validate every response against its
+# response model again, e.g. to catch a query that no longer matches the models
+VALIDATE_RESPONSES = os.environ.get('REDMANE_VALIDATE_RESPONSES', '') not in ('', '0')
+
+
+def dump_json(result):
+    """
+    Encode plain dicts/lists/scalars as compact JSON bytes without any per-row validation.
+
+    Uses orjson when it is installed and pydantic-core's encoder otherwise.
+    """
+    if orjson is not None:
+        return orjson.dumps(result)
+    return to_json(result)
+
+
+def validating_serializer(model):
+    """
+    Return a serializer that validates a result against model before encoding it.
+
+    This is what FastAPI does for response_model, and costs far more than the query
+    for large lists; it is kept for VALIDATE_RESPONSES and for benchmarking.
+    """
+    adapter = TypeAdapter(model)
+    return lambda result: adapter.dump_json(adapter.validate_python(result))
+
+
+def serializer_for(model):
+    """
+    Return the serializer used for responses of model.
+
+    The fetch functions already build dicts with exactly the model's fields, so by default
+    rows are written straight to JSON. The route keeps response_model, so the OpenAPI
+    schema still documents the model.
+    """
+    if VALIDATE_RESPONSES:
+        return validating_serializer(model)
+    return dump_json
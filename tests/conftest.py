@@ -0,0 +1,85 @@
+import os
+import random
+import sqlite3
+import sys
+
+import pytest
+
+# Make the repo's modules, the file tracker's and the benchmark data generator importable,
+# in that order, as benchmarks/ has modules of its own named like theirs
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+for path in (os.path.join(REPO_ROOT, 'sample_files', 'tracker'), os.path.join(REPO_ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.append(path)
+
+from database import configure_connection
+from migrations import migrate
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """
+    A migrated, empty database.
+    """
+    conn = configure_connection(sqlite3.connect(tmp_path / 'test.db'))
+    migrate(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """
+    A TestClient for the app, on a fresh database in a temporary working directory.
+    """
+    from fastapi.testclient import TestClient
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data', exist_ok=True)
+    import main
+    monkeypatch.setattr(main, 'DATABASE', str(tmp_path / 'data' / 'data_redmane.db'))
+    main.init_db()
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def catalogue(client):
+    """
+    The client's database filled with a small synthetic catalogue: two projects of 30 patients,
+    their samples, metadata, datasets and raw files.
+    """
+    from synthetic import generate_catalogue
+
+    conn = sqlite3.connect('data/data_redmane.db')
+    result = generate_catalogue(conn, projects=2, patients=30, samples_per_patient=3, datasets=2, seed=0)
+    conn.close()
+    return result
+
+
+def ids(conn, table):
+    return [row[0] for row in conn.execute(f"SELECT id FROM {table}")]
+
+
+def check_random_writes(conn, seed, random_write, maintained, recount, steps=400, check_every=50, ignore=()):
+    """
+    Apply random writes to a database and check, every check_every writes, that the rows its
+    triggers maintain still equal a recount from the base tables.
+
+    Args:
+    random_write (callable): Called as random_write(conn, rng) to make one write.
+    maintained (callable): Returns the trigger-maintained rows, sorted.
+    recount (callable): Returns the same rows computed from the base tables, sorted.
+    ignore (tuple): Exceptions of writes the schema refuses, which wrote nothing.
+    """
+    rng = random.Random(seed)
+    for step in range(steps):
+        try:
+            random_write(conn, rng)
+        except ignore:
+            pass
+        if step % check_every == check_every - 1:
+            conn.commit()
+            assert maintained(conn) == recount(conn), f"drift after {step + 1} writes"
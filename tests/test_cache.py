@@ -0,0 +1,87 @@
+import sqlite3
+
+from cache import ResponseCache
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = ResponseCache(max_entries=3, max_bytes=100)
+    for key in 'abc':
+        cache.put(key, b'x' * 10, (), ())
+    cache.get('a')  # Now the most recently used
+    cache.put('d', b'x' * 10, (), ())
+    assert [key for key in 'abcd' if cache.get(key)] == ['a', 'c', 'd']
+
+    # Over both bounds: 'a' is now the least recently used
+    cache.put('e', b'x' * 75, (), ())
+    assert [key for key in 'acde' if cache.get(key)] == ['c', 'd', 'e'] and cache.stats()["bytes"] == 95
+    # Too large to keep, but still returned to be served
+    assert cache.put('f', b'x' * 101, (), ()).body == b'x' * 101 and cache.get('f') is None
+    cache.put('d', b'y' * 5, (), ())
+    assert cache.get('d').body == b'y' * 5 and cache.stats()["bytes"] == 90
+    cache.put('g', b'x' * 20, (), ())
+    assert [key for key in 'cdeg' if cache.get(key)] == ['d', 'e', 'g'] and cache.stats()["bytes"] == 100
+    assert cache.stats()["evictions"] == 3
+
+
+def test_invalidate_by_scope():
+    cache = ResponseCache()
+    cache.put('a', b'1', (1,), (('dataset', 1),))
+    cache.put('b', b'2', (1, 1), (('project', 1), ('dataset', 2)))
+    cache.put('c', b'3', (1,), (('dataset', 2),))
+    cache.invalidate(('dataset', 2))
+    assert [key for key in 'abc' if cache.get(key)] == ['a']
+
+
+def stats(client):
+    return client.get('/cache_stats/').json()
+
+
+def test_writes_through_endpoints_are_seen(client, catalogue):
+    dataset_id = catalogue["dataset_ids"][0]
+    url = f'/raw_files_with_metadata/{dataset_id}'
+    before = client.get(url).json()
+    assert client.get(url).json() == before and stats(client)["hits"] == 1
+
+    response = client.post('/add_raw_files/', json=[{"dataset_id": dataset_id, "path": '/data/new.fastq'}])
+    assert response.status_code == 200
+    after = client.get(url).json()
+    assert [row["path"] for row in after] == [row["path"] for row in before] + ['/data/new.fastq']
+
+
+def test_writes_from_other_connections_are_seen(client, catalogue):
+    project_id, other_project_id = catalogue["project_ids"]
+    url = f'/patients_metadata/0?project_id={project_id}'
+    before = client.get(url).json()
+    other = client.get(f'/patients_metadata/0?project_id={other_project_id}').json()
+
+    # As another API worker or a script would write, bypassing this worker's invalidation
+    conn = sqlite3.connect('data/data_redmane.db')
+    conn.execute("INSERT INTO patients_metadata (patient_id, key, value) VALUES (?, 'note', 'new')", (before[0]["id"],))
+    conn.commit()
+    conn.close()
+
+    after = client.get(url).json()
+    assert after != before and {"note": 'new'}.items() <= {m["key"]: m["value"] for m in after[0]["metadata"]}.items()
+    assert stats(client)["stale"] == 1
+    # The other project's response is still served from the cache
+    hits = stats(client)["hits"]
+    assert client.get(f'/patients_metadata/0?project_id={other_project_id}').json() == other
+    assert stats(client)["hits"] == hits + 1
+
+
+def test_if_none_match(client, catalogue):
+    url = f'/samples/0?project_id={catalogue["project_ids"][0]}'
+    response = client.get(url)
+    etag = response.headers['etag']
+    for if_none_match in (etag, 'W/' + etag, f'"other", {etag}', '*'):
+        response = client.get(url, headers={'If-None-Match': if_none_match})
+        assert response.status_code == 304 and response.content == b'' and response.headers['etag'] == etag
+    assert client.get(url, headers={'If-None-Match': '"other"'}).status_code == 200
+
+    conn = sqlite3.connect('data/data_redmane.db')
+    conn.execute("UPDATE samples SET ext_sample_url = 'changed' WHERE id = (SELECT MIN(id) FROM samples)")
+    conn.commit()
+    conn.close()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['etag'] != etag
+    assert 'changed' in response.text
@@ -0,0 +1,79 @@
+import hashlib
+import os
+
+from checksums import checksum_raw_files, fetch_duplicate_checksums, hash_file
+
+
+def stored_checksums(conn):
+    return dict(conn.execute('''
+        SELECT rf.path, m.metadata_value FROM raw_files rf
+        JOIN raw_files_metadata m ON m.raw_file_id = rf.id AND m.metadata_key = 'checksum'
+    ''').fetchall())
+
+
+def blake2b(data):
+    return 'blake2b:' + hashlib.blake2b(data).hexdigest()
+
+
+def test_hash_file(tmp_path):
+    data = os.urandom(100000)
+    (tmp_path / 'a').write_bytes(data)
+    # Chunks smaller than the file, and one that does not divide it
+    assert hash_file(tmp_path / 'a', chunk_size=4096) == blake2b(data)
+    assert hash_file(tmp_path / 'a', chunk_size=3333) == blake2b(data)
+    (tmp_path / 'empty').write_bytes(b'')
+    assert hash_file(tmp_path / 'empty') == blake2b(b'')
+
+
+def test_checksum_raw_files(conn, tmp_path):
+    files = {'a.fastq': b'AAAA', 'b.fastq': b'BBBB', 'c.fastq': b'AAAA'}
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+    conn.execute("INSERT INTO projects (name, status) VALUES ('Project', 'active')")
+    conn.executemany("INSERT INTO datasets (project_id, name) VALUES (1, ?)", [('One',), ('Two',)])
+    conn.executemany("INSERT INTO raw_files (dataset_id, path) VALUES (?, ?)",
+                     [(1, 'a.fastq'), (1, 'b.fastq'), (2, 'c.fastq'), (2, 'missing.fastq')])
+    conn.commit()
+
+    errors = []
+    counts = checksum_raw_files(conn, workers=1, root=str(tmp_path), onerror=lambda path, error: errors.append(path))
+    assert (counts["hashed"], counts["unchanged"], counts["failed"], counts["bytes"]) == (3, 0, 1, 12)
+    assert errors == ['missing.fastq']
+    assert stored_checksums(conn) == {name: blake2b(data) for name, data in files.items()}
+
+    # Files whose size and mtime match their checksum are not read again: new content
+    # behind an unchanged size and mtime keeps the old checksum
+    stat = os.stat(tmp_path / 'b.fastq')
+    (tmp_path / 'b.fastq').write_bytes(b'CCCC')
+    os.utime(tmp_path / 'b.fastq', ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    counts = checksum_raw_files(conn, workers=1, root=str(tmp_path))
+    assert (counts["hashed"], counts["unchanged"], counts["bytes"]) == (0, 3, 0)
+    assert stored_checksums(conn)['b.fastq'] == blake2b(b'BBBB')
+
+    # A changed mtime has the file hashed again
+    os.utime(tmp_path / 'b.fastq', ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    counts = checksum_raw_files(conn, workers=1, root=str(tmp_path))
+    assert (counts["hashed"], counts["unchanged"]) == (1, 2)
+    assert stored_checksums(conn)['b.fastq'] == blake2b(b'CCCC')
+
+    # Only one dataset's files
+    counts = checksum_raw_files(conn, dataset_id=2, workers=1, root=str(tmp_path))
+    assert (counts["hashed"], counts["unchanged"], counts["failed"]) == (0, 1, 1)
+
+
+def test_fetch_duplicate_checksums(conn, tmp_path):
+    for name, data in {'a': b'same', 'b': b'other', 'c': b'same', 'd': b'alone'}.items():
+        (tmp_path / name).write_bytes(data)
+    conn.execute("INSERT INTO projects (name, status) VALUES ('Project', 'active')")
+    conn.executemany("INSERT INTO datasets (project_id, name) VALUES (1, ?)", [('One',), ('Two',), ('Three',)])
+    conn.executemany("INSERT INTO raw_files (dataset_id, path) VALUES (?, ?)",
+                     [(1, 'a'), (1, 'b'), (2, 'c'), (3, 'd')])
+    conn.commit()
+    checksum_raw_files(conn, workers=1, root=str(tmp_path))
+
+    groups = [{"checksum": blake2b(b'same'), "files": [{"id": 1, "dataset_id": 1, "path": 'a'},
+                                                       {"id": 3, "dataset_id": 2, "path": 'c'}]}]
+    assert fetch_duplicate_checksums(conn) == groups
+    # A dataset's groups include the copies in other datasets
+    assert fetch_duplicate_checksums(conn, dataset_id=2) == groups
+    assert fetch_duplicate_checksums(conn, dataset_id=3) == []
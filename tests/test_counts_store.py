@@ -0,0 +1,178 @@
+import json
+import os
+import random
+import sqlite3
+from array import array
+from collections import OrderedDict
+
+import pytest
+
+import counts_store
+from counts_store import STORE_KEY, CountsStore, convert_counts, convert_raw_files, iter_slice
+
+
+def write_table(path, genes, samples, rng, integer=True):
+    # A counts table, with its values by (gene row, sample) for checking
+    values = {}
+    lines = ['GeneID\t' + '\t'.join(samples)]
+    for row, gene in enumerate(genes):
+        cells = [rng.randrange(1000) if integer else round(rng.uniform(0, 100), 3) for _ in samples]
+        values.update(((row, sample), value) for sample, value in zip(samples, cells))
+        lines.append(gene + '\t' + '\t'.join(map(str, cells)))
+    path.write_text('\n'.join(lines) + '\n')
+    return values
+
+
+@pytest.fixture
+def table(tmp_path):
+    rng = random.Random(0)
+    genes = [f'ENSG{n:011d}' for n in range(5000)]
+    genes[10] = genes[4000]  # A repeated gene ID
+    samples = [f's{n}' for n in range(30)]
+    values = write_table(tmp_path / 'counts.tsv', genes, samples, rng)
+    return tmp_path / 'counts.tsv', genes, samples, values
+
+
+def test_store_values_match_the_table(tmp_path, table):
+    path, genes, samples, values = table
+    # Small blocks, so rows and columns are written across many blocks
+    index = convert_counts(path, tmp_path / 'store', block_size=4096)
+    assert index["rows"] == len(genes) and index["samples"] == samples and index["integer"]
+
+    store = CountsStore(tmp_path / 'store')
+    for sample in samples:
+        assert list(store.column(sample)) == [values[row, sample] for row in range(len(genes))]
+    assert store.gene_rows(genes[4000]) == [10, 4000]
+    assert store.gene_rows('missing') == []
+    assert [store.gene(row) for row in (0, 10, 4999)] == [genes[0], genes[4000], genes[4999]]
+    assert store.missing_samples(['s3', 'x', 's0', 'y']) == ['x', 'y']
+
+
+@pytest.mark.parametrize('fmt', ['json', 'ndjson', 'npy'])
+def test_slices(tmp_path, table, fmt):
+    path, genes, samples, values = table
+    convert_counts(path, tmp_path / 'store')
+    store = CountsStore(tmp_path / 'store')
+    rng = random.Random(1)
+    for rows in ([rng.randrange(len(genes)) for _ in range(20)], range(len(genes)), []):
+        picked = rng.sample(samples, 5)
+        body = b''.join(iter_slice(store, rows, picked, fmt))
+        expected = [[values[row, sample] for sample in picked] for row in rows]
+
+        if fmt == 'npy':
+            header_size = 10 + int.from_bytes(body[8:10], 'little')
+            assert f"'shape': ({len(rows)}, {len(picked)})".encode() in body[:header_size]
+            cells = array('d', body[header_size:])
+            assert [cells[n * len(picked):(n + 1) * len(picked)].tolist() for n in range(len(rows))] == expected
+        else:
+            if fmt == 'json':
+                result = json.loads(body)
+            else:
+                head, *lines = body.decode().splitlines()
+                result = dict(json.loads(head), rows=[json.loads(line) for line in lines])
+            assert result["samples"] == picked
+            assert [row["gene"] for row in result["rows"]] == [genes[row] for row in rows]
+            assert [row["values"] for row in result["rows"]] == expected
+
+
+def test_non_integer_values(tmp_path):
+    values = write_table(tmp_path / 'counts.tsv', ['g1', 'g2'], ['a', 'b'], random.Random(2), integer=False)
+    assert not convert_counts(tmp_path / 'counts.tsv', tmp_path / 'store')["integer"]
+    store = CountsStore(tmp_path / 'store')
+    assert store.values([1, 0], ['b']) == {'b': [values[1, 'b'], values[0, 'b']]}
+
+
+def test_raw_file_counts_endpoint(client, tmp_path, table):
+    path, genes, samples, values = table
+    response = client.post('/add_raw_files/', json=[{"dataset_id": 1, "path": str(path)}])
+    assert response.status_code == 200
+    conn = sqlite3.connect('data/data_redmane.db')
+    raw_file_id = conn.execute("SELECT id FROM raw_files WHERE path = ?", (str(path),)).fetchone()[0]
+
+    assert client.get(f'/raw_file_counts/{raw_file_id}').status_code == 404
+    assert convert_raw_files(conn, workers=1, store_root=str(tmp_path / 'stores'))["converted"] == 1
+    conn.close()
+
+    response = client.get(f'/raw_file_counts/{raw_file_id}', params={"gene": [genes[7], genes[4000]], "sample": ['s5', 's1']})
+    assert response.status_code == 200
+    assert response.json() == {"samples": ['s5', 's1'], "rows": [
+        {"gene": genes[7], "values": [values[7, 's5'], values[7, 's1']]},
+        {"gene": genes[4000], "values": [values[10, 's5'], values[10, 's1']]},
+        {"gene": genes[4000], "values": [values[4000, 's5'], values[4000, 's1']]},
+    ]}
+
+    response = client.get(f'/raw_file_counts/{raw_file_id}', params={"gene": genes[3], "format": 'npy'})
+    assert response.headers['content-type'] == 'application/octet-stream'
+    assert array('d', response.content[-len(samples) * 8:]).tolist() == [values[3, sample] for sample in samples]
+
+    response = client.get(f'/raw_file_counts/{raw_file_id}', params={"gene": ['nope', genes[0]], "sample": ['s1', 'x']})
+    assert response.status_code == 404
+    assert response.json()["detail"] == {"missing_genes": ['nope'], "missing_samples": ['x']}
+    assert client.get('/raw_file_counts/999999').status_code == 404
+
+
+def test_store_paths_are_absolute(conn, tmp_path, table, monkeypatch):
+    path, genes, samples, values = table
+    conn.execute("INSERT INTO projects (name, status) VALUES ('Project', 'active')")
+    conn.execute("INSERT INTO datasets (project_id, name) VALUES (1, 'Dataset')")
+    raw_file_id = conn.execute("INSERT INTO raw_files (dataset_id, path) VALUES (1, ?)", (str(path),)).lastrowid
+    conn.commit()
+
+    monkeypatch.chdir(tmp_path)
+    assert convert_raw_files(conn, workers=1, store_root='stores')["converted"] == 1
+    store_dir, = conn.execute("SELECT metadata_value FROM raw_files_metadata WHERE raw_file_id = ? AND metadata_key = ?",
+                              (raw_file_id, STORE_KEY)).fetchone()
+    assert os.path.isabs(store_dir) and store_dir.startswith(str(tmp_path / 'stores'))
+
+    # The API opens the store from another working directory
+    monkeypatch.chdir('/')
+    assert list(CountsStore(store_dir).column('s0')) == [values[row, 's0'] for row in range(len(genes))]
+
+    # A new version of the table replaces the old store, which is removed
+    os.utime(path, ns=(1, 1))
+    assert convert_raw_files(conn, workers=1, store_root=str(tmp_path / 'stores'))["converted"] == 1
+    assert os.listdir(tmp_path / 'stores' / str(raw_file_id)) == ['1']
+
+
+def test_store_evicted_while_streaming(tmp_path, table, monkeypatch):
+    path, genes, samples, values = table
+    monkeypatch.setattr(counts_store, '_open_stores', OrderedDict())
+    monkeypatch.setattr(counts_store, 'STORE_CACHE_SIZE', 2)
+    convert_counts(path, tmp_path / 'store')
+    for n in range(3):
+        write_table(tmp_path / f'other{n}.tsv', ['g1'], ['a'], random.Random(n))
+        convert_counts(tmp_path / f'other{n}.tsv', tmp_path / f'other{n}')
+
+    # Evict the store after the first chunk of its response, so the rest is read from it
+    # after it has left the cache
+    body = iter_slice(counts_store.open_store(str(tmp_path / 'store')), range(len(genes)), ['s2'], 'ndjson')
+    chunks = [next(body), next(body)]
+    for n in range(3):
+        counts_store.open_store(str(tmp_path / f'other{n}'))
+    assert str(tmp_path / 'store') not in counts_store._open_stores
+    chunks.extend(body)
+
+    head, *lines = b''.join(chunks).decode().splitlines()
+    assert [json.loads(line) for line in lines] == [{"gene": genes[row], "values": [values[row, 's2']]}
+                                                   for row in range(len(genes))]
+
+
+def test_space_separated_tables(tmp_path):
+    repo_sample = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               'sample_files', 'tracker', 'scrnaseq', 'raw', 'scrnaseq_agrf_all.counts.tsv')
+    index = convert_counts(repo_sample, tmp_path / 'sample')
+    assert index["gene_column"] == 'GeneID' and len(index["samples"]) == 12 and index["rows"] == 5
+    store = CountsStore(tmp_path / 'sample')
+    assert store.values(store.gene_rows('GeneE'), ['abc1111', 'abc1122']) == {'abc1111': [3], 'abc1122': [2]}
+
+    (tmp_path / 'spaced.tsv').write_text('\nGeneID  a   b\r\n\ng1  1 2\r\ng2   3.5 4\n\n')
+    assert convert_counts(tmp_path / 'spaced.tsv', tmp_path / 'spaced', block_size=8)["rows"] == 2
+    assert CountsStore(tmp_path / 'spaced').values([0, 1], ['a', 'b']) == {'a': [1.0, 3.5], 'b': [2.0, 4.0]}
+
+
+@pytest.mark.parametrize('text', ['GeneID\ng1\n', 'GeneID s1 s2\ng1 1\n', 'GeneID\ts1\ng1\t1\t2\n', ''])
+def test_invalid_tables_are_not_converted(tmp_path, text):
+    (tmp_path / 'counts.tsv').write_text(text)
+    with pytest.raises(ValueError):
+        convert_counts(tmp_path / 'counts.tsv', tmp_path / 'store')
+    assert not os.path.exists(tmp_path / 'store' / 'store.json')
@@ -0,0 +1,105 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+from database import BUSY_TIMEOUT_MS, ConnectionPool, PoolTimeout
+
+
+@pytest.fixture
+def pool(tmp_path):
+    path = str(tmp_path / 'pool.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.close()
+    pool = ConnectionPool(path, size=2, timeout=0.05)
+    yield pool
+    pool.close()
+
+
+def count_items(pool):
+    conn = sqlite3.connect(pool.database)
+    count = conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_connections_are_configured(pool):
+    with pool.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == BUSY_TIMEOUT_MS
+
+
+def test_release_rolls_back_open_transactions(pool):
+    conn = pool.acquire()
+    conn.execute("INSERT INTO items (name) VALUES ('uncommitted')")
+    assert conn.in_transaction
+    pool.release(conn)
+
+    # The pool hands the most recently released connection out first
+    again = pool.acquire()
+    assert again is conn and not again.in_transaction
+    pool.release(again)
+    assert count_items(pool) == 0
+
+
+def test_connection_is_returned_after_an_error(pool):
+    with pytest.raises(sqlite3.IntegrityError):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO items (id, name) VALUES (1, 'first')")
+            conn.execute("INSERT INTO items (id, name) VALUES (1, 'duplicate')")
+    assert pool.stats()["idle"] == 2
+    assert count_items(pool) == 0
+
+
+def test_acquire_times_out_when_every_connection_is_in_use(pool):
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    stats = pool.stats()
+    assert (stats["in_use"], stats["timeouts"]) == (2, 1)
+
+    # A connection released while another request waits goes to it
+    pool.timeout = 5
+    threading.Timer(0.2, pool.release, [held.pop()]).start()
+    pool.release(pool.acquire())
+    pool.release(held.pop())
+    stats = pool.stats()
+    assert (stats["idle"], stats["waits"], stats["timeouts"]) == (2, 1, 1)
+
+
+def test_run_uses_the_worker_threads(pool):
+    def insert(conn, name):
+        conn.execute("INSERT INTO items (name) VALUES (?)", (name,))
+        conn.commit()
+        return threading.current_thread().name
+
+    async def main():
+        return await asyncio.gather(*(pool.run(insert, str(i)) for i in range(10)))
+
+    threads = asyncio.run(main())
+    assert all(name.startswith('sqlite') for name in threads)
+    assert count_items(pool) == 10
+
+    async def failing():
+        return await pool.run(lambda conn: conn.execute("SELECT * FROM missing"))
+
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(failing())
+    assert pool.stats()["idle"] == 2
+
+
+def test_requests_get_503_when_the_pool_is_exhausted(client):
+    pool = client.app.state.db_pool
+    pool.timeout = 0.05
+    held = [pool.acquire() for _ in range(pool.size)]
+    try:
+        response = client.get('/projects/')
+        assert response.status_code == 503
+        assert response.json() == {"detail": "No database connection available after 0.05s"}
+    finally:
+        for conn in held:
+            pool.release(conn)
+    assert client.get('/projects/').status_code == 200
+    assert client.get('/db_pool_stats/').json()["timeouts"] == 1
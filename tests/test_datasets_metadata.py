@@ -0,0 +1,45 @@
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def dataset(client):
+    conn = sqlite3.connect('data/data_redmane.db')
+    project_id = conn.execute("INSERT INTO projects (name, status) VALUES ('Project', 'active')").lastrowid
+    dataset_id = conn.execute("INSERT INTO datasets (project_id, name) VALUES (?, 'Dataset')", (project_id,)).lastrowid
+    conn.commit()
+    conn.close()
+    return dataset_id
+
+
+def stored(dataset_id):
+    conn = sqlite3.connect('data/data_redmane.db')
+    rows = dict(conn.execute("SELECT key, value FROM datasets_metadata WHERE dataset_id = ?", (dataset_id,)).fetchall())
+    conn.close()
+    return rows
+
+
+def test_size_update(client, dataset):
+    update = {"dataset_id": dataset, "raw_file_size": '10MB', "last_size_update": '2024-01-01T00:00:00'}
+    assert client.put('/datasets_metadata/size_update', json=update).json() == update
+    # An empty value leaves the stored one as it is
+    client.put('/datasets_metadata/size_update', json=dict(update, raw_file_size='20MB', last_size_update=''))
+    assert stored(dataset) == {'raw_file_extension_size_of_all_files': '20MB', 'last_size_update': '2024-01-01T00:00:00'}
+
+
+def test_size_update_of_an_unknown_dataset(client, dataset):
+    update = {"dataset_id": dataset + 1, "raw_file_size": '10MB', "last_size_update": '2024-01-01T00:00:00'}
+    response = client.put('/datasets_metadata/size_update', json=update)
+    assert response.status_code == 404
+    assert stored(dataset + 1) == {}
+    # The connection the failed request used is usable again
+    for _ in range(10):
+        assert client.put('/datasets_metadata/size_update', json=dict(update, dataset_id=dataset)).status_code == 200
+
+
+def test_bulk_upsert_of_an_unknown_dataset_writes_nothing(client, dataset):
+    entries = [{"dataset_id": dataset, "key": 'a', "value": '1'}, {"dataset_id": dataset + 1, "key": 'a', "value": '1'}]
+    response = client.put('/datasets_metadata/', json=entries)
+    assert response.status_code == 404
+    assert stored(dataset) == {}
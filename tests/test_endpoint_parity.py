@@ -0,0 +1,146 @@
+import sqlite3
+
+import pytest
+
+
+def legacy_patients_metadata(conn, project_id, patient_id):
+    # The handler /patients_metadata ran before the set-based rewrite: patients with their
+    # metadata, then one query per patient for its samples
+    cursor = conn.cursor()
+    if patient_id != 0:
+        cursor.execute('''
+            SELECT p.id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id,
+                   pm.id, pm.key, pm.value
+            FROM patients p
+            LEFT JOIN patients_metadata pm ON p.id = pm.patient_id
+            WHERE p.project_id = ? and p.id = ?
+            ORDER BY p.id
+        ''', (project_id, patient_id))
+    else:
+        cursor.execute('''
+            SELECT p.id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id,
+                   pm.id, pm.key, pm.value
+            FROM patients p
+            LEFT JOIN patients_metadata pm ON p.id = pm.patient_id
+            WHERE p.project_id = ?
+            ORDER BY p.id
+        ''', (project_id,))
+
+    patients = []
+    current_patient = None
+    for row in cursor.fetchall():
+        if not current_patient or current_patient['id'] != row[0]:
+            if current_patient:
+                patients.append(current_patient)
+            current_patient = {'id': row[0], 'project_id': row[1], 'ext_patient_id': row[2],
+                               'ext_patient_url': row[3], 'public_patient_id': row[4], 'samples': [], 'metadata': []}
+        if row[5]:
+            current_patient['metadata'].append({'id': row[5], 'patient_id': row[0], 'key': row[6], 'value': row[7]})
+    if current_patient:
+        patients.append(current_patient)
+
+    for patient in patients:
+        cursor.execute('''
+            SELECT s.id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
+                   sm.id, sm.key, sm.value
+            FROM samples s
+            LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
+            WHERE s.patient_id = ?
+            ORDER BY s.id
+        ''', (patient['id'],))
+        current_sample = None
+        for sample_row in cursor.fetchall():
+            if not current_sample or current_sample['id'] != sample_row[0]:
+                if current_sample:
+                    patient['samples'].append(current_sample)
+                current_sample = {'id': sample_row[0], 'patient_id': sample_row[1], 'ext_sample_id': sample_row[2],
+                                  'ext_sample_url': sample_row[3], 'metadata': []}
+            if sample_row[4]:
+                current_sample['metadata'].append({'id': sample_row[4], 'sample_id': sample_row[0],
+                                                   'key': sample_row[5], 'value': sample_row[6]})
+        if current_sample:
+            patient['samples'].append(current_sample)
+    return patients
+
+
+def legacy_raw_files_with_metadata(conn, dataset_id):
+    # The handler /raw_files_with_metadata ran before the rewrite: each file's sample_id
+    # metadata rows joined to samples, then one metadata query per file
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT rf.id, rf.path, rfm.metadata_value AS sample_id, s.ext_sample_id
+        FROM raw_files rf
+        LEFT JOIN raw_files_metadata rfm ON rf.id = rfm.raw_file_id
+        LEFT JOIN samples s ON rfm.metadata_value = s.id
+        WHERE rf.dataset_id = ? AND rfm.metadata_key = 'sample_id'
+    ''', (dataset_id,))
+    response = []
+    for raw_file_id, path, sample_id, ext_sample_id in cursor.fetchall():
+        cursor.execute("SELECT id, sample_id, key, value FROM samples_metadata WHERE sample_id = ?", (sample_id,))
+        response.append({'id': raw_file_id, 'path': path, 'sample_id': sample_id, 'ext_sample_id': ext_sample_id,
+                         'sample_metadata': [{'id': row[0], 'sample_id': row[1], 'key': row[2], 'value': row[3]}
+                                             for row in cursor.fetchall()]})
+    return response
+
+
+@pytest.fixture
+def edge_cases(catalogue):
+    # Rows the generated catalogue lacks: a patient without samples or metadata, a sample
+    # without metadata, metadata with a NULL value, a file linked to two samples and a file
+    # linked to none
+    conn = sqlite3.connect('data/data_redmane.db')
+    project_id = catalogue["project_ids"][0]
+    dataset_id = catalogue["dataset_ids"][0]
+    conn.execute("INSERT INTO patients (project_id, ext_patient_id) VALUES (?, 'lonely')", (project_id,))
+    patient_id = conn.execute("INSERT INTO patients (project_id, ext_patient_id) VALUES (?, 'bare')", (project_id,)).lastrowid
+    conn.execute("INSERT INTO patients_metadata (patient_id, key, value) VALUES (?, 'note', NULL)", (patient_id,))
+    conn.execute("INSERT INTO samples (patient_id, ext_sample_id) VALUES (?, 'bare_sample')", (patient_id,))
+    samples = [row[0] for row in conn.execute('''
+        SELECT s.id FROM samples s JOIN patients p ON p.id = s.patient_id WHERE p.project_id = ? ORDER BY s.id LIMIT 2
+    ''', (project_id,))]
+    file_id = conn.execute("INSERT INTO raw_files (dataset_id, path) VALUES (?, '/data/matrix.tsv')", (dataset_id,)).lastrowid
+    conn.executemany("INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value) VALUES (?, 'sample_id', ?)",
+                     [(file_id, str(sample_id)) for sample_id in samples])
+    conn.execute("INSERT INTO raw_files (dataset_id, path) VALUES (?, '/data/unmatched.fastq')", (dataset_id,))
+    conn.commit()
+    conn.close()
+    return catalogue
+
+
+def test_patients_metadata_matches_the_legacy_handler(client, edge_cases):
+    conn = sqlite3.connect('data/data_redmane.db')
+    for project_id in edge_cases["project_ids"]:
+        patient_ids = [row[0] for row in conn.execute("SELECT id FROM patients WHERE project_id = ?", (project_id,))]
+        for patient_id in [0, *patient_ids[:3], *patient_ids[-2:], 10 ** 6]:
+            response = client.get(f'/patients_metadata/{patient_id}', params={"project_id": project_id})
+            assert response.status_code == 200
+            assert response.json() == legacy_patients_metadata(conn, project_id, patient_id), (project_id, patient_id)
+        assert len(client.get('/patients_metadata/0', params={"project_id": project_id}).json()) == len(patient_ids)
+    conn.close()
+
+
+def test_raw_files_with_metadata_matches_the_legacy_handler(client, edge_cases):
+    conn = sqlite3.connect('data/data_redmane.db')
+    for dataset_id in edge_cases["dataset_ids"]:
+        response = client.get(f'/raw_files_with_metadata/{dataset_id}')
+        assert response.status_code == 200
+        rows = response.json()
+
+        # Files linked to a sample are listed as before, one entry per link, now in id order
+        legacy = legacy_raw_files_with_metadata(conn, dataset_id)
+        linked = [row for row in rows if row["sample_id"] is not None]
+        assert linked == sorted(legacy, key=lambda row: (row["id"], int(row["sample_id"])))
+
+        # Files without a sample are now listed too, with a null sample
+        unlinked = [row for row in rows if row["sample_id"] is None]
+        assert unlinked == [{"id": raw_file_id, "path": path, "sample_id": None, "ext_sample_id": None, "sample_metadata": []}
+                            for raw_file_id, path in conn.execute('''
+                                SELECT id, path FROM raw_files rf WHERE dataset_id = ? AND NOT EXISTS (
+                                    SELECT 1 FROM raw_files_metadata WHERE raw_file_id = rf.id AND metadata_key = 'sample_id')
+                                ORDER BY id
+                            ''', (dataset_id,))]
+        assert linked
+    conn.close()
+
+    paths = [row["path"] for row in client.get(f'/raw_files_with_metadata/{edge_cases["dataset_ids"][0]}').json()]
+    assert (paths.count('/data/matrix.tsv'), paths.count('/data/unmatched.fastq')) == (2, 1)
@@ -0,0 +1,94 @@
+import bz2
+import gzip
+import os
+import random
+
+import pytest
+import zstandard
+
+from file_stats import counts_stats, fastq_stats
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMPRESSORS = {'plain': lambda data: data, 'gzip': gzip.compress, 'bz2': bz2.compress,
+               'zstd': lambda data: zstandard.ZstdCompressor().compress(data)}
+
+
+def fastq(rng, reads, line_end='\n'):
+    records = []
+    for n in range(reads):
+        sequence = ''.join(rng.choice('ACGTN') for _ in range(rng.randrange(1, 300)))
+        records.append(f'@read{n}{line_end}{sequence}{line_end}+{line_end}{"I" * len(sequence)}{line_end}')
+    return ''.join(records)
+
+
+def naive_fastq_stats(text):
+    lines = text.splitlines()
+    lengths = [len(line) for line in lines[1::4]]
+    return {"read_count": len(lengths), "base_count": sum(lengths),
+            "mean_read_length": round(sum(lengths) / len(lengths), 2) if lengths else 0,
+            "min_read_length": min(lengths, default=0), "max_read_length": max(lengths, default=0)}
+
+
+def counts_table(rng, genes, samples, separator='\t'):
+    lines = [separator.join(['GeneID'] + [f's{n}' for n in range(samples)])]
+    for gene in range(genes):
+        lines.append(separator.join([f'G{gene}'] + [str(rng.randrange(1000)) for _ in range(samples)]))
+    return '\n'.join(lines) + '\n'
+
+
+def naive_counts_stats(text):
+    header, *rows = [line.split() for line in text.splitlines() if line.strip()]
+    return {"row_count": len(rows), "column_count": len(header),
+            "column_totals": {sample: sum(int(row[n]) for row in rows) for n, sample in enumerate(header[1:], 1)}}
+
+
+@pytest.mark.parametrize('compression', COMPRESSORS)
+@pytest.mark.parametrize('line_end', ['\n', '\r\n'])
+def test_fastq_stats(tmp_path, compression, line_end):
+    text = fastq(random.Random(0), 500, line_end)
+    path = tmp_path / 'reads.fastq'
+    path.write_bytes(COMPRESSORS[compression](text.encode()))
+    # Small blocks, so records are split across blocks
+    assert fastq_stats(path, block_size=1000) == naive_fastq_stats(text)
+    assert fastq_stats(path) == naive_fastq_stats(text)
+
+
+def test_fastq_stats_rejects_truncated_and_other_files(tmp_path):
+    text = fastq(random.Random(1), 10)
+    (tmp_path / 'truncated.fastq').write_text(text.rsplit('\n', 3)[0] + '\n')
+    with pytest.raises(ValueError, match='truncated'):
+        fastq_stats(tmp_path / 'truncated.fastq', block_size=100)
+    (tmp_path / 'other.fastq').write_text('>not fastq\nACGT\n')
+    with pytest.raises(ValueError, match='not a FASTQ file'):
+        fastq_stats(tmp_path / 'other.fastq')
+    (tmp_path / 'empty.fastq').write_text('')
+    assert fastq_stats(tmp_path / 'empty.fastq')["read_count"] == 0
+
+
+@pytest.mark.parametrize('compression', COMPRESSORS)
+@pytest.mark.parametrize('separator', ['\t', ' ', '   '])
+def test_counts_stats(tmp_path, compression, separator):
+    text = counts_table(random.Random(2), 300, 12, separator) + '\n'
+    path = tmp_path / 'counts.tsv'
+    path.write_bytes(COMPRESSORS[compression](text.encode()))
+    assert counts_stats(path, block_size=500) == naive_counts_stats(text)
+
+
+def test_counts_stats_of_the_repo_sample():
+    path = os.path.join(REPO_ROOT, 'sample_files', 'tracker', 'scrnaseq', 'raw', 'scrnaseq_agrf_all.counts.tsv')
+    with open(path) as file:
+        expected = naive_counts_stats(file.read())
+    assert counts_stats(path) == expected and expected["column_count"] == 13
+
+
+@pytest.mark.parametrize('text, error', [
+    ('GeneID\ts1\ts2\nG1\t1\t2\nG2\t3\n', "header's 3 columns"),
+    ('GeneID s1 s2\nG1 1 2 3\nG2 3 4\n', "header's 3 columns"),
+    ('GeneID\nG1\n', 'no.*sample columns|1 column'),
+    ('GeneID\ts1\nG1\tmany\n', 'could not convert'),
+])
+def test_counts_stats_rejects_bad_tables(tmp_path, text, error):
+    (tmp_path / 'counts.tsv').write_text(text)
+    with pytest.raises(ValueError, match=error):
+        counts_stats(tmp_path / 'counts.tsv')
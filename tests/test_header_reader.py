@@ -0,0 +1,104 @@
+import bz2
+import gzip
+import os
+import zlib
+
+import pytest
+import zstandard
+
+import header_reader
+from header_reader import HEADER_MAX_BYTES, read_header, read_headers
+
+COMPRESSORS = {'plain': lambda data: data, 'gzip': gzip.compress, 'bz2': bz2.compress,
+               'zstd': lambda data: zstandard.ZstdCompressor().compress(data)}
+
+
+@pytest.fixture
+def bytes_read(monkeypatch):
+    # Counts the bytes read_header reads from disk
+    counter = {"bytes": 0}
+
+    class CountingFile:
+        def __init__(self, file):
+            self._file = file
+
+        def read(self, size=-1):
+            data = self._file.read(size)
+            counter["bytes"] += len(data)
+            return data
+
+        def __getattr__(self, name):
+            return getattr(self._file, name)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self._file.close()
+
+    monkeypatch.setattr(header_reader, 'open', lambda path, mode: CountingFile(open(path, mode)), raising=False)
+    return counter
+
+
+@pytest.mark.parametrize('compression', COMPRESSORS)
+@pytest.mark.parametrize('line_end', [b'\n', b'\r\n'])
+def test_read_header(tmp_path, compression, line_end):
+    data = b'GeneID\tS1\tS2' + line_end + b'G1\t1\t2' + line_end
+    (tmp_path / 'table').write_bytes(COMPRESSORS[compression](data))
+    assert read_header(tmp_path / 'table') == 'GeneID\tS1\tS2'
+
+
+@pytest.mark.parametrize('compression', COMPRESSORS)
+def test_large_files_are_read_only_up_to_their_header(tmp_path, compression, bytes_read):
+    # Incompressible data, so the compressed file is as large as the content
+    body = b'@header\n' + os.urandom(8 * 1024 * 1024).hex().encode()
+    (tmp_path / 'big').write_bytes(COMPRESSORS[compression](body))
+    assert read_header(tmp_path / 'big') == '@header'
+    # bzip2 and zstd decode whole blocks (up to 900 kB and 128 kB); the others stop after a
+    # read or two
+    limit = {'bz2': 1024 * 1024, 'zstd': 128 * 1024 + header_reader.READ_SIZE}.get(compression, 2 * header_reader.READ_SIZE)
+    assert bytes_read["bytes"] <= limit
+
+
+@pytest.mark.parametrize('compression', COMPRESSORS)
+def test_long_first_lines_are_cut(tmp_path, compression, bytes_read):
+    (tmp_path / 'long').write_bytes(COMPRESSORS[compression](b'x' * (HEADER_MAX_BYTES * 50) + b'\nrest\n'))
+    assert read_header(tmp_path / 'long') == 'x' * HEADER_MAX_BYTES
+    assert read_header(tmp_path / 'long', max_bytes=10) == 'x' * 10
+    assert bytes_read["bytes"] <= 2 * (HEADER_MAX_BYTES + header_reader.READ_SIZE) + 1024 * 1024
+
+
+def test_multi_member_files(tmp_path):
+    # bgzip and pbzip2 write many members; a header can span two of them
+    (tmp_path / 'members.gz').write_bytes(gzip.compress(b'Gene') + gzip.compress(b'ID\tS1\n') + b'')
+    assert read_header(tmp_path / 'members.gz') == 'GeneID\tS1'
+    (tmp_path / 'streams.bz2').write_bytes(bz2.compress(b'Gene') + bz2.compress(b'ID\tS1\n'))
+    assert read_header(tmp_path / 'streams.bz2') == 'GeneID\tS1'
+    zstd = zstandard.ZstdCompressor()
+    (tmp_path / 'frames.zst').write_bytes(zstd.compress(b'Gene') + zstd.compress(b'ID\tS1\n'))
+    assert read_header(tmp_path / 'frames.zst') == 'GeneID\tS1'
+
+
+def test_corruption_after_the_header_is_not_read(tmp_path):
+    compressed = gzip.compress(b'@header\n' + os.urandom(1024 * 1024))
+    (tmp_path / 'tail.gz').write_bytes(compressed[:len(compressed) // 2] + b'\x00' * 1000)
+    assert read_header(tmp_path / 'tail.gz') == '@header'
+    (tmp_path / 'head.gz').write_bytes(b'\x1f\x8b' + b'\x00' * 100)
+    with pytest.raises((zlib.error, EOFError, OSError)):
+        read_header(tmp_path / 'head.gz')
+
+
+def test_read_headers(tmp_path):
+    paths = []
+    for n in range(200):
+        compress = list(COMPRESSORS.values())[n % len(COMPRESSORS)]
+        path = tmp_path / f'{n}.txt'
+        path.write_bytes(compress(f'header {n}\nbody\n'.encode()))
+        paths.append(str(path))
+    paths.insert(50, str(tmp_path / 'missing'))
+    errors = []
+    results = list(read_headers(paths, workers=3, onerror=lambda path, error: errors.append((path, type(error)))))
+    assert [path for path, _ in results] == paths
+    assert [header for _, header in results] == [f'header {n}' for n in range(50)] + [None] + \
+        [f'header {n}' for n in range(50, 200)]
+    assert errors == [(str(tmp_path / 'missing'), FileNotFoundError)]
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+import ingest
+from ingest import iter_ndjson
+
+
+async def chunked(body, rng):
+    # The body in chunks of random sizes, as a request stream delivers it
+    start = 0
+    while start < len(body):
+        end = start + rng.randint(1, 64)
+        yield body[start:end]
+        start = end
+
+
+def parse(body, rng):
+    async def collect():
+        return [item async for item in iter_ndjson(chunked(body, rng))]
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_iter_ndjson_matches_splitting_the_whole_body(seed):
+    rng = random.Random(seed)
+    objects = [{"path": 'x' * rng.randrange(200), "n": n} if rng.random() < 0.8 else None for n in range(50)]
+    lines = [json.dumps(obj) if obj is not None else rng.choice(['', '  ', '\r']) for obj in objects]
+    body = '\n'.join(lines) + rng.choice(['', '\n'])
+    expected = [(number, json.loads(line)) for number, line in enumerate(lines, 1) if line.strip()]
+    assert parse(body.encode(), rng) == expected
+
+
+def test_iter_ndjson_rejects_long_lines(monkeypatch):
+    monkeypatch.setattr(ingest, 'MAX_NDJSON_LINE_BYTES', 100)
+    rng = random.Random(0)
+    line = json.dumps({"path": 'x' * 80}).encode()
+    assert parse(line + b'\n' + line, rng) == [(1, {"path": 'x' * 80}), (2, {"path": 'x' * 80})]
+    for body in (line + b'\n' + b'x' * 101, b'x' * 101 + b'\n', b'x' * 1000):
+        with pytest.raises(ValueError, match='longer than 100 bytes'):
+            parse(body, rng)
+
+
+def test_add_raw_files_ndjson(client, monkeypatch):
+    files = [{"dataset_id": 1, "path": f'/data/{n}.fastq'} for n in range(3)]
+    body = ''.join(json.dumps(raw_file) + '\n' for raw_file in files)
+    response = client.post('/add_raw_files/ndjson', content=body)
+    assert response.status_code == 200 and response.json()["inserted"] == 3
+
+    monkeypatch.setattr(ingest, 'MAX_NDJSON_LINE_BYTES', 100)
+    response = client.post('/add_raw_files/ndjson', content=body + json.dumps({"dataset_id": 1, "path": 'x' * 200}))
+    assert response.status_code == 413
+    assert 'line 4 is longer than 100 bytes' in response.json()["detail"]
+    response = client.post('/add_raw_files/ndjson', content=body + '{"dataset_id": 1,\n')
+    assert response.status_code == 422
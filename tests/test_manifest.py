@@ -0,0 +1,116 @@
+import pytest
+
+from manifest import Manifest, match_fingerprint
+from scanner import ScannedFile
+
+SAMPLES = [{"sample_id": 1, "ext_sample_id": "S1", "ext_patient_id": "P1"},
+           {"sample_id": 2, "ext_sample_id": "S2", "ext_patient_id": "P1"}]
+
+
+def scanned(path, size=10, mtime=1.0, inode=1):
+    return ScannedFile(path, size, mtime, '.fastq', inode)
+
+
+def run(manifest, dataset_id, files, samples=None):
+    # One tracker run as file_report.py makes it: stage the scan, match what changed, record it
+    manifest.start_scan()
+    batch = manifest.stage(files)
+    changed = manifest.changed(dataset_id, batch)
+    manifest.record(dataset_id, [(path, size, mtime, inode, None, (samples or {}).get(path, []))
+                                 for path, size, mtime, inode, previous in changed])
+    deleted = manifest.deleted(dataset_id)
+    manifest.forget(dataset_id, [path for path, previous in deleted])
+    manifest.commit()
+    return changed, deleted
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = Manifest(str(tmp_path / 'manifest.db'))
+    yield manifest
+    manifest.close()
+
+
+def test_new_files_are_changed(manifest):
+    changed, deleted = run(manifest, 1, [scanned('a'), scanned('b')], {'a': [1]})
+    assert changed == [('a', 10, 1.0, 1, None), ('b', 10, 1.0, 1, None)]
+    assert deleted == []
+
+
+def test_unchanged_files_are_skipped(manifest):
+    files = [scanned('a'), scanned('b')]
+    run(manifest, 1, files, {'a': [1]})
+    changed, deleted = run(manifest, 1, files)
+    assert changed == [] and deleted == []
+
+    manifest.start_scan()
+    batch = manifest.stage(files)
+    assert manifest.unchanged(1, batch) == [('a', 10, 1.0, 1, None, [1]), ('b', 10, 1.0, 1, None, [])]
+
+
+@pytest.mark.parametrize('change', [{'size': 11}, {'mtime': 2.0}, {'inode': 2}])
+def test_changed_files_are_found(manifest, change):
+    run(manifest, 1, [scanned('a'), scanned('b')], {'a': [1, 2]})
+    file = scanned('a', **change)
+    changed, deleted = run(manifest, 1, [file, scanned('b')])
+    # The previous samples come back, so the old registration can be removed
+    assert changed == [(file.path, file.size, file.mtime, file.inode, [1, 2])]
+    assert deleted == []
+
+
+def test_deleted_files_are_found(manifest):
+    run(manifest, 1, [scanned('a'), scanned('b'), scanned('c')], {'a': [1], 'b': [2]})
+    changed, deleted = run(manifest, 1, [scanned('b')])
+    assert changed == []
+    assert deleted == [('a', [1]), ('c', [])]
+
+    # Forgotten once the run went through, so a file that comes back is new again
+    changed, deleted = run(manifest, 1, [scanned('a'), scanned('b')])
+    assert changed == [('a', 10, 1.0, 1, None)]
+    assert deleted == []
+
+
+def test_datasets_are_separate(manifest):
+    run(manifest, 1, [scanned('a')])
+    changed, deleted = run(manifest, 2, [scanned('b')])
+    assert [row[0] for row in changed] == ['b']
+    assert deleted == []
+
+    manifest.reset(1)
+    changed, deleted = run(manifest, 1, [scanned('a')])
+    assert [row[0] for row in changed] == ['a']
+
+
+def test_changes_are_kept_only_on_commit(tmp_path):
+    manifest = Manifest(str(tmp_path / 'manifest.db'))
+    manifest.start_scan()
+    manifest.record(1, [('a', 10, 1.0, 1, None, [1])])
+    manifest.set_fingerprint(1, 'f')
+    manifest.close()
+
+    manifest = Manifest(str(tmp_path / 'manifest.db'))
+    manifest.start_scan()
+    manifest.stage([scanned('a')])
+    assert manifest.changed(1) == [('a', 10, 1.0, 1, None)]
+    assert manifest.fingerprint(1) is None
+    manifest.close()
+
+
+def test_batches_are_compared_separately(manifest):
+    manifest.start_scan()
+    first = manifest.stage([scanned('a')])
+    second = manifest.stage([scanned('b'), scanned('c')])
+    assert [row[0] for row in manifest.changed(1, first)] == ['a']
+    assert [row[0] for row in manifest.changed(1, second)] == ['b', 'c']
+    assert [row[0] for row in manifest.changed(1)] == ['a', 'b', 'c']
+
+
+def test_match_fingerprint():
+    fingerprint = match_fingerprint('filename', SAMPLES)
+    assert match_fingerprint('filename', [dict(sample) for sample in SAMPLES]) == fingerprint
+    assert match_fingerprint('header', SAMPLES) != fingerprint
+    assert match_fingerprint('filename', SAMPLES[:1]) != fingerprint
+    renamed = [SAMPLES[0], {**SAMPLES[1], "ext_sample_id": "S3"}]
+    assert match_fingerprint('filename', renamed) != fingerprint
+    moved = [SAMPLES[0], {**SAMPLES[1], "ext_patient_id": "P2"}]
+    assert match_fingerprint('filename', moved) != fingerprint
@@ -0,0 +1,78 @@
+import random
+import re
+
+import pytest
+
+import matcher
+from matcher import SampleMatcher
+
+
+# A small alphabet, so IDs often overlap, are prefixes of each other or repeat; '.' checks
+# that IDs are matched literally
+ALPHABET = 'ab1.'
+
+
+def legacy_match(filename, samples):
+    # The loop file_report.py ran for each file before SampleMatcher
+    matches = []
+    for data in samples:
+        if data["ext_sample_id"] in filename:
+            matches.append(data)
+        elif re.compile(re.escape(data["ext_patient_id"]).replace(r'\ ', '.*')).search(filename):
+            matches.append(data)
+            break
+    return matches
+
+
+def random_id(rng, spaces=False):
+    parts = [''.join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 2) if spaces else 1)]
+    return ' '.join(parts)
+
+
+def random_samples(rng):
+    samples = []
+    for patient in range(rng.randint(1, 8)):
+        ext_patient_id = random_id(rng, spaces=True)
+        for _ in range(rng.randint(1, 4)):
+            samples.append({"ext_sample_id": random_id(rng), "ext_patient_id": ext_patient_id})
+    return samples
+
+
+def random_filename(rng, samples):
+    parts = [random_id(rng) for _ in range(rng.randint(0, 3))]
+    parts += [rng.choice(samples)["ext_sample_id"] for _ in range(rng.randint(0, 2))]
+    parts += [rng.choice(samples)["ext_patient_id"].replace(' ', rng.choice(['', '_', 'x1'])) for _ in range(rng.randint(0, 1))]
+    rng.shuffle(parts)
+    return '/data/raw/' + rng.choice(['', '_', '-']).join(parts) + '.fastq'
+
+
+@pytest.fixture(params=['automaton', 'fallback'])
+def substring_index(request, monkeypatch):
+    # Both the pyahocorasick automaton and the pure Python fallback
+    if request.param == 'automaton':
+        if matcher.ahocorasick is None:
+            pytest.skip("pyahocorasick is not installed")
+    else:
+        monkeypatch.setattr(matcher, 'ahocorasick', None)
+    return request.param
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_filenames_match_like_the_legacy_loop(substring_index, seed):
+    rng = random.Random(seed)
+    for _ in range(20):
+        samples = random_samples(rng)
+        sample_matcher = SampleMatcher(samples)
+        for _ in range(50):
+            filename = random_filename(rng, samples)
+            assert sample_matcher.match_filename(filename) == legacy_match(filename, samples), filename
+
+
+def test_prefix_and_overlapping_ids(substring_index):
+    samples = [{"ext_sample_id": 'abc1', "ext_patient_id": 'P1'},
+               {"ext_sample_id": 'abc', "ext_patient_id": 'P1'},
+               {"ext_sample_id": 'c1x', "ext_patient_id": 'P2'},
+               {"ext_sample_id": 'abc', "ext_patient_id": 'P3 x'}]
+    sample_matcher = SampleMatcher(samples)
+    for filename in ['abc1x.fastq', 'P2_abc.fastq', 'P3_x_abc.fastq', 'zzz.fastq', 'P1.fastq']:
+        assert sample_matcher.match_filename(filename) == legacy_match(filename, samples), filename
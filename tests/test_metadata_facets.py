@@ -0,0 +1,59 @@
+import pytest
+
+from conftest import check_random_writes, ids
+from synthetic import generate_catalogue
+
+
+KEYS = ['tissue', 'sample_type', 'sex', 'smoking']
+VALUES = ['a', 'b', 'c', None]
+
+RECOUNT = '''
+    SELECT 'samples', p.project_id, sm.key, sm.value, COUNT(DISTINCT sm.sample_id)
+    FROM samples_metadata sm
+    JOIN samples s ON s.id = sm.sample_id
+    JOIN patients p ON p.id = s.patient_id
+    WHERE sm.key IS NOT NULL AND sm.value IS NOT NULL
+    GROUP BY p.project_id, sm.key, sm.value
+    UNION ALL
+    SELECT 'patients', p.project_id, pm.key, pm.value, COUNT(DISTINCT pm.patient_id)
+    FROM patients_metadata pm
+    JOIN patients p ON p.id = pm.patient_id
+    WHERE pm.key IS NOT NULL AND pm.value IS NOT NULL
+    GROUP BY p.project_id, pm.key, pm.value
+'''
+
+
+def random_write(conn, rng):
+    # One insert, update or delete of metadata, or a move or delete of a sample or patient,
+    # including duplicate key/value rows and rows with NULL keys or values
+    metadata_table, id_column, entity_table = rng.choice([('samples_metadata', 'sample_id', 'samples'),
+                                                          ('patients_metadata', 'patient_id', 'patients')])
+    rows = ids(conn, metadata_table)
+    entities = ids(conn, entity_table)
+    operation = rng.choice(['insert', 'insert', 'update', 'update', 'delete', 'move', 'remove'])
+
+    if operation == 'insert' and entities:
+        conn.execute(f"INSERT INTO {metadata_table} ({id_column}, key, value) VALUES (?, ?, ?)",
+                     (rng.choice(entities), rng.choice(KEYS), rng.choice(VALUES)))
+    elif operation == 'update' and rows and entities:
+        column, value = rng.choice([(id_column, rng.choice(entities)), ('key', rng.choice(KEYS)), ('value', rng.choice(VALUES))])
+        conn.execute(f"UPDATE {metadata_table} SET {column} = ? WHERE id = ?", (value, rng.choice(rows)))
+    elif operation == 'delete' and rows:
+        conn.execute(f"DELETE FROM {metadata_table} WHERE id = ?", (rng.choice(rows),))
+    elif operation == 'move' and entities:
+        if entity_table == 'samples':
+            conn.execute("UPDATE samples SET patient_id = ? WHERE id = ?", (rng.choice(ids(conn, 'patients')), rng.choice(entities)))
+        else:
+            conn.execute("UPDATE patients SET project_id = ? WHERE id = ?", (rng.choice(ids(conn, 'projects')), rng.choice(entities)))
+    elif operation == 'remove' and entities:
+        conn.execute(f"DELETE FROM {entity_table} WHERE id = ?", (rng.choice(entities),))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_facet_counts_match_a_recount(conn, seed):
+    generate_catalogue(conn, projects=3, patients=20, samples_per_patient=3, patient_metadata_keys=2,
+                       sample_metadata_keys=2, files_per_sample=0, seed=seed)
+    check_random_writes(
+        conn, seed, random_write,
+        lambda conn: sorted(conn.execute("SELECT entity, project_id, key, value, count FROM metadata_facets")),
+        lambda conn: sorted(conn.execute(RECOUNT)))
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+from metadata_filter import FILTERABLE, matching_ids, parse_predicates, predicates_key
+from synthetic import generate_catalogue
+
+
+def naive_matching_ids(conn, entity, project_id, predicates):
+    # One EXISTS per key against the metadata rows themselves
+    metadata_table, _, id_column, in_project = FILTERABLE[entity]
+    conditions, params = [], []
+    for key, values in predicates.items():
+        conditions.append(f"EXISTS (SELECT 1 FROM {metadata_table} x WHERE x.{id_column} = m.{id_column} "
+                          f"AND x.key = ? AND x.value IN ({', '.join('?' for _ in values)}))")
+        params += [key, *values]
+    rows = conn.execute(f'''
+        SELECT DISTINCT m.{id_column} FROM {metadata_table} m
+        WHERE {' AND '.join(conditions)} AND EXISTS ({in_project})
+        ORDER BY 1
+    ''', (*params, project_id))
+    return [row[0] for row in rows]
+
+
+# Values that look like other pairs once joined into a pivot row, or hold the characters
+# filters are written with
+AWKWARD_VALUES = ['a=b', 'x, y', 'Liver\x1fsex\x1eFemale', 'Lung\x1e', '\x1fsample_type\x1eTumour\x1f', '']
+
+
+def test_parse_predicates():
+    assert parse_predicates(['tissue= Liver ', ' tissue=Lung', 'tissue=Liver', 'note=a=b', 'empty=']) == \
+        {'tissue': ['Liver', 'Lung'], 'note': ['a=b'], 'empty': ['']}
+    assert predicates_key(parse_predicates(['b=2', 'a=1', 'b=1'])) == predicates_key(parse_predicates(['a=1', 'b=1', 'b=2']))
+    for invalid in ['tissue', '=Liver', ' =Liver', 'tissue=Li\x1fver', 'tis\x1esue=Liver']:
+        with pytest.raises(ValueError):
+            parse_predicates([invalid])
+
+
+@pytest.mark.parametrize('entity', ['samples', 'patients'])
+@pytest.mark.parametrize('seed', range(5))
+def test_matching_ids_match_a_naive_query(conn, entity, seed):
+    catalogue = generate_catalogue(conn, projects=2, patients=60, samples_per_patient=3, patient_metadata_keys=4,
+                                   sample_metadata_keys=5, files_per_sample=0, seed=seed)
+    rng = random.Random(seed)
+    metadata_table, _, id_column, _ = FILTERABLE[entity]
+    ids = [row[0] for row in conn.execute(f"SELECT DISTINCT {id_column} FROM {metadata_table}")]
+    conn.executemany(f"INSERT INTO {metadata_table} ({id_column}, key, value) VALUES (?, 'note', ?)",
+                     [(rng.choice(ids), rng.choice(AWKWARD_VALUES)) for _ in range(40)])
+    conn.commit()
+    pairs = conn.execute(f"SELECT DISTINCT key, value FROM {metadata_table} WHERE value NOT LIKE '%' || char(31) || '%' "
+                         f"AND value NOT LIKE '%' || char(30) || '%'").fetchall()
+    keys = sorted({key for key, _ in pairs})
+
+    for _ in range(40):
+        where = []
+        for key in rng.sample(keys, rng.randint(1, min(3, len(keys)))):
+            values = [value for pair_key, value in pairs if pair_key == key]
+            where += [f'{key}={value}' for value in rng.sample(values, rng.randint(1, min(2, len(values))))]
+        if rng.random() < 0.3:
+            # A pair no entity has, and one that only exists inside an awkward value
+            where.append(rng.choice(['sex=Female', 'sample_type=Tumour', 'tissue=Nowhere']))
+        predicates = parse_predicates(where)
+        for project_id in catalogue["project_ids"]:
+            expected = naive_matching_ids(conn, entity, project_id, predicates)
+            assert matching_ids(conn, entity, project_id, predicates) == expected, where
+            # Keyset pages add up to the same ids
+            pages, after = [], 0
+            while page := matching_ids(conn, entity, project_id, predicates, after=after, limit=7):
+                pages += page
+                after = page[-1]
+            assert pages == expected, where
+
+
+def test_values_are_stripped(client, catalogue):
+    project_id = catalogue["project_ids"][0]
+    exact = client.get('/samples_by_metadata/', params={"project_id": project_id, "where": 'tissue=Liver'}).json()
+    spaced = client.get('/samples_by_metadata/', params={"project_id": project_id, "where": ' tissue = Liver '}).json()
+    assert exact and spaced == exact
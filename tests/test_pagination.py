@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import pagination
+from database import ConnectionPool, PoolTimeout
+from pagination import NEXT_AFTER_HEADER, iter_pages
+
+@pytest.fixture
+def lists(catalogue, monkeypatch):
+    # (path, query) of every paged list; small stream pages, so every stream is read in several
+    monkeypatch.setattr(pagination, 'STREAM_PAGE_SIZE', 7)
+    project_id, dataset_id = catalogue["project_ids"][1], catalogue["dataset_ids"][2]
+    return [
+        ('/samples/0', {"project_id": project_id}),
+        ('/patients/0', {"project_id": project_id}),
+        ('/patients_metadata/0', {"project_id": project_id}),
+        (f'/raw_files_with_metadata/{dataset_id}', {}),
+        ('/samples_by_metadata/', {"project_id": project_id, "where": ['tissue=Liver', 'tissue=Lung']}),
+    ]
+
+
+def get(client, url, **params):
+    url, url_params = url
+    response = client.get(url, params={**url_params, **params})
+    assert response.status_code == 200, response.text
+    return response
+
+
+@pytest.mark.parametrize('limit', [1, 10, 1000])
+def test_walking_pages_returns_every_row_once(client, lists, limit):
+    for url in lists:
+        everything = get(client, url).json()
+        assert everything and NEXT_AFTER_HEADER not in get(client, url).headers
+        rows, after = [], 0
+        while True:
+            response = get(client, url, after=after, limit=limit)
+            page = response.json()
+            assert len(page) <= limit
+            rows += page
+            if NEXT_AFTER_HEADER not in response.headers:
+                break
+            assert len(page) == limit
+            after = int(response.headers[NEXT_AFTER_HEADER])
+        assert rows == everything, url
+
+
+def test_streams_match_the_unstreamed_list(client, lists):
+    for url in lists:
+        everything = get(client, url).json()
+        middle = everything[len(everything) // 2]["id"]
+        for params in ({}, {"limit": 15}, {"after": middle}, {"after": middle, "limit": 9}):
+            expected = get(client, url, **params).json()
+            response = get(client, url, stream='json', **params)
+            assert response.headers['content-type'] == 'application/json'
+            assert json.loads(response.content) == expected, (url, params)
+            response = get(client, url, stream='ndjson', **params)
+            assert response.headers['content-type'] == 'application/x-ndjson'
+            assert response.text.endswith('\n') or not expected
+            assert [json.loads(line) for line in response.text.splitlines()] == expected, (url, params)
+
+
+def test_empty_streams(client, catalogue):
+    assert get(client, ('/samples/0', {"project_id": 999}), stream='json').json() == []
+    assert get(client, ('/samples/0', {"project_id": 999}), stream='ndjson').content == b''
+
+
+def test_streams_hold_no_connection_between_pages(tmp_path, conn, monkeypatch):
+    conn.executemany("INSERT INTO projects (name, status) VALUES (?, 'active')", [(f'p{n}',) for n in range(10)])
+    conn.commit()
+    monkeypatch.setattr(pagination, 'STREAM_PAGE_SIZE', 3)
+
+    def fetch_page(conn, after, limit):
+        rows = conn.execute("SELECT id, name FROM projects WHERE id > ? ORDER BY id LIMIT ?", (after, limit))
+        return [{"id": id, "name": name} for id, name in rows]
+
+    pool = ConnectionPool(str(tmp_path / 'test.db'), size=1, timeout=0.1)
+    try:
+        streams = [iter_pages(pool, fetch_page, 0, None, 'ndjson') for _ in range(3)]
+        # Every stream is partway through while the pool's only connection is free
+        firsts = [next(stream) for stream in streams]
+        with pool.connection():
+            with pytest.raises(PoolTimeout):
+                pool.acquire()
+        lines = [b''.join([first, *stream]).splitlines() for first, stream in zip(firsts, streams)]
+        assert all([json.loads(line)["id"] for line in stream_lines] == list(range(1, 11)) for stream_lines in lines)
+        assert pool.stats()["in_use"] == 0
+    finally:
+        pool.close()
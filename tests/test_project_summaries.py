@@ -0,0 +1,89 @@
+import sqlite3
+
+import pytest
+
+from conftest import check_random_writes, ids
+from migrations import RAW_SIZE_KEY, SUMMARY_COLUMNS
+from synthetic import generate_catalogue
+
+
+# Sizes as the tracker reports them, with the bytes each stands for
+SIZES = {'2048': 2048, '1KB': 1024, '10MB': 10 * 1024 ** 2, '1.5 GB': int(1.5 * 1024 ** 3), '2 tb': 2 * 1024 ** 4, 'junk': 0}
+
+
+def recount(conn):
+    # Every project's summary computed in Python from the base tables
+    projects = [row[0] for row in conn.execute("SELECT id FROM projects")]
+    patients = dict(conn.execute("SELECT id, project_id FROM patients").fetchall())
+    datasets = dict(conn.execute("SELECT id, project_id FROM datasets").fetchall())
+    summaries = {project_id: dict.fromkeys(SUMMARY_COLUMNS, 0) for project_id in projects}
+
+    def add(project_id, column, amount=1):
+        if project_id in summaries:
+            summaries[project_id][column] += amount
+
+    for project_id in patients.values():
+        add(project_id, 'patient_count')
+    for patient_id, in conn.execute("SELECT patient_id FROM samples"):
+        add(patients.get(patient_id), 'sample_count')
+    for project_id in datasets.values():
+        add(project_id, 'dataset_count')
+    for dataset_id, in conn.execute("SELECT dataset_id FROM raw_files"):
+        add(datasets.get(dataset_id), 'raw_file_count')
+    for dataset_id, value in conn.execute("SELECT dataset_id, value FROM datasets_metadata WHERE key = ?", (RAW_SIZE_KEY,)):
+        add(datasets.get(dataset_id), 'raw_bytes', SIZES[value])
+    return sorted((project_id, *counts.values()) for project_id, counts in summaries.items())
+
+
+def random_write(conn, rng):
+    # One insert, delete or move of a project, patient, sample, dataset, raw file or
+    # dataset size row
+    projects, patients, datasets = ids(conn, 'projects'), ids(conn, 'patients'), ids(conn, 'datasets')
+    table = rng.choice(['projects', 'patients', 'samples', 'datasets', 'raw_files', 'datasets_metadata', 'datasets_metadata'])
+    operation = rng.choice(['insert', 'insert', 'delete', 'move'])
+    rows = ids(conn, table)
+
+    if operation == 'delete' and rows:
+        conn.execute(f"DELETE FROM {table} WHERE id = ?", (rng.choice(rows),))
+    elif table == 'projects' and operation == 'insert':
+        conn.execute("INSERT INTO projects (name, status) VALUES ('Project', 'active')")
+    elif table == 'patients' and projects:
+        if operation == 'insert':
+            conn.execute("INSERT INTO patients (project_id, ext_patient_id) VALUES (?, ?)", (rng.choice(projects), f'P{rng.random()}'))
+        elif rows:
+            conn.execute("UPDATE patients SET project_id = ? WHERE id = ?", (rng.choice(projects), rng.choice(rows)))
+    elif table == 'samples' and patients:
+        if operation == 'insert':
+            conn.execute("INSERT INTO samples (patient_id, ext_sample_id) VALUES (?, ?)", (rng.choice(patients), f's{rng.random()}'))
+        elif rows:
+            conn.execute("UPDATE samples SET patient_id = ? WHERE id = ?", (rng.choice(patients), rng.choice(rows)))
+    elif table == 'datasets' and projects:
+        if operation == 'insert':
+            conn.execute("INSERT INTO datasets (project_id, name) VALUES (?, 'Dataset')", (rng.choice(projects),))
+        elif rows:
+            conn.execute("UPDATE datasets SET project_id = ? WHERE id = ?", (rng.choice(projects), rng.choice(rows)))
+    elif table == 'raw_files' and datasets:
+        if operation == 'insert':
+            conn.execute("INSERT INTO raw_files (dataset_id, path) VALUES (?, ?)", (rng.choice(datasets), f'/data/{rng.random()}'))
+        elif rows:
+            conn.execute("UPDATE raw_files SET dataset_id = ? WHERE id = ?", (rng.choice(datasets), rng.choice(rows)))
+    elif table == 'datasets_metadata' and datasets:
+        if operation == 'insert':
+            conn.execute('''
+                INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, ?, ?)
+                ON CONFLICT (dataset_id, key) DO UPDATE SET value = excluded.value
+            ''', (rng.choice(datasets), rng.choice([RAW_SIZE_KEY, 'other']), rng.choice(list(SIZES))))
+        elif rows:
+            conn.execute("UPDATE datasets_metadata SET dataset_id = ? WHERE id = ?", (rng.choice(datasets), rng.choice(rows)))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_project_summaries_match_a_recount(conn, seed):
+    result = generate_catalogue(conn, projects=3, patients=10, samples_per_patient=2, datasets=2, files_per_sample=2, seed=seed)
+    conn.executemany("INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, ?, '10MB')",
+                     [(dataset_id, RAW_SIZE_KEY) for dataset_id in result["dataset_ids"]])
+    # IntegrityError: a size row moved onto a dataset that already has one; nothing was written
+    check_random_writes(
+        conn, seed, random_write,
+        lambda conn: sorted(conn.execute(f"SELECT project_id, {', '.join(SUMMARY_COLUMNS)} FROM project_summaries")),
+        recount, ignore=sqlite3.IntegrityError)
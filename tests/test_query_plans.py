@@ -0,0 +1,45 @@
+import random
+
+from migrations import HOT_QUERIES, check_query_plans
+from synthetic import generate_catalogue
+
+
+def seed(conn):
+    # A catalogue shaped like a production one: several projects and datasets, thousands of
+    # samples and raw files, and rows in every table HOT_QUERIES reads
+    result = generate_catalogue(conn, projects=8, patients=250, samples_per_patient=2, patient_metadata_keys=3,
+                                sample_metadata_keys=5, datasets=3, files_per_sample=2, seed=1)
+    rng = random.Random(1)
+    conn.executemany("INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, ?, ?)",
+                     [(dataset_id, f'key_{n}', str(n)) for dataset_id in result["dataset_ids"] for n in range(50)])
+    conn.executemany("INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value) VALUES (?, 'checksum', ?)",
+                     [(raw_file_id, f'blake2b:{rng.getrandbits(128):032x}')
+                      for raw_file_id, in conn.execute("SELECT id FROM raw_files").fetchall()])
+    conn.executemany('''
+        INSERT INTO scan_jobs (dataset_id, directory, status, server_pid, created_at)
+        VALUES (?, '/data/raw', 'finished', 1, 0)
+    ''', [(rng.choice(result["dataset_ids"]),) for _ in range(2000)])
+    conn.commit()
+    # As the PRAGMA optimize after a later migration would
+    conn.execute('ANALYZE')
+
+
+def test_hot_queries_use_their_indexes(conn):
+    seed(conn)
+    assert check_query_plans(conn, min_rows=0) == []
+
+
+def test_every_hot_query_table_is_seeded(conn):
+    seed(conn)
+    for description, query, _, _ in HOT_QUERIES:
+        table = query.split(' FROM ')[1].split()[0]
+        assert conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] >= 1000, description
+
+
+def test_small_tables_are_not_flagged(conn):
+    conn.execute("INSERT INTO projects (name, status) VALUES ('Project', 'active')")
+    conn.execute("INSERT INTO datasets (project_id, name) VALUES (1, 'Dataset')")
+    conn.executemany("INSERT INTO raw_files (dataset_id, path) VALUES (1, ?)", [(f'data/{n}',) for n in range(20)])
+    conn.commit()
+    conn.execute('ANALYZE')
+    assert check_query_plans(conn) == []
@@ -0,0 +1,49 @@
+import gzip
+import json
+import os
+
+from raw_file_stats import compute_raw_file_stats
+
+
+def stored(conn):
+    rows = conn.execute('''
+        SELECT rf.path, m.metadata_key, m.metadata_value FROM raw_files rf
+        JOIN raw_files_metadata m ON m.raw_file_id = rf.id
+    ''').fetchall()
+    metadata = {}
+    for path, key, value in rows:
+        metadata.setdefault(path, {})[key] = value
+    return metadata
+
+
+def test_compute_raw_file_stats(conn, tmp_path):
+    (tmp_path / 'a.fastq.gz').write_bytes(gzip.compress(b'@r1\nACGT\n+\nIIII\n@r2\nAC\n+\nII\n'))
+    (tmp_path / 'b.counts.tsv').write_text('GeneID s1 s2\nG1 1 2\nG2 3 4\n\n')
+    (tmp_path / 'bad.fastq').write_text('@r1\nACGT\n+\n')
+    (tmp_path / 'notes.txt').write_text('not read')
+    conn.execute("INSERT INTO projects (name, status) VALUES ('Project', 'active')")
+    conn.execute("INSERT INTO datasets (project_id, name) VALUES (1, 'Dataset')")
+    conn.executemany("INSERT INTO raw_files (dataset_id, path) VALUES (1, ?)",
+                     [(name,) for name in ('a.fastq.gz', 'b.counts.tsv', 'bad.fastq', 'notes.txt', 'missing.fastq')])
+    conn.commit()
+
+    errors = []
+    counts = compute_raw_file_stats(conn, workers=1, root=str(tmp_path), onerror=lambda path, error: errors.append(path))
+    assert (counts["read"], counts["unchanged"], counts["skipped"], counts["failed"]) == (2, 0, 1, 2)
+    assert sorted(errors) == ['bad.fastq', 'missing.fastq']
+
+    metadata = stored(conn)
+    assert set(metadata) == {'a.fastq.gz', 'b.counts.tsv'}
+    assert {key: metadata['a.fastq.gz'][key] for key in ('read_count', 'base_count', 'min_read_length')} == \
+        {'read_count': '2', 'base_count': '6', 'min_read_length': '2'}
+    assert metadata['b.counts.tsv']['row_count'] == '2'
+    assert json.loads(metadata['b.counts.tsv']['column_totals']) == {'s1': 4, 's2': 6}
+
+    # Unchanged files are not read again; a changed one is
+    counts = compute_raw_file_stats(conn, workers=1, root=str(tmp_path))
+    assert (counts["read"], counts["unchanged"]) == (0, 2)
+    (tmp_path / 'b.counts.tsv').write_text('GeneID s1 s2\nG1 1 2\n')
+    os.utime(tmp_path / 'b.counts.tsv', ns=(1, 1))
+    counts = compute_raw_file_stats(conn, workers=1, root=str(tmp_path))
+    assert (counts["read"], counts["unchanged"]) == (1, 1)
+    assert stored(conn)['b.counts.tsv']['row_count'] == '1'
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+import scan_jobs
+
+
+@pytest.fixture
+def dataset(client, tmp_path):
+    # A dataset set up for scanning a directory of .fastq files named by sample
+    directory = tmp_path / 'root' / 'raw'
+    directory.mkdir(parents=True)
+    (directory / 'S1.fastq').write_text('@read\n')
+    conn = sqlite3.connect('data/data_redmane.db')
+    project_id = conn.execute("INSERT INTO projects (name, status) VALUES ('Project', 'active')").lastrowid
+    patient_id = conn.execute("INSERT INTO patients (project_id, ext_patient_id) VALUES (?, 'P1')", (project_id,)).lastrowid
+    conn.execute("INSERT INTO samples (patient_id, ext_sample_id) VALUES (?, 'S1')", (patient_id,))
+    dataset_id = conn.execute("INSERT INTO datasets (project_id, name) VALUES (?, 'Dataset')", (project_id,)).lastrowid
+    conn.executemany("INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, ?, ?)", [
+        (dataset_id, 'raw_file_directory', str(directory)),
+        (dataset_id, 'sample_info_stored', 'filename'),
+        (dataset_id, 'raw_file_extensions', '.fastq'),
+    ])
+    conn.commit()
+    conn.close()
+    return dataset_id
+
+
+def test_scan_jobs_are_refused_without_a_scan_root(client, dataset, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'SCAN_ROOT', None)
+    response = client.post('/scan_jobs/', json={"dataset_id": dataset})
+    assert response.status_code == 403
+    assert client.get('/scan_jobs/', params={"dataset_id": dataset}).json() == []
+
+
+def test_scan_jobs_stay_inside_the_scan_root(client, dataset, tmp_path, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'SCAN_ROOT', str(tmp_path / 'root'))
+    for directory in (str(tmp_path), str(tmp_path / 'root' / '..'), '/'):
+        response = client.post('/scan_jobs/', json={"dataset_id": dataset, "directory": directory})
+        assert response.status_code == 400, directory
+
+    response = client.post('/scan_jobs/', json={"dataset_id": dataset})
+    assert response.status_code == 200
+    job = wait_for_job(client, response.json()["id"])
+    assert job["status"] == 'succeeded' and job["files_registered"] == 1, job
+
+
+def wait_for_job(client, job_id):
+    deadline = time.monotonic() + 30
+    while (job := client.get(f'/scan_jobs/{job_id}').json())["status"] in ('queued', 'running'):
+        assert time.monotonic() < deadline, job
+        time.sleep(0.1)
+    return job
+
+
+def registered_paths(dataset_id):
+    conn = sqlite3.connect('data/data_redmane.db')
+    paths = {path for (path,) in conn.execute("SELECT path FROM raw_files WHERE dataset_id = ?", (dataset_id,))}
+    conn.close()
+    return paths
+
+
+def run_job(dataset_id, directory):
+    # Runs the job on this process, where os.scandir can be patched
+    conn = sqlite3.connect('data/data_redmane.db')
+    job_id = conn.execute("INSERT INTO scan_jobs (dataset_id, directory, server_pid, created_at) VALUES (?, ?, ?, ?)",
+                          (dataset_id, directory, os.getpid(), time.time())).lastrowid
+    conn.commit()
+    conn.close()
+    scan_jobs.run_scan_job('data/data_redmane.db', job_id)
+    conn = sqlite3.connect('data/data_redmane.db')
+    job = dict(zip(('status', 'error', 'files_removed'), conn.execute(
+        "SELECT status, error, files_removed FROM scan_jobs WHERE id = ?", (job_id,)).fetchone()))
+    conn.close()
+    return job
+
+
+@pytest.mark.parametrize('link', ['symlink', 'dotdot'])
+def test_scan_jobs_scan_the_resolved_directory(client, dataset, tmp_path, monkeypatch, link):
+    import main
+    monkeypatch.setattr(main, 'SCAN_ROOT', str(tmp_path / 'root'))
+    raw = os.path.realpath(tmp_path / 'root' / 'raw')
+    if link == 'symlink':
+        (tmp_path / 'root' / 'link').symlink_to(raw, target_is_directory=True)
+        directory = str(tmp_path / 'root' / 'link')
+    else:
+        (tmp_path / 'root' / 'other').mkdir()
+        directory = str(tmp_path / 'root' / 'other' / '..' / 'raw')
+
+    response = client.post('/scan_jobs/', json={"dataset_id": dataset, "directory": directory})
+    assert response.status_code == 200
+    assert response.json()["directory"] == raw
+    job = wait_for_job(client, response.json()["id"])
+    assert job["status"] == 'succeeded' and job["files_registered"] == 1, job
+    assert registered_paths(dataset) == {os.path.join(raw, 'S1.fastq')}
+
+
+def test_scan_jobs_skip_unreadable_directories(client, dataset, tmp_path, monkeypatch):
+    raw = os.path.realpath(tmp_path / 'root' / 'raw')
+    (tmp_path / 'root' / 'raw' / 'run1').mkdir()
+    (tmp_path / 'root' / 'raw' / 'run1' / 'S1_R1.fastq').write_text('@read\n')
+    (tmp_path / 'root' / 'raw' / 'run2').mkdir()
+    (tmp_path / 'root' / 'raw' / 'run2' / 'S1_R1.fastq').write_text('@read\n')
+    assert run_job(dataset, raw)["status"] == 'succeeded'
+    assert len(registered_paths(dataset)) == 3
+
+    # Permissions do not stop root, so listing run1 fails instead; run2's file is deleted
+    unreadable = os.path.join(raw, 'run1')
+    real_scandir = os.scandir
+
+    def scandir(path):
+        if path in (unreadable, unreadable_root):
+            raise PermissionError(13, 'Permission denied', path)
+        return real_scandir(path)
+
+    unreadable_root = None
+    monkeypatch.setattr(os, 'scandir', scandir)
+    os.remove(tmp_path / 'root' / 'raw' / 'run2' / 'S1_R1.fastq')
+    job = run_job(dataset, raw)
+    assert job["status"] == 'succeeded', job
+    assert job["error"] == f"Skipped 1 unreadable paths: {unreadable}"
+    assert job["files_removed"] == 1
+    assert registered_paths(dataset) == {os.path.join(raw, 'S1.fastq'), os.path.join(unreadable, 'S1_R1.fastq')}
+
+    # An unreadable directory to scan fails the job rather than passing for an empty one
+    unreadable_root = raw
+    job = run_job(dataset, raw)
+    assert job["status"] == 'failed' and 'Permission denied' in job["error"], job
+    assert len(registered_paths(dataset)) == 2
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from scanner import ScannedFile, file_extension, scan_tree
+
+
+def walk_files(directory, extensions=None):
+    # The os.walk pass file_report.py made before scan_tree
+    files = set()
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if (extensions is None or name.endswith(extensions)) and os.path.isfile(path):
+                stat = os.stat(path)
+                files.add(ScannedFile(path, stat.st_size, stat.st_mtime, file_extension(name), stat.st_ino))
+    return files
+
+
+@pytest.fixture
+def tree(tmp_path):
+    # Nested directories, files of several extensions and sizes, empty directories, a symlink
+    # to a directory and one to a file
+    for i in range(40):
+        directory = tmp_path.joinpath(*[f'd{i % n}' for n in (2, 3, 5)][:i % 4])
+        directory.mkdir(parents=True, exist_ok=True)
+        extension = ['.fastq', '.fastq.gz', '.tsv', '.FASTQ'][i % 4]
+        (directory / f'sample{i}{extension}').write_bytes(b'@' * i)
+    (tmp_path / 'empty' / 'deeper').mkdir(parents=True)
+    (tmp_path / 'linked').mkdir()
+    (tmp_path / 'linked' / 'hidden.fastq').write_bytes(b'@')
+    (tmp_path / 'd0' / 'to_linked').symlink_to(tmp_path / 'linked', target_is_directory=True)
+    (tmp_path / 'd0' / 'to_file.fastq').symlink_to(tmp_path / 'sample0.fastq')
+    return tmp_path
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+@pytest.mark.parametrize('extensions', [None, '.fastq', ('.fastq', '.fastq.gz')])
+def test_scan_tree_matches_os_walk(tree, workers, extensions):
+    scanned = list(scan_tree(str(tree), extensions, workers=workers))
+    assert len(scanned) == len(set(scanned))
+    assert set(scanned) == walk_files(str(tree), extensions)
+
+
+def test_scan_tree_extensions(tree):
+    extensions = {file.extension for file in scan_tree(str(tree))}
+    assert extensions == {'.fastq', '.fastq.gz', '.tsv', '.FASTQ'}
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_scan_tree_reports_unreadable_directories(tree, workers, monkeypatch):
+    # Permissions do not stop root, so the listing of one directory fails instead
+    unreadable = str(tree / 'd1')
+    real_scandir = os.scandir
+
+    def scandir(path):
+        if path == unreadable:
+            raise PermissionError(13, 'Permission denied', path)
+        return real_scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', scandir)
+    errors = []
+    scanned = set(scan_tree(str(tree), workers=workers, onerror=errors.append))
+
+    assert [error.filename for error in errors] == [unreadable]
+    expected = {file for file in walk_files(str(tree)) if not file.path.startswith(unreadable + os.sep)}
+    assert scanned == expected
+
+    # Without onerror the directory is skipped silently, as with os.walk
+    assert set(scan_tree(str(tree), workers=workers)) == expected
+
+
+def test_scan_tree_stops_early(tree):
+    scan = scan_tree(str(tree), workers=4)
+    first = next(scan)
+    scan.close()
+    assert os.path.isfile(first.path)
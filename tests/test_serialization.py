@@ -0,0 +1,90 @@
+import importlib
+import sqlite3
+from typing import List
+
+import pytest
+
+import serialization
+from cache import ResponseCache
+from serialization import dump_json, validating_serializer
+
+
+def endpoints(catalogue):
+    project_id = catalogue["project_ids"][0]
+    dataset_id = catalogue["dataset_ids"][0]
+    return [
+        ('/projects/', {}),
+        ('/patients_metadata/0', {"project_id": project_id}),
+        ('/patients_by_metadata/', {"project_id": project_id, "where": 'sex=Female'}),
+        ('/metadata_facets/samples', {"project_id": project_id}),
+        ('/samples/0', {"project_id": project_id}),
+        ('/samples_by_metadata/', {"project_id": project_id, "where": 'tissue=Liver'}),
+        ('/patients/0', {"project_id": project_id}),
+        ('/datasets/0', {"project_id": project_id}),
+        (f'/datasets_with_metadata/{dataset_id}', {"project_id": project_id}),
+        (f'/raw_files_with_metadata/{dataset_id}', {}),
+    ]
+
+
+@pytest.fixture
+def awkward_values(catalogue):
+    # Strings the two encoders could escape differently: non-ASCII, quotes, backslashes,
+    # control characters, HTML and a character outside the Basic Multilingual Plane
+    conn = sqlite3.connect('data/data_redmane.db')
+    values = ['Lebergewebe éè', '"quoted" \\ back', 'tab\tnew\nline\x01', '<b>&amp;</b>/', '\U0001f9ec', '  ', '']
+    sample_id = conn.execute("SELECT MIN(id) FROM samples").fetchone()[0]
+    patient_id = conn.execute("SELECT patient_id FROM samples WHERE id = ?", (sample_id,)).fetchone()[0]
+    conn.executemany("INSERT INTO samples_metadata (sample_id, key, value) VALUES (?, 'note', ?)",
+                     [(sample_id, value) for value in values])
+    conn.executemany("INSERT INTO patients_metadata (patient_id, key, value) VALUES (?, 'note', ?)",
+                     [(patient_id, value) for value in values])
+    conn.execute("UPDATE projects SET name = ? WHERE id = (SELECT MIN(id) FROM projects)", (values[0] + values[4],))
+    conn.commit()
+    conn.close()
+    return catalogue
+
+
+def test_validated_responses_are_byte_identical(client, awkward_values, monkeypatch):
+    import main
+
+    fast = {}
+    for path, params in endpoints(awkward_values):
+        response = client.get(path, params=params)
+        assert response.status_code == 200, path
+        fast[path] = response.content
+
+    # What REDMANE_VALIDATE_RESPONSES=1 gives: every module-level serializer validates
+    models = {'serialize_patients_with_samples': List[main.PatientWithSamples], 'serialize_facets': List[main.Facet],
+              'serialize_samples': List[main.Sample], 'serialize_patients_with_sample_counts': List[main.PatientWithSampleCount],
+              'serialize_projects': List[main.Project], 'serialize_datasets': List[main.Dataset],
+              'serialize_dataset_with_metadata': main.DatasetWithMetadata, 'serialize_raw_files': List[main.RawFileResponse]}
+    assert set(models) == {name for name in vars(main) if name.startswith('serialize_')}
+    for name, model in models.items():
+        monkeypatch.setattr(main, name, validating_serializer(model))
+    client.app.state.response_cache = ResponseCache()
+
+    for path, params in endpoints(awkward_values):
+        assert client.get(path, params=params).content == fast[path], path
+
+
+def test_validate_responses_setting(monkeypatch):
+    for value, validates in (('', False), ('0', False), ('1', True), ('yes', True)):
+        monkeypatch.setenv('REDMANE_VALIDATE_RESPONSES', value)
+        importlib.reload(serialization)
+        assert (serialization.serializer_for(List[int]) is not serialization.dump_json) == validates, value
+    monkeypatch.delenv('REDMANE_VALIDATE_RESPONSES')
+    importlib.reload(serialization)
+    assert serialization.serializer_for(List[int]) is serialization.dump_json
+
+
+def test_validating_serializer_rejects_rows_that_no_longer_match():
+    from pydantic import BaseModel, ValidationError
+
+    class Row(BaseModel):
+        id: int
+        name: str
+
+    rows = [{"id": 1, "name": 'a'}]
+    assert validating_serializer(List[Row])(rows) == dump_json(rows)
+    with pytest.raises(ValidationError):
+        validating_serializer(List[Row])([{"id": 1}])
@@ -0,0 +1,123 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from uploader import ChunkUploader, UploadError
+
+
+class FakeAPI(ThreadingHTTPServer):
+    """
+    An endpoint that applies each Idempotency-Key once, as the API does, and answers the
+    first attempts of chosen chunks with error statuses.
+    """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeAPIHandler)
+        self.lock = threading.Lock()
+        self.attempts = []          # (key, item count) per request
+        self.applied = {}           # key -> items
+        self.failures = {}          # chunk number -> statuses to answer with first
+        self.retry_after = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/add_raw_files/'
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        key = self.headers['Idempotency-Key']
+        items = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        number = int(key.rsplit('-', 1)[1])
+        with server.lock:
+            server.attempts.append((key, len(items)))
+            statuses = server.failures.get(number, [])
+            status = statuses.pop(0) if statuses else 200
+            if status == 200:
+                new = key not in server.applied
+                server.applied.setdefault(key, items)
+        if status != 200:
+            self.send_response(status)
+            if server.retry_after is not None:
+                self.send_header('Retry-After', str(server.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps({"status": 'success', "inserted": len(items) if new else 0,
+                           "skipped": 0 if new else len(items)}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def api():
+    server = FakeAPI()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_items_are_sent_in_chunks(api):
+    with ChunkUploader(api.url, chunk_size=100, concurrency=3, backoff=0.01) as uploader:
+        for n in range(1050):
+            uploader.add({"path": f'/data/{n}'})
+    assert uploader.totals == {"inserted": 1050, "skipped": 0}
+    assert (uploader.chunks, uploader.items, uploader.retries) == (11, 1050, 0)
+    keys = sorted(api.applied, key=lambda key: int(key.rsplit('-', 1)[1]))
+    assert keys == [f'{uploader.run_id}-{n}' for n in range(11)]
+    assert [item["path"] for key in keys for item in api.applied[key]] == [f'/data/{n}' for n in range(1050)]
+
+
+def test_failed_chunks_are_retried_with_their_key(api):
+    api.failures = {1: [503, 500], 4: [429], 6: [502, 504, 503]}
+    with ChunkUploader(api.url, chunk_size=10, concurrency=2, backoff=0.01) as uploader:
+        for n in range(75):
+            uploader.add({"path": f'/data/{n}'})
+    assert uploader.totals["inserted"] == 75 and uploader.retries == 6
+    attempts = {}
+    for key, count in api.attempts:
+        attempts[key] = attempts.get(key, 0) + 1
+    assert {int(key.rsplit('-', 1)[1]): count for key, count in attempts.items() if count > 1} == {1: 3, 4: 2, 6: 4}
+
+
+def test_retry_after_is_honoured(api):
+    api.failures = {0: [503]}
+    api.retry_after = 0
+    # A backoff this long would time the test out if Retry-After were ignored
+    with ChunkUploader(api.url, chunk_size=10, backoff=60) as uploader:
+        uploader.add({"path": '/data/1'})
+    assert uploader.retries == 1 and uploader.totals["inserted"] == 1
+
+
+def test_chunks_that_keep_failing_raise(api):
+    api.failures = {0: [503] * 3}
+    uploader = ChunkUploader(api.url, chunk_size=1, concurrency=1, attempts=3, backoff=0.01)
+    uploader.add({"path": '/data/1'})
+    with pytest.raises(UploadError, match='after 3 attempts: 503'):
+        uploader.close()
+    # Client errors are not retried
+    api.failures = {0: [422]}
+    uploader = ChunkUploader(api.url, chunk_size=1, backoff=0.01)
+    uploader.add({"path": '/data/1'})
+    with pytest.raises(Exception, match='422'):
+        uploader.flush()
+    with pytest.raises(Exception, match='422'):
+        uploader.add({"path": '/data/2'})
+    assert sum(1 for key, _ in api.attempts if key.startswith(uploader.run_id)) == 1
+
+
+@pytest.mark.parametrize('setting', ['chunk_size', 'concurrency', 'attempts'])
+def test_settings_below_one_are_refused(api, setting):
+    with pytest.raises(ValueError, match=setting):
+        ChunkUploader(api.url, **{setting: 0})